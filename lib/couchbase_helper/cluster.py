@@ -1,6 +1,7 @@
 from tasks.future import Future
 from tasks.taskmanager import TaskManager
 from tasks.task import *
+from couchbase_helper.query_compare import MAX_QUERIES_IN_FLIGHT
 import types
 
 
@@ -14,7 +15,8 @@ class Cluster(object):
     """An API for interacting with Couchbase clusters"""
 
     def __init__(self):
-        self.task_manager = TaskManager("Cluster_Thread")
+        self.task_manager = TaskManager("Cluster_Thread",
+                                        blocking_limits={"ESRunQueryCompare": MAX_QUERIES_IN_FLIGHT})
         self.task_manager.start()
 
     def async_create_default_bucket(self, bucket_params):
@@ -1,10 +1,17 @@
 import os, time, datetime
 import os.path
 import uuid
+import csv
+import heapq
+import marshal
+import shutil
+import atexit
+import tempfile
 from remote.remote_util import RemoteMachineShellConnection
 from lib.mc_bin_client import MemcachedClient
 from memcached.helper.data_helper import MemcachedClientHelper
 from membase.api.rest_client import RestConnection
+from couchbase_helper import vbucket_digest
 # constants used in this file only
 DELETED_ITEMS_FAILURE_ANALYSIS_FORMAT="\n1) Failure :: Deleted Items :: Expected {0}, Actual {1}"
 DELETED_ITEMS_SUCCESS_ANALYSIS_FORMAT="\n1) Success :: Deleted Items "
@@ -17,7 +24,12 @@ DELETED_ITEMS="deletedItems"
 UPDATED_ITEMS="updatedItems"
 LOGICAL_RESULT="logicalresult"
 RESULT="result"
+VBUCKET_RESULT="vbucketresult"
 MEMCACHED_PORT=11210
+# rows sorted in memory at a time when building a SortedDataSet
+SORT_RUN_SIZE=500000
+# keys listed per type of difference when comparing SortedDataSets
+MAX_REPORTED_ITEMS=10000
 
 class DataAnalysisResultAnalyzer:
     """ Class containing methods to help analyze results for data analysis """
@@ -52,6 +64,10 @@ class DataAnalysisResultAnalyzer:
             output+=o
             summary+=s
             logic=l and logic
+            if VBUCKET_RESULT in result[bucket]:
+                vbuckets=result[bucket][VBUCKET_RESULT]
+                for vbucket in sorted(vbuckets.keys()):
+                    output+="\n vbucket {0} :: {1}".format(vbucket,vbuckets[vbucket])
         return logic,summary,output
 
     def analyze_per_node_result(self,result,deletedItems = False,addedItems = False,updatedItems = False):
@@ -165,7 +181,10 @@ class DataAnalyzer(object):
         for bucket in sourceMap.keys():
             info1 = sourceMap[bucket]
             info2 = targetMap[bucket]
-            Result[bucket] = self.compare_data_maps(info1,info2,headerInfo,"key")
+            if isinstance(info1, SortedDataSet):
+                Result[bucket] = self.compare_sorted_data_sets(info1,info2,headerInfo)
+            else:
+                Result[bucket] = self.compare_data_maps(info1,info2,headerInfo,"key")
         return Result
 
     def compare_per_node_dataset(self,headerInfo,sourceMap,targetMap,comparisonMap=None):
@@ -299,13 +318,16 @@ class DataAnalyzer(object):
     def find_data_distribution(self,info):
         """ Method to extract data distribution from map info """
         distribution_map = {}
-        for key in info.keys():
-            data = info[key].split(",")
-            vbucket = data[len(data) - 1]
-            if vbucket in distribution_map.keys():
-                distribution_map[vbucket] += 1
-            else:
-                distribution_map[vbucket] = 1
+        if isinstance(info, SortedDataSet):
+            distribution_map = dict(info.vbucket_counts)
+        else:
+            for key in info.keys():
+                data = info[key].split(",")
+                vbucket = data[len(data) - 1]
+                if vbucket in distribution_map:
+                    distribution_map[vbucket] += 1
+                else:
+                    distribution_map[vbucket] = 1
         array  =  []
         total  = 0
         for key in distribution_map.keys():
@@ -345,27 +367,162 @@ class DataAnalyzer(object):
     def compare_data_maps(self,info1,info2,headerInfo,mainKey,comparisonMap=None):
         """ Method to help comparison of datasets """
         updatedItemsMap = {}
-        deletedItemsList = list(set(info1.keys()) - set(info2.keys()))
-        addedItemsList = list(set(info2.keys()) - set(info1.keys()))
-        for key in set(info1.keys()) & set(info2.keys()):
-            data1 = info1[key].split(",")
-            data2 = info2[key].split(",")
-            fields = headerInfo.split(",")
-            reason = {}
-            if len(data1) == len(data2):
-                for i in range(len(data1)):
-                    if comparisonMap != None and headerInfo[i] in comparisonMap.keys():
-                        self.compare_values(data1[i],data2[i],fields[i],reason,comparisonMap[headerInfo[i]])
-                    elif data1[i] !=  data2[i]:
-                        reason[fields[i]] = "Expected {0} :: Actual {1}".format(data1[i],data2[i])
-            else:
-                reason["number of value mismatch"] = "Number of values mismatch :: Expected values {0} \n Actual values {1}".format(data1,data2)
+        keys1 = set(info1)
+        keys2 = set(info2)
+        deletedItemsList = list(keys1 - keys2)
+        addedItemsList = list(keys2 - keys1)
+        fields = headerInfo.split(",")
+        for key in keys1 & keys2:
+            if comparisonMap == None and info1[key] == info2[key]:
+                continue
+            reason = self.compare_rows(info1[key].split(","),info2[key].split(","),headerInfo,fields,comparisonMap)
             if len(reason) > 0:
                 updatedItemsMap[key] = reason
         comparisonResult = {DELETED_ITEMS:deletedItemsList,ADD_ITEMS:addedItemsList,UPDATED_ITEMS:updatedItemsMap}
         logicalResult = {DELETED_ITEMS:(len(deletedItemsList) > 0),ADD_ITEMS:(len(addedItemsList) > 0),UPDATED_ITEMS:(len(updatedItemsMap) > 0)}
         return {LOGICAL_RESULT:logicalResult,RESULT:comparisonResult}
 
+    def compare_sorted_data_sets(self,dataSet1,dataSet2,headerInfo,comparisonMap=None):
+        """
+            Same as compare_data_maps for two SortedDataSets, done as a merge of
+            both files on key so memory use does not depend on the number of items.
+            At most MAX_REPORTED_ITEMS keys are listed per type of difference, the
+            counts per vbucket are in the VBUCKET_RESULT part of the output.
+        """
+        deletedItemsList = []
+        addedItemsList = []
+        updatedItemsMap = {}
+        vbuckets = {}
+        counts = {DELETED_ITEMS:0,ADD_ITEMS:0,UPDATED_ITEMS:0}
+        fields = headerInfo.split(",")
+
+        def record(type, vbucket):
+            counts[type] += 1
+            if vbucket not in vbuckets:
+                vbuckets[vbucket] = {DELETED_ITEMS:0,ADD_ITEMS:0,UPDATED_ITEMS:0}
+            vbuckets[vbucket][type] += 1
+            return counts[type] <= MAX_REPORTED_ITEMS
+
+        rows1 = iter(dataSet1)
+        rows2 = iter(dataSet2)
+        row1 = next(rows1, None)
+        row2 = next(rows2, None)
+        while row1 is not None or row2 is not None:
+            if row2 is None or (row1 is not None and row1[0] < row2[0]):
+                if record(DELETED_ITEMS, row1[2]):
+                    deletedItemsList.append(row1[0])
+                row1 = next(rows1, None)
+            elif row1 is None or row2[0] < row1[0]:
+                if record(ADD_ITEMS, row2[2]):
+                    addedItemsList.append(row2[0])
+                row2 = next(rows2, None)
+            else:
+                if comparisonMap != None or row1[3] != row2[3]:
+                    reason = self.compare_rows(row1[3],row2[3],headerInfo,fields,comparisonMap)
+                    if len(reason) > 0 and record(UPDATED_ITEMS, row1[2]):
+                        updatedItemsMap[row1[0]] = reason
+                row1 = next(rows1, None)
+                row2 = next(rows2, None)
+        comparisonResult = {DELETED_ITEMS:deletedItemsList,ADD_ITEMS:addedItemsList,UPDATED_ITEMS:updatedItemsMap}
+        logicalResult = {DELETED_ITEMS:(counts[DELETED_ITEMS] > 0),ADD_ITEMS:(counts[ADD_ITEMS] > 0),UPDATED_ITEMS:(counts[UPDATED_ITEMS] > 0)}
+        return {LOGICAL_RESULT:logicalResult,RESULT:comparisonResult,VBUCKET_RESULT:vbuckets}
+
+    def compare_rows(self,data1,data2,headerInfo,fields,comparisonMap=None):
+        """ Helper method returning the differences between the values of two rows """
+        reason = {}
+        if len(data1) == len(data2):
+            for i in range(len(data1)):
+                if comparisonMap != None and headerInfo[i] in comparisonMap.keys():
+                    self.compare_values(data1[i],data2[i],fields[i],reason,comparisonMap[headerInfo[i]])
+                elif data1[i] !=  data2[i]:
+                    reason[fields[i]] = "Expected {0} :: Actual {1}".format(data1[i],data2[i])
+        else:
+            reason["number of value mismatch"] = "Number of values mismatch :: Expected values {0} \n Actual values {1}".format(data1,data2)
+        return reason
+
+    def compare_active_replica_digests(self,activeDigests,replicaDigests,replicaNodes):
+        """
+            Method to compare per-vbucket digests of active and replica data
+
+            Paramters:
+
+            activeDigests, replicaDigests: {bucket: {node: {vbucket: digest}}} as given
+            by DataCollector.collect_vbucket_digests
+            replicaNodes: {bucket: {vbucket: [node, ...]}} as given by
+            DataCollector.collect_vbucket_replica_nodes
+
+            Returns:
+
+            {bucket: {vbucket: reason}} for every vbucket where a replica copy does not
+            match the active one, a node of replicaNodes has no copy of a vbucket with
+            items, or that is not active on exactly one node
+        """
+        Result = {}
+        for bucket in activeDigests.keys():
+            mismatches = {}
+            active = {}
+            for node, digests in activeDigests[bucket].iteritems():
+                for vbucket, digest in digests.iteritems():
+                    if vbucket in active:
+                        mismatches[vbucket] = "active on {0} and {1}".format(active[vbucket][0], node)
+                    active[vbucket] = (node, digest)
+            for node, digests in replicaDigests.get(bucket, {}).iteritems():
+                for vbucket, digest in digests.iteritems():
+                    if vbucket not in active:
+                        mismatches[vbucket] = "replica on {0} but no active copy".format(node)
+                        continue
+                    active_node, active_digest = active[vbucket]
+                    if digest["root"] != active_digest["root"]:
+                        mismatches[vbucket] = self.compare_digests(active_digest, digest,
+                                                                   active_node, node)
+            # no digest is made for a vbucket without rows, so an empty or
+            # missing replica copy only shows up against the vbucket map
+            replicas = replicaDigests.get(bucket, {})
+            for vbucket, (active_node, active_digest) in active.iteritems():
+                if active_digest["count"] == 0 or vbucket in mismatches:
+                    continue
+                for node in replicaNodes.get(bucket, {}).get(vbucket, []):
+                    if vbucket not in replicas.get(node, {}):
+                        mismatches[vbucket] = "no replica copy on {0}".format(node)
+                        break
+            Result[bucket] = mismatches
+        return Result
+
+    def compare_vbucket_digests(self,prevDigests,currDigests):
+        """
+            Method to compare two sets of per-vbucket digests of the same kind of data,
+            e.g. active data before and after a rebalance, wherever the vbuckets live
+
+            Returns:
+
+            {bucket: {vbucket: reason}} for every vbucket whose copies differ
+        """
+        Result = {}
+        for bucket in prevDigests.keys():
+            prev = self.merge_vbucket_digests(prevDigests[bucket])
+            curr = self.merge_vbucket_digests(currDigests.get(bucket, {}))
+            mismatches = {}
+            for vbucket in set(prev) | set(curr):
+                if prev.get(vbucket) != curr.get(vbucket):
+                    mismatches[vbucket] = "Expected {0} :: Actual {1}".format(prev.get(vbucket), curr.get(vbucket))
+            Result[bucket] = mismatches
+        return Result
+
+    def merge_vbucket_digests(self,nodeDigests):
+        """ Helper method returning {vbucket: sorted (count, root) of all copies} """
+        merged = {}
+        for digests in nodeDigests.values():
+            for vbucket, digest in digests.iteritems():
+                merged.setdefault(vbucket, set()).add((digest["count"], digest["root"]))
+        return dict((vbucket, sorted(copies)) for vbucket, copies in merged.iteritems())
+
+    def compare_digests(self,digest1,digest2,node1,node2):
+        """ Helper method describing how two digests of a vbucket differ """
+        leaves = [i for i in range(len(digest1["leaves"]))
+                  if digest1["leaves"][i] != digest2["leaves"][i]]
+        return "{0} items on {1}, {2} items on {3}, {4} of {5} key ranges differ"\
+            .format(digest1["count"], node1, digest2["count"], node2, len(leaves), len(digest1["leaves"]))
+
     def compare_values(self,val1,val2,key,reason,logic):
         """ Helper method to compare values """
         isFail=True
@@ -719,8 +876,8 @@ class DataCollector(object):
         revIdIndex = 5
         for value in dataInCSV:
             values = value.split(",")
-            if values[index] in bucketMap.keys():
-                prev_revId =  int(bucketMap[values[index]][revIdIndex])
+            if values[index] in bucketMap:
+                prev_revId =  int(bucketMap[values[index]].split(",")[revIdIndex])
                 new_revId = int(values[revIdIndex])
                 if prev_revId < new_revId:
                     bucketMap[values[index]] = value
@@ -732,6 +889,23 @@ class DataCollector(object):
                                                   userId="Administrator", password="password",
                                                   getReplica=False, mode = "memory"):
         """ Get Local CSV information :: method used when running simple tests only """
+        bucketMap = {}
+        headerInfo = ""
+        files = self.get_local_data_files_using_cbtransfer(server, buckets, data_path=data_path,
+                                                           userId=userId, password=password,
+                                                           getReplica=getReplica, mode=mode)
+        for bucket_name, dest_path in files.iteritems():
+            with open(dest_path) as f:
+                headerInfo = f.readline()
+                content = f.readlines()
+            bucketMap[bucket_name] = content
+            os.remove(dest_path)
+        return headerInfo, bucketMap
+
+    def get_local_data_files_using_cbtransfer(self, server, buckets, data_path=None,
+                                                    userId="Administrator", password="password",
+                                                    getReplica=False, mode = "memory"):
+        """ Run cbtransfer locally and return {bucket: path of the CSV dump} """
         temp_path = "/tmp/"
         replicaOption = ""
         prefix = str(uuid.uuid1())
@@ -744,10 +918,8 @@ class DataCollector(object):
         elif mode == "backup":
             source = data_path
             fileName =  ""
-        # Initialize Output
-        bucketMap = {}
-        headerInfo = ""
-        # Iterate per bucket and generate maps
+        files = {}
+        # Iterate per bucket and generate dumps
         for bucket in buckets:
             if data_path == None:
                 options = " -b " + bucket.name + " -u " + userId + " -p " + password + \
@@ -757,7 +929,7 @@ class DataCollector(object):
                                                                    " " + replicaOption
             suffix = "_" + bucket.name + "_N%2FA.csv"
             if mode == "memory" or mode == "backup":
-               suffix = "_" + bucket.name + "_" + self.ip + "%3A"+server.port+".csv"
+               suffix = "_" + bucket.name + "_" + server.ip + "%3A"+server.port+".csv"
             genFileName = prefix + suffix
             csv_path = temp_path + fileName
             dest_path = temp_path+"/"+genFileName
@@ -766,16 +938,190 @@ class DataCollector(object):
                                                    "/install/bin/cbtransfer"
             command = "{0} {1} {2} {3}".format(bin_path,source,destination,options)
             os.system(command)
-            file_existed = os.path.isfile(dest_path)
-            if file_existed:
-                content = []
-                headerInfo = ""
-                with open(dest_path) as f:
-                    headerInfo = f.readline()
-                    content = f.readlines()
-                bucketMap[bucket.name] = content
-                os.remove(dest_path)
-        return headerInfo, bucketMap
+            if os.path.isfile(dest_path):
+                files[bucket.name] = dest_path
+        return files
+
+    def collect_sorted_data(self, servers, buckets, userId="Administrator", password="password",
+                                                    data_path = None, getReplica = False, mode = "memory"):
+        """
+            Same as collect_data with perNode=False, but the union of the data of all nodes
+            is kept on local disk as one SortedDataSet per bucket instead of a map in memory.
+            The CSV dumps are never loaded as a whole, so memory use does not grow with the
+            number of items.
+
+            Returns:
+
+            headerInfo, {bucket: SortedDataSet}
+        """
+        writers = {}
+        for bucket in buckets:
+            writers[bucket.name] = SortedDataSetWriter()
+        for server in servers:
+            if  mode  ==  "disk" and data_path == None:
+                rest = RestConnection(server)
+                data_path = rest.get_data_path()
+            if  server.ip == "127.0.0.1":
+                files = self.get_local_data_files_using_cbtransfer(server, buckets,
+                                                      data_path=data_path,
+                                                      userId=userId,
+                                                      password=password,
+                                                      getReplica = getReplica,
+                                                      mode = mode)
+            else:
+                remote_client = RemoteMachineShellConnection(server)
+                files = remote_client.get_data_files_using_cbtransfer(buckets,
+                                                         data_path=data_path,
+                                                         userId=userId,
+                                                         password=password,
+                                                         getReplica = getReplica,
+                                                         mode = mode,
+                                                         local_dir = data_set_dir())
+                remote_client.disconnect()
+            for bucket_name, path in files.iteritems():
+                try:
+                    writers[bucket_name].add_csv_file(path)
+                finally:
+                    os.remove(path)
+        headerInfo = ""
+        completeMap = {}
+        for bucket_name, writer in writers.iteritems():
+            if writer.header:
+                headerInfo = writer.header
+            completeMap[bucket_name] = writer.close()
+        return headerInfo, completeMap
+
+    def collect_vbucket_digests(self, servers, buckets, userId="Administrator", password="password",
+                                                        data_path = None, getReplica = False, mode = "memory"):
+        """
+            Method to get per-vbucket digests of the data on every node, see
+            couchbase_helper/vbucket_digest.py. The digests are computed on the nodes,
+            so only a few KB per bucket and node are transferred.
+
+            Returns:
+
+            {bucket: {"ip:port": {vbucket: digest}}}, cluster_run nodes share an ip
+        """
+        completeMap = {}
+        for bucket in buckets:
+            completeMap[bucket.name] = {}
+        for server in servers:
+            if  mode  ==  "disk" and data_path == None:
+                rest = RestConnection(server)
+                data_path = rest.get_data_path()
+            if  server.ip == "127.0.0.1":
+                files = self.get_local_data_files_using_cbtransfer(server, buckets,
+                                                      data_path=data_path,
+                                                      userId=userId,
+                                                      password=password,
+                                                      getReplica = getReplica,
+                                                      mode = mode)
+                digests = {}
+                for bucket_name, path in files.iteritems():
+                    try:
+                        digests[bucket_name] = vbucket_digest.digest_csv(path)
+                    finally:
+                        os.remove(path)
+            else:
+                remote_client = RemoteMachineShellConnection(server)
+                digests = remote_client.get_vbucket_digests_using_cbtransfer(buckets,
+                                                         data_path=data_path,
+                                                         userId=userId,
+                                                         password=password,
+                                                         getReplica = getReplica,
+                                                         mode = mode)
+                remote_client.disconnect()
+            for bucket_name, bucket_digests in digests.iteritems():
+                completeMap[bucket_name]["{0}:{1}".format(server.ip, server.port)] = bucket_digests
+        return completeMap
+
+    def collect_vbucket_replica_nodes(self, servers, buckets):
+        """
+            Method to get the nodes the vbucket map of every bucket gives as replicas,
+            named as in collect_vbucket_digests. Replicas on nodes that are not in
+            servers are left out, their data is not collected.
+
+            Returns:
+
+            {bucket: {vbucket: ["ip:port", ...]}}
+        """
+        rest = RestConnection(servers[0])
+        keys = set("{0}:{1}".format(server.ip, server.port) for server in servers)
+        # the vbucket map names nodes by their memcached port
+        nodes = {}
+        for node in rest.get_nodes():
+            key = "{0}:{1}".format(node.ip, node.port)
+            if key in keys:
+                nodes["{0}:{1}".format(node.ip, node.memcached)] = key
+        completeMap = {}
+        for bucket in buckets:
+            server_map = rest.get_bucket_json(bucket.name)["vBucketServerMap"]
+            server_list = []
+            for host in server_map["serverList"]:
+                ip, port = host.rsplit(":", 1)
+                if ip == "127.0.0.1":
+                    ip = rest.ip
+                server_list.append(nodes.get("{0}:{1}".format(ip, port)))
+            replicas = {}
+            for vbucket, chain in enumerate(server_map["vBucketMap"]):
+                replicas[str(vbucket)] = [server_list[i] for i in chain[1:]
+                                          if i != -1 and server_list[i] is not None]
+            completeMap[bucket.name] = replicas
+        return completeMap
+
+    def collect_vbucket_rows(self, servers, buckets, vbuckets, userId="Administrator", password="password",
+                                                     data_path = None, getReplica = False, mode = "memory"):
+        """
+            Same as collect_sorted_data, but only for the rows of the given vbuckets
+            ({bucket: [vbucket, ...]}), which are filtered on the nodes
+
+            Returns:
+
+            headerInfo, {bucket: SortedDataSet}
+        """
+        writers = {}
+        for bucket in buckets:
+            writers[bucket.name] = SortedDataSetWriter()
+        buckets = [bucket for bucket in buckets if vbuckets.get(bucket.name)]
+        for server in servers:
+            if not buckets:
+                break
+            if  mode  ==  "disk" and data_path == None:
+                rest = RestConnection(server)
+                data_path = rest.get_data_path()
+            if  server.ip == "127.0.0.1":
+                files = self.get_local_data_files_using_cbtransfer(server, buckets,
+                                                      data_path=data_path,
+                                                      userId=userId,
+                                                      password=password,
+                                                      getReplica = getReplica,
+                                                      mode = mode)
+                for bucket_name, path in files.items():
+                    vbucket_digest.copy_vbucket_rows(path, vbuckets[bucket_name], path + ".rows")
+                    os.remove(path)
+                    files[bucket_name] = path + ".rows"
+            else:
+                remote_client = RemoteMachineShellConnection(server)
+                files = remote_client.get_vbucket_rows_using_cbtransfer(buckets, vbuckets,
+                                                         data_path=data_path,
+                                                         userId=userId,
+                                                         password=password,
+                                                         getReplica = getReplica,
+                                                         mode = mode,
+                                                         local_dir = data_set_dir())
+                remote_client.disconnect()
+            for bucket_name, path in files.iteritems():
+                try:
+                    writers[bucket_name].add_csv_file(path)
+                finally:
+                    os.remove(path)
+        headerInfo = ""
+        completeMap = {}
+        for bucket_name, writer in writers.iteritems():
+            if writer.header:
+                headerInfo = writer.header
+            completeMap[bucket_name] = writer.close()
+        return headerInfo, completeMap
 
     def get_kv_dump_from_backup_file(self, server, cli_command, cmd_ext,
                                      backup_dir, master_key, buckets):
@@ -848,3 +1194,116 @@ class DataCollector(object):
                     return views_output
                 else:
                     return False
+
+
+# SortedDataSet: the cbtransfer rows of one bucket in a local file, sorted by
+#   key and holding only the row with the highest revId of every key, so two
+#   data sets can be compared with a single merge pass.
+# SortedDataSetWriter: builds a SortedDataSet from any number of CSV dumps
+#   with an external merge sort, at most SORT_RUN_SIZE rows are in memory.
+
+_data_set_dir = None
+
+
+def data_set_dir():
+    """ Directory for data set files, removed when the process exits """
+    global _data_set_dir
+    if _data_set_dir is None:
+        _data_set_dir = tempfile.mkdtemp(prefix="data_analysis_")
+        atexit.register(shutil.rmtree, _data_set_dir, True)
+    return _data_set_dir
+
+
+def _read_records(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield marshal.load(f)
+            except EOFError:
+                return
+
+
+class SortedDataSet(object):
+    def __init__(self, path, header, count, vbucket_counts):
+        self.path = path
+        self.header = header
+        self.count = count
+        self.vbucket_counts = vbucket_counts
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """ Yields (key, revId, vbucket, fields) in key order """
+        for key, rev, vbucket, fields in _read_records(self.path):
+            yield key, -rev, vbucket, fields
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SortedDataSetWriter(object):
+    def __init__(self, directory=None, run_size=SORT_RUN_SIZE):
+        self.directory = directory or data_set_dir()
+        self.run_size = run_size
+        self.header = ""
+        self._rows = []
+        self._runs = []
+
+    def add_csv_file(self, path):
+        with open(path, "rb") as f:
+            header = f.readline()
+            if not header:
+                return
+            self.header = header
+            names = [name.strip() for name in next(csv.reader([header]))]
+            revIdIndex = names.index("rev") if "rev" in names else 5
+            vbucketIndex = names.index("vbid") if "vbid" in names else -1
+            for fields in csv.reader(f):
+                if not fields:
+                    continue
+                # the negated revId sorts the newest row of a key first
+                self._rows.append((fields[0], -int(fields[revIdIndex]),
+                                   fields[vbucketIndex], fields))
+                if len(self._rows) >= self.run_size:
+                    self._write_run()
+
+    def _new_file(self):
+        fd, path = tempfile.mkstemp(suffix=".dat", dir=self.directory)
+        return os.fdopen(fd, "wb"), path
+
+    def _write_run(self):
+        self._rows.sort()
+        f, path = self._new_file()
+        with f:
+            for row in self._rows:
+                marshal.dump(row, f)
+        self._runs.append(path)
+        self._rows = []
+
+    def close(self):
+        if self._runs and self._rows:
+            self._write_run()
+        if self._runs:
+            rows = heapq.merge(*[_read_records(path) for path in self._runs])
+        else:
+            self._rows.sort()
+            rows = self._rows
+        count = 0
+        vbucket_counts = {}
+        last_key = None
+        f, path = self._new_file()
+        with f:
+            for row in rows:
+                if row[0] == last_key:
+                    continue
+                last_key = row[0]
+                marshal.dump(row, f)
+                count += 1
+                vbucket_counts[row[2]] = vbucket_counts.get(row[2], 0) + 1
+        for run in self._runs:
+            os.remove(run)
+        self._runs = []
+        self._rows = []
+        return SortedDataSet(path, self.header, count, vbucket_counts)
@@ -0,0 +1,163 @@
+import copy
+import itertools
+import json
+import marshal
+from collections import OrderedDict
+from threading import Lock
+
+from documentgenerator import DocumentGenerator
+
+# DocumentCorpus: the keys and decoded documents one DocumentGenerator
+#   template produces over a range of its iterator, stored as two parallel
+#   lists. Documents are kept marshalled, which is compact and loads several
+#   times faster than json, and every caller gets its own copy to modify.
+#   Ranges that do not overlap an existing corpus get a corpus of their own.
+#   DocumentGenerator output only depends on the iterator position, so a
+#   corpus is shared by every generator with the same name, template and
+#   args no matter which start/end it was created with, and only the part of
+#   a requested range that is not cached yet gets generated.
+# DocumentCorpusCache: an LRU of corpora bounded by their approximate size.
+
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+# rough per-document overhead of two str objects and two list slots
+_DOC_OVERHEAD = 90
+
+
+class DocumentCorpus(object):
+    def __init__(self, gen):
+        self.gen = copy.deepcopy(gen)
+        self.start = gen.itr
+        self.end = gen.itr
+        self.keys = []
+        self.docs = []
+        self._data_size = 0
+        self._index = None
+
+    def _generate(self, start, end):
+        self.gen.itr = start
+        self.gen.end = end
+        keys, values = self.gen.next_batch(end - start)
+        return keys, [marshal.dumps(json.loads(value)) for value in values]
+
+    def _build_index(self):
+        self._index = {}
+        for pos, key in enumerate(self.keys):
+            self._index.setdefault(key, []).append(pos)
+
+    @property
+    def size(self):
+        size = self._data_size
+        if self._index is not None:
+            size += len(self.keys) * _DOC_OVERHEAD
+        return size
+
+    def extend(self, start, end):
+        """Makes sure the range start..end, which overlaps or touches the
+        cached one, is cached by generating only the missing documents."""
+        if start < self.start:
+            keys, docs = self._generate(start, self.start)
+            self.keys[:0] = keys
+            self.docs[:0] = docs
+            self._data_size += _size(keys, docs)
+            self.start = start
+            self._index = None
+        if end > self.end:
+            keys, docs = self._generate(self.end, end)
+            if self._index is not None:
+                for pos, key in enumerate(keys, len(self.keys)):
+                    self._index.setdefault(key, []).append(pos)
+            self.keys.extend(keys)
+            self.docs.extend(docs)
+            self._data_size += _size(keys, docs)
+            self.end = end
+
+    def items(self, start, end, keys=None):
+        """Returns (key, document) pairs for start..end in generation order,
+        only for the given keys if any are passed."""
+        lo = max(start, self.start) - self.start
+        hi = min(end, self.end) - self.start
+        if keys is None:
+            return [(self.keys[pos], marshal.loads(self.docs[pos]))
+                    for pos in xrange(lo, hi)]
+        if self._index is None:
+            self._build_index()
+        positions = set()
+        for key in keys:
+            for pos in self._index.get(key, ()):
+                if lo <= pos < hi:
+                    positions.add(pos)
+        return [(self.keys[pos], marshal.loads(self.docs[pos]))
+                for pos in sorted(positions)]
+
+
+def _size(keys, docs):
+    return sum(len(key) + len(doc) + _DOC_OVERHEAD
+               for key, doc in zip(keys, docs))
+
+
+class DocumentCorpusCache(object):
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._corpora = OrderedDict()
+        self._lock = Lock()
+        self._counter = itertools.count()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cacheable(gen):
+        # subclasses may override next() and random keys differ on every call
+        return type(gen) is DocumentGenerator and gen.name != "random_keys"
+
+    @staticmethod
+    def _template_id(gen):
+        return gen.name, gen.template, repr(gen.args)
+
+    def _find_corpus(self, template_id, start, end):
+        for corpus_id, corpus in self._corpora.iteritems():
+            if corpus_id[0] == template_id and start <= corpus.end and end >= corpus.start:
+                return corpus_id, corpus
+        return (template_id, next(self._counter)), None
+
+    def docs(self, gen, keys=None):
+        """Returns (key, json.loads(value)) for what a deep copy of gen would
+        generate from its current position, served from the cache."""
+        if gen.itr >= gen.end:
+            return []
+        with self._lock:
+            corpus_id, corpus = self._find_corpus(self._template_id(gen), gen.itr, gen.end)
+            if corpus is None:
+                corpus = DocumentCorpus(gen)
+                self.misses += 1
+            else:
+                del self._corpora[corpus_id]
+                if corpus.start <= gen.itr and gen.end <= corpus.end:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            corpus.extend(gen.itr, gen.end)
+            self._corpora[corpus_id] = corpus
+            self._evict()
+            return corpus.items(gen.itr, gen.end, keys)
+
+    def _evict(self):
+        # the most recently used corpus is kept even if it alone is too big
+        size = sum(corpus.size for corpus in self._corpora.itervalues())
+        while size > self.max_bytes and len(self._corpora) > 1:
+            corpus_id, corpus = self._corpora.popitem(last=False)
+            size -= corpus.size
+
+    def clear(self):
+        with self._lock:
+            self._corpora.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"corpora": len(self._corpora),
+                    "docs": sum(len(corpus.keys) for corpus in self._corpora.itervalues()),
+                    "bytes": sum(corpus.size for corpus in self._corpora.itervalues()),
+                    "hits": self.hits,
+                    "misses": self.misses}
+
+
+DOCS_CACHE = DocumentCorpusCache()
@@ -24,6 +24,19 @@ class KVGenerator(object):
     def reset(self):
         self.itr = self.start
 
+    def next_batch(self, count):
+        """Generates up to count documents at once.
+
+        Returns:
+            A list of keys and a list of values"""
+        keys = []
+        values = []
+        while len(keys) < count and self.has_next():
+            key, value = self.next()
+            keys.append(key)
+            values.append(value)
+        return keys, values
+
     def __iter__(self):
         return self
 
@@ -70,6 +83,12 @@ class DocumentGenerator(KVGenerator):
         if 'end' in kwargs:
             self.end = kwargs['end']
 
+        # with compiled=True the template is parsed once into a JSON skeleton
+        # and each document is joined from it, see _compile
+        self.compiled = kwargs.get('compiled', True)
+        self._compiled_for = None
+        self._skeleton = None
+
     """Creates the next generated document and increments the iterator.
 
     Returns:
@@ -77,23 +96,239 @@ class DocumentGenerator(KVGenerator):
     def next(self):
         if self.itr >= self.end:
             raise StopIteration
-        seed = self.itr
+        doc_id = self._doc_id(self.itr)
+        doc = None
+        if self.compiled:
+            doc = self._compiled_doc(self.itr, doc_id)
+        if doc is None:
+            doc = self._render(self.itr, doc_id)
+        self.itr += 1
+        return doc_id, doc
+
+    def next_batch(self, count):
+        """Generates up to count documents at once.
+
+        Returns:
+            A list of keys and a list of values"""
+        end = min(self.itr + count, self.end)
+        keys = []
+        values = []
+        compiled = self.compiled
+        for itr in xrange(self.itr, end):
+            doc_id = self._doc_id(itr)
+            doc = None
+            if compiled:
+                doc = self._compiled_doc(itr, doc_id)
+            if doc is None:
+                doc = self._render(itr, doc_id)
+            keys.append(doc_id)
+            values.append(doc)
+            self.itr = itr + 1
+        return keys, values
+
+    def _doc_id(self, itr):
+        if self.name == "random_keys":
+            """ This will generate a random ascii key with 12 characters """
+            return ''.join(choice(ascii_uppercase+ascii_lowercase+digits) \
+                                                                   for i in range(12))
+        return self.name + '-' + str(itr)
+
+    def _doc_args(self, itr):
+        seed = itr
         doc_args = []
         for arg in self.args:
             value = arg[seed % len(arg)]
             doc_args.append(value)
             seed /= len(arg)
-        doc = self.template.format(*doc_args).replace('\'', '"').replace('True',
+        return doc_args
+
+    @staticmethod
+    def _replace(text):
+        return text.replace('\'', '"').replace('True',
                              'true').replace('False', 'false').replace('\\', '\\\\')
+
+    def _render(self, itr, doc_id):
+        doc = self._replace(self.template.format(*self._doc_args(itr)))
         json_doc = json.loads(doc)
-        if self.name == "random_keys":
-            """ This will generate a random ascii key with 12 characters """
-            json_doc['_id'] = ''.join(choice(ascii_uppercase+ascii_lowercase+digits) \
-                                                                   for i in range(12))
-        else:
-            json_doc['_id'] = self.name + '-' + str(self.itr)
-        self.itr += 1
-        return json_doc['_id'], json.dumps(json_doc).encode("ascii", "ignore")
+        json_doc['_id'] = doc_id
+        return json.dumps(json_doc).encode("ascii", "ignore")
+
+    def _compiled_doc(self, itr, doc_id):
+        """Joins the document for itr from the compiled skeleton. Returns None
+        when the template can't be compiled or a value needs the full
+        format/loads/dumps path to come out the same."""
+        if self._compiled_for is None or self._compiled_for[0] is not self.template \
+                or self._compiled_for[1] is not self.args:
+            self._compiled_for = (self.template, self.args)
+            self._skeleton = None
+            skeleton = self._compile()
+            if skeleton is not None and self._verify(skeleton):
+                self._skeleton = skeleton
+        if self._skeleton is None:
+            return None
+        literals, slots, id_pos, caches, plain_id = self._skeleton
+        parts = [literals[0]]
+        seeds = []
+        seed = itr
+        for arg in self.args:
+            seeds.append(seed % len(arg))
+            seed /= len(arg)
+        for pos, (arg_index, in_string) in enumerate(slots):
+            if pos == id_pos:
+                parts.append('"' + doc_id + '"' if plain_id else json.dumps(doc_id))
+            else:
+                index = seeds[arg_index]
+                cache = caches[pos]
+                if index in cache:
+                    rendered = cache[index]
+                else:
+                    rendered = cache[index] = self._render_value(
+                        self.args[arg_index][index], in_string)
+                if rendered is None:
+                    return None
+                parts.append(rendered)
+            parts.append(literals[pos + 1])
+        return ''.join(parts)
+
+    def _render_value(self, value, in_string):
+        try:
+            text = self._replace(self.template[:0] + '{0}'.format(value))
+            if in_string:
+                return json.dumps(json.loads('"' + text + '"'))[1:-1]
+            return json.dumps(json.loads(text))
+        except Exception:
+            return None
+
+    def _compile(self):
+        """Splits the template into literal JSON text and value slots.
+
+        The template is formatted with a sentinel in every slot, run through
+        the usual replace/loads/dumps once, and the sentinels are located in
+        the output. A slot inside a JSON string is filled with the escaped
+        string content of its value, any other slot with the dumped value.
+        Templates that could come out differently when documents are built
+        one by one (format specs, slots in keys or not standing alone as a
+        JSON value, True/False spanning a slot) are not compiled."""
+        literals = ['']
+        slots = []
+        try:
+            for literal, field, spec, conversion in string.Formatter().parse(self.template):
+                literals[-1] += literal
+                if field is None:
+                    continue
+                if spec or conversion or not field.isdigit() or int(field) >= len(self.args):
+                    return None
+                slots.append(int(field))
+                literals.append('')
+        except ValueError:
+            return None
+        if not slots:
+            return None
+        word_chars = set('TrueFals')
+        for pos in range(len(slots)):
+            left, right = literals[pos], literals[pos + 1]
+            if (left and left[-1] in word_chars) or (right and right[0] in word_chars):
+                return None
+            if pos < len(slots) - 1 and not right:
+                return None
+        literals = [self._replace(literal) for literal in literals]
+
+        # find out whether each slot is inside a JSON string
+        in_string = False
+        contexts = []
+        for pos, literal in enumerate(literals):
+            escaped = False
+            for ch in literal:
+                if escaped:
+                    escaped = False
+                elif in_string and ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = not in_string
+            if pos == len(slots):
+                break
+            if in_string:
+                # the string must not be an object key
+                rest = ''.join(literals[pos + 1:])
+                escaped = False
+                for index, ch in enumerate(rest):
+                    if escaped:
+                        escaped = False
+                    elif ch == '\\':
+                        escaped = True
+                    elif ch == '"':
+                        break
+                else:
+                    return None
+                if rest[index + 1:].lstrip()[:1] == ':':
+                    return None
+            else:
+                before = literal.rstrip()[-1:]
+                after = literals[pos + 1].lstrip()[:1]
+                if before not in (':', ',', '[') or after not in (',', ']', '}'):
+                    return None
+            contexts.append(in_string)
+
+        sentinels = ['zqslot%dqz' % pos for pos in range(len(slots))]
+        probe = [literals[0]]
+        for pos, in_str in enumerate(contexts):
+            probe.append(sentinels[pos] if in_str else '"%s"' % sentinels[pos])
+            probe.append(literals[pos + 1])
+        try:
+            json_doc = json.loads(''.join(probe))
+            if not isinstance(json_doc, dict):
+                return None
+            json_doc['_id'] = 'zqdocidqz'
+            skeleton = json.dumps(json_doc).encode("ascii", "ignore")
+        except Exception:
+            return None
+
+        # cut the skeleton at the sentinels, the _id being one more slot
+        marks = []
+        for pos, in_str in enumerate(contexts):
+            mark = sentinels[pos] if in_str else '"%s"' % sentinels[pos]
+            if skeleton.count(mark) != 1:
+                return None
+            marks.append((skeleton.index(mark), len(mark), (slots[pos], in_str)))
+        if skeleton.count('"zqdocidqz"') != 1:
+            return None
+        marks.append((skeleton.index('"zqdocidqz"'), len('"zqdocidqz"'), None))
+        marks.sort()
+        out_literals = []
+        out_slots = []
+        offset = 0
+        id_pos = None
+        for start, length, slot in marks:
+            out_literals.append(skeleton[offset:start])
+            if slot is None:
+                id_pos = len(out_slots)
+                slot = (None, False)
+            out_slots.append(slot)
+            offset = start + length
+        out_literals.append(skeleton[offset:])
+        # keys made of the plain name and a number need no escaping
+        plain_id = isinstance(self.name, str) and \
+            json.dumps(self.name + '-0') == '"%s-0"' % self.name
+        return out_literals, out_slots, id_pos, [{} for _ in out_slots], plain_id
+
+    def _verify(self, skeleton):
+        """Checks the compiled output against the full path for the first
+        documents, in case the template does something _compile missed."""
+        saved = self._skeleton
+        self._skeleton = skeleton
+        try:
+            for itr in xrange(self.start, min(self.start + 20, self.end)):
+                doc_id = self.name + '-' + str(itr)
+                try:
+                    expected = self._render(itr, doc_id)
+                except Exception:
+                    continue
+                doc = self._compiled_doc(itr, doc_id)
+                if doc is not None and doc != expected:
+                    return False
+            return True
+        finally:
+            self._skeleton = saved
 
 class SubdocDocumentGenerator(KVGenerator):
     """ An idempotent document generator."""
@@ -183,6 +418,9 @@ class BatchedDocumentGenerator(object):
         return self._doc_gen.has_next()
 
     def next_batch(self):
+        if isinstance(self._doc_gen, KVGenerator):
+            keys, values = self._doc_gen.next_batch(self._batch_size)
+            return dict(zip(keys, values))
         count = 0
         key_val = {}
         while count < self._batch_size and self.has_next():
@@ -0,0 +1,100 @@
+import time
+import logger
+from threading import Condition
+
+log = logger.Logger.get_logger()
+
+# IndexStateTracker: waits for GSI indexes to reach a state. Every poll
+#   reads the state of all indexes from system:indexes in one query, and
+#   all threads waiting through the same tracker share that snapshot, so a
+#   wait for a hundred indexes costs as many queries as a wait for one.
+#   Polls back off exponentially from MIN_POLL_INTERVAL to MAX_POLL_INTERVAL.
+
+MIN_POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 8
+
+
+def index_online(state):
+    return state == "online"
+
+
+def index_built(state):
+    # the states the waits in N1QLHelper have always treated as done
+    return state is not None and state not in ["pending", "building", "deferred"]
+
+
+class IndexStateTracker(object):
+    def __init__(self, run_query, min_interval=MIN_POLL_INTERVAL,
+                 max_interval=MAX_POLL_INTERVAL):
+        self.run_query = run_query
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._cond = Condition()
+        self._polling = False
+        self._snapshot = {}
+        self._snapshot_time = 0
+        self.polls = 0
+
+    def _fetch(self):
+        res = self.run_query("SELECT * FROM system:indexes")
+        snapshot = {}
+        for item in res['results']:
+            index = item['indexes']
+            if 'keyspace_id' not in index:
+                continue
+            snapshot[(str(index['keyspace_id']), str(index['name']))] = index['state']
+        return snapshot
+
+    def snapshot(self, newer_than=0):
+        """Returns ({(bucket, index_name): state}, time) for all indexes as
+        read by a poll that started after newer_than. Only one thread polls,
+        the others wait for its snapshot."""
+        with self._cond:
+            while self._snapshot_time <= newer_than and self._polling:
+                self._cond.wait(1)
+            if self._snapshot_time > newer_than:
+                return self._snapshot, self._snapshot_time
+            self._polling = True
+        started = time.time()
+        snapshot = None
+        try:
+            snapshot = self._fetch()
+        finally:
+            with self._cond:
+                self._polling = False
+                if snapshot is not None:
+                    self.polls += 1
+                    self._snapshot = snapshot
+                    self._snapshot_time = started
+                self._cond.notify_all()
+        return snapshot, started
+
+    def wait(self, indexes, done, timeout=600):
+        """Waits until done(state) holds for every (bucket, index_name) in
+        indexes, where state is None for an index that does not exist.
+        Returns True then, or False after timeout seconds."""
+        pending = set((str(bucket), str(index_name)) for bucket, index_name in indexes)
+        end_time = time.time() + timeout
+        seen = time.time()
+        interval = self.min_interval
+        while True:
+            try:
+                snapshot, seen = self.snapshot(seen)
+                pending = set(index for index in pending if not done(snapshot.get(index)))
+            except Exception, ex:
+                # the query service may be busy with the builds, try again
+                log.info("reading system:indexes failed: {0}".format(ex))
+            if not pending:
+                return True
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                log.info("indexes not ready after {0} secs: {1}".format(timeout, sorted(pending)))
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.max_interval)
+
+    def wait_for_online(self, indexes, timeout=600):
+        return self.wait(indexes, index_online, timeout)
+
+    def wait_for_dropped(self, indexes, timeout=600):
+        return self.wait(indexes, lambda state: state is None, timeout)
@@ -0,0 +1,102 @@
+import itertools
+import json
+from collections import OrderedDict
+from threading import Condition, Thread
+
+from tasks.future import Future
+
+# OracleResultCache: the (hits, doc ids, time) results ESRunQueryCompare got
+#   from its oracle, ElasticSearchBase or the reference index, keyed by the
+#   query JSON, the index and the oracle's dataset_fingerprint(). That
+#   changes with every load, delete or mapping change, so the queries of an
+#   index run again on unchanged data, during and after a rebalance or on a
+#   retry, only go to FTS and N1QL. A query asked for while it runs waits
+#   for that run. The least recently used results are dropped once more
+#   than max_doc_ids doc ids are kept.
+# submit(): runs a call in a thread of its own and returns its Future, so
+#   the FTS, oracle and N1QL queries of one comparison overlap.
+
+# ESRunQueryCompare tasks a TaskManager runs at once, each has up to three
+# queries in flight
+MAX_QUERIES_IN_FLIGHT = 8
+MAX_CACHED_DOC_IDS = 10 * 1000 * 1000
+
+_dataset_versions = itertools.count(1)
+
+
+def dataset_version():
+    """A number no other call in this process returns, for oracles to
+    fingerprint their data with"""
+    return next(_dataset_versions)
+
+
+def submit(func, *args, **kwargs):
+    """Runs func(*args, **kwargs) in a new thread and returns its Future"""
+    future = Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception, ex:
+            future.set_exception(ex)
+    thread = Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+class OracleResultCache(object):
+    def __init__(self, max_doc_ids=MAX_CACHED_DOC_IDS):
+        self.max_doc_ids = max_doc_ids
+        self._cond = Condition()
+        self._results = OrderedDict()
+        self._running = set()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def result(self, oracle, index_name, query, run):
+        """run(), the (hits, doc ids, time) of query on index_name of
+        oracle, or what it returned for an earlier call on the same data"""
+        fingerprint = oracle.dataset_fingerprint(index_name)
+        key = (fingerprint, index_name, json.dumps(query, sort_keys=True))
+        with self._cond:
+            while key in self._running:
+                self._cond.wait(1)
+            result = self._results.pop(key, None)
+            if result is not None:
+                self.hits += 1
+                self._results[key] = result
+                return result
+            self.misses += 1
+            self._running.add(key)
+        result = None
+        try:
+            result = run()
+        finally:
+            # a result the data changed under may or may not include the change
+            keep = result is not None and \
+                oracle.dataset_fingerprint(index_name) == fingerprint
+            with self._cond:
+                self._running.discard(key)
+                if keep:
+                    self._results[key] = result
+                    self._size += len(result[1])
+                    while self._size > self.max_doc_ids and len(self._results) > 1:
+                        self._size -= len(self._results.popitem(last=False)[1][1])
+                self._cond.notify_all()
+        return result
+
+    def clear(self):
+        with self._cond:
+            self._results.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._cond:
+            return {"results": len(self._results), "doc_ids": self._size,
+                    "hits": self.hits, "misses": self.misses}
+
+
+ORACLE_RESULTS = OracleResultCache()
@@ -1,4 +1,3 @@
-import copy
 from documentgenerator import  DocumentGenerator
 import re
 import datetime
@@ -17,6 +16,7 @@ class TuqGenerators(object):
         self.log = log
         self.full_set = full_set
         self.query = None
+        self._compiled_clauses = {}
         self.type_args = {}
         self.nests = self._all_nested_objects(full_set[0])
         self.type_args['str'] = [attr[0] for attr in full_set[0].iteritems()
@@ -324,35 +324,57 @@ class TuqGenerators(object):
                         else:
                             select_clause = select_clause + '"%s" : %s,' %([at.replace('"','') for at in re.compile('"\w+"').findall(attr)][0], attr)
                     select_clause = select_clause + '}'
+        select_fn = self._compile_clause(select_clause)
+        result = iter(self.full_set)
         if where_clause:
-            result = [eval(select_clause) for doc in self.full_set if eval(where_clause)]
-        else:
-            result = [eval(select_clause) for doc in self.full_set]
+            where_fn = self._compile_clause(where_clause)
+            result = (doc for doc in result if where_fn(doc))
+        result = (select_fn(doc) for doc in result)
         if self.distinct:
             result = [dict(y) for y in set(tuple(x.items()) for x in result)]
         if unnest_clause:
+            unnest_fn = self._compile_clause(unnest_clause)
             unnest_attr = unnest_clause[5:-2]
             if unnest_attr in self.aliases:
-                def res_generator():
-                    for doc in result:
-                        doc_temp = copy.deepcopy(doc)
+                def res_generator(docs):
+                    for doc in docs:
+                        doc_temp = dict(doc)
                         del doc_temp[unnest_attr]
-                        for item in eval(unnest_clause):
-                            doc_to_append = copy.deepcopy(doc_temp)
-                            doc_to_append[unnest_attr] = copy.deepcopy(item)
+                        for item in unnest_fn(doc):
+                            doc_to_append = dict(doc_temp)
+                            doc_to_append[unnest_attr] = item
                             yield doc_to_append
-                result = list(res_generator())
+                result = res_generator(result)
             else:
-                result = [item for doc in result for item in eval(unnest_clause)]
-        if self._create_groups()[0]:
-            result = self._group_results(result)
+                result = (item for doc in result for item in unnest_fn(doc))
+        result = list(result)
+        attrs, groups = self._create_groups()
+        if attrs:
+            result = self._group_results(result, attrs, groups)
         if self.aggr_fns:
-            if not self._create_groups()[0] or len(result) == 0:
+            if not attrs or len(result) == 0:
                 for fn_name, params in self.aggr_fns.iteritems():
                     if fn_name == 'COUNT':
                         result = [{params['alias'] : len(result)}]
         return result
 
+    def _compile_clause(self, clause):
+        """Turns one of the generated python expressions over `doc` into a
+        function, so the clause is parsed once per query instead of once per
+        document. A clause that does not compile raises when it is called,
+        the same point at which eval() used to fail."""
+        fn = self._compiled_clauses.get(clause)
+        if fn is None:
+            try:
+                fn = eval('lambda doc: (%s\n)' % clause.strip(), globals())
+            except SyntaxError, ex:
+                def fn(doc, ex=ex):
+                    raise ex
+            if len(self._compiled_clauses) >= 256:
+                self._compiled_clauses.clear()
+            self._compiled_clauses[clause] = fn
+        return fn
+
     def _order_clause_greater_than_select(self, select_clause):
         order_clause = self._get_order_clause()
         if not order_clause:
@@ -439,8 +461,9 @@ class TuqGenerators(object):
                                                          if params['field'] == att_name[1:-1]][0])
             if order_clause.find(',"') != -1:
                 order_clause = order_clause.replace(',"', '"')
-            key = lambda doc: eval(order_clause)
         try:
+            if order_clause:
+                key = self._compile_clause(order_clause)
             result = sorted(result, key=key, reverse=reverse)
         except:
             return result
@@ -489,28 +512,32 @@ class TuqGenerators(object):
                 groups = set([doc[attrs[0]]  for doc in self.full_set])
         return attrs, groups
 
-    def _group_results(self, result):
-        attrs, groups = self._create_groups()
+    def _group_results(self, result, attrs, groups):
         for fn_name, params in self.aggr_fns.iteritems():
             if fn_name == 'COUNT':
+                counts = {}
+                for doc in result:
+                    group = (doc[attrs[0]], doc[attrs[1]])
+                    counts[group] = counts.get(group, 0) + 1
                 result = [{attrs[0] : group[0], attrs[1] : group[1],
-                                params['alias'] : len([doc for doc in result
-                                if doc[attrs[0]]==group[0] and doc[attrs[1]]==group[1]])}
-                          for group in groups]
-                result = [doc for doc in result if doc[params['alias']] > 0]
+                           params['alias'] : counts[group]}
+                          for group in groups if counts.get(group, 0) > 0]
             if fn_name == 'MIN':
+                values = {}
                 if isinstance(list(groups)[0], tuple):
+                    for doc in result:
+                        values.setdefault((doc[attrs[0]], doc[attrs[1]]), []).append(doc[params['field']])
                     result = [{attrs[0] : group[0], attrs[1] : group[1],
-                                    params['alias'] : min([doc[params['field']] for doc in result
-                                    if doc[attrs[0]]==group[0] and doc[attrs[1]]==group[1]])}
+                               params['alias'] : min(values.get(group, []))}
                               for group in groups]
                 else:
                     if attrs[0] in self.aliases.itervalues():
                         attrs[0] = self.get_alias_for(attrs[0]).replace(',', '')
+                    for doc in result:
+                        values.setdefault(doc[attrs[0]], []).append(doc[params['alias']])
                     result = [{attrs[0] : group,
-                                params['alias'] : min([doc[params['alias']] for doc in result
-                                if doc[attrs[0]]==group])}
-                          for group in groups]
+                               params['alias'] : min(values.get(group, []))}
+                              for group in groups]
         else:
             result = [dict(y) for y in set(tuple(x.items()) for x in result)]
         return result
@@ -8,13 +8,37 @@ import time
 import testconstants
 import datetime
 import time
+import Queue
+import threading
 from datetime import date
 from couchbase_helper.tuq_generators import TuqGenerators
+from couchbase_helper.index_tracker import IndexStateTracker, index_built
 from remote.remote_util import RemoteMachineShellConnection
 from membase.api.exception import CBQError, ReadDocumentException
 from membase.api.rest_client import RestConnection
 import copy
 
+# result values _canonical_value returns as they are
+_PLAIN_TYPES = frozenset([int, long, bool, str, unicode, type(None)])
+# statements run_cbq_queries keeps in flight by default
+MAX_QUERIES_IN_FLIGHT = 8
+
+# RestConnections to the query nodes, shared by all query tests so a
+# statement doesn't pay for RestConnection's nodes/self check. Their http
+# connections are kept alive in http_pool.
+_query_connections = {}
+_query_connections_lock = threading.Lock()
+
+
+def get_query_connection(server):
+    key = (server.ip, server.port, getattr(server, "rest_username", None),
+           getattr(server, "rest_password", None))
+    with _query_connections_lock:
+        if key not in _query_connections:
+            _query_connections[key] = RestConnection(server)
+        return _query_connections[key]
+
+
 class N1QLHelper():
     def __init__(self, version=None, master=None, shell=None,  max_verify=0, buckets=[], item_flag=0,
                  n1ql_port=8093, full_docs_list=[], log=None, input=None, database=None, use_rest=None):
@@ -30,6 +54,8 @@ class N1QLHelper():
         self.full_docs_list = full_docs_list
         self.master = master
         self.database = database
+        self._index_trackers = {}
+        self._index_trackers_lock = threading.Lock()
         if self.full_docs_list and len(self.full_docs_list) > 0:
             self.gen_results = TuqGenerators(self.log, self.full_docs_list)
 
@@ -145,9 +171,8 @@ class N1QLHelper():
                 query_params['scan_vector']= str(scan_vector).replace("'", '"')
             if verbose:
                 self.log.info('RUN QUERY %s' % query)
-            result = RestConnection(server).query_tool(query, self.n1ql_port, query_params=query_params, is_prepared = is_prepared, verbose = verbose)
+            result = get_query_connection(server).query_tool(query, self.n1ql_port, query_params=query_params, is_prepared = is_prepared, verbose = verbose)
         else:
-            shell = RemoteMachineShellConnection(server)
             url = "'http://%s:8093/query/service'" % server.ip
             cmd = "%s/cbq  -engine=http://%s:8093/" % (testconstants.LINUX_COUCHBASE_BIN_PATH, server.ip)
             query = query.replace('"', '\\"')
@@ -155,7 +180,12 @@ class N1QLHelper():
                 query = query.replace("'#primary'", '\\"#primary\\"')
             query = "select curl('POST', " + url + ", {'data' : 'statement=%s'})" % query
             print query
-            output = shell.execute_commands_inside(cmd, query, "", "", "", "", "")
+            # hands the ssh session back to the pool for the next statement
+            shell = RemoteMachineShellConnection(server)
+            try:
+                output = shell.execute_commands_inside(cmd, query, "", "", "", "", "")
+            finally:
+                shell.disconnect()
             print "-"*128
             print output
             new_curl = json.dumps(output[47:])
@@ -171,10 +201,52 @@ class N1QLHelper():
         self.log.info("TOTAL ELAPSED TIME: %s" % result["metrics"]["elapsedTime"])
         return result
 
-    def wait_for_all_indexes_online(self):
+    def run_cbq_queries(self, queries, server=None, query_params={}, scan_consistency=None,
+                        max_in_flight=MAX_QUERIES_IN_FLIGHT, verbose=False, raise_on_error=True):
+        """Runs the statements through run_cbq_query with at most max_in_flight
+        of them running at once and returns their results in the order of
+        queries. With raise_on_error=False the exception of a failed statement
+        is returned in its place, otherwise the first one is raised once all
+        statements are done."""
+        if not self.use_rest:
+            # cbq runs its statements from the same file on the node
+            max_in_flight = 1
+        results = [None] * len(queries)
+        pending = Queue.Queue()
+        for index, query in enumerate(queries):
+            pending.put((index, query))
+
+        def run():
+            while True:
+                try:
+                    index, query = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[index] = self.run_cbq_query(query=query, server=server, query_params=dict(query_params),
+                                                        scan_consistency=scan_consistency, verbose=verbose)
+                except Exception, ex:
+                    results[index] = ex
+
+        threads = []
+        for _ in xrange(min(max_in_flight, len(queries))):
+            t = threading.Thread(target=run)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def wait_for_all_indexes_online(self, timeout=12000):
         cur_indexes = self.get_parsed_indexes()
-        for index in cur_indexes:
-            self._wait_for_index_online(index['bucket'], index['name'])
+        indexes = [(index['bucket'], index['name']) for index in cur_indexes]
+        if not self.index_tracker().wait_for_online(indexes, timeout):
+            raise Exception('indexes are not online after %s secs' % timeout)
 
     def get_parsed_indexes(self):
         query_response = self.run_cbq_query("SELECT * FROM system:indexes")
@@ -189,26 +261,71 @@ class N1QLHelper():
         return current_indexes
 
     def _wait_for_index_online(self, bucket, index_name, timeout=12000):
-        end_time = time.time() + timeout
-        res = {}
-        while time.time() < end_time:
-            query = "SELECT * FROM system:indexes where name='%s'" % index_name
-            res = self.run_cbq_query(query)
-            for item in res['results']:
-                if 'keyspace_id' not in item['indexes']:
-                    self.log.error(item)
-                    continue
-                bucket_name = ""
-                if isinstance(bucket, str) or isinstance(bucket, unicode):
-                    bucket_name = bucket
-                else:
-                    bucket_name = bucket.name
-                if item['indexes']['keyspace_id'] == bucket_name:
-                    if item['indexes']['state'] == "online":
-                        return
-            time.sleep(timeout)
-        raise Exception('index %s is not online. last response is %s' % (index_name, res))
-
+        if not isinstance(bucket, (str, unicode)):
+            bucket = bucket.name
+        if not self.index_tracker().wait_for_online([(bucket, index_name)], timeout):
+            raise Exception('index %s is not online after %s secs' % (index_name, timeout))
+
+    def index_tracker(self, server=None):
+        """The IndexStateTracker for waits on server's system:indexes,
+        shared by the threads using this helper"""
+        if server is None:
+            server = self.master
+        with self._index_trackers_lock:
+            if server.ip not in self._index_trackers:
+                self._index_trackers[server.ip] = IndexStateTracker(
+                    lambda query: self.run_cbq_query(query=query, server=server, verbose=False))
+            return self._index_trackers[server.ip]
+
+    def _with_defer_build(self, statement):
+        if "defer_build" in statement:
+            return statement
+        match = re.search(r'\bWITH\s*\{\s*', statement, re.IGNORECASE)
+        if match is None:
+            return statement.rstrip().rstrip(";") + ' WITH {"defer_build":true}'
+        separator = "" if statement[match.end():].startswith("}") else ", "
+        return statement[:match.end()] + '"defer_build":true' + separator + statement[match.end():]
+
+    def create_indexes(self, bucket, index_statements, server=None, timeout=600):
+        """Creates the indexes of index_statements, which maps index names to
+        their CREATE INDEX statements on bucket, with defer_build, builds them
+        all with one BUILD INDEX and waits until they are online. Returns
+        whether they all came online within timeout."""
+        if server is None:
+            server = self.master
+        if not index_statements:
+            return True
+        for index_name in sorted(index_statements):
+            self.run_cbq_query(query=self._with_defer_build(index_statements[index_name]), server=server)
+        index_names = ["`%s`" % index_name for index_name in sorted(index_statements)]
+        self.run_cbq_query(query=self.gen_build_index_query("`%s`" % bucket, index_names), server=server)
+        return self.index_tracker(server).wait_for_online(
+            [(bucket, index_name) for index_name in index_statements], timeout)
+
+    def drop_indexes(self, bucket, index_statements, server=None, timeout=600):
+        """Runs the DROP INDEX statements of index_statements, which maps
+        index names on bucket to them, or drops the GSI indexes of a list of
+        names, and waits until they are gone from system:indexes. A failed
+        drop doesn't stop the others, its error is raised after the wait.
+        Returns whether all dropped indexes were gone within timeout."""
+        if server is None:
+            server = self.master
+        if not isinstance(index_statements, dict):
+            index_statements = dict((index_name, "DROP INDEX `%s`.`%s`" % (bucket, index_name))
+                                    for index_name in index_statements)
+        if not index_statements:
+            return True
+        errors = {}
+        for index_name in sorted(index_statements):
+            try:
+                self.run_cbq_query(query=index_statements[index_name], server=server)
+            except Exception, ex:
+                errors[index_name] = ex
+        dropped = self.index_tracker(server).wait_for_dropped(
+            [(bucket, index_name) for index_name in index_statements if index_name not in errors], timeout)
+        if errors:
+            raise Exception("drop index failed for %s" % errors)
+        return dropped
 
     def _verify_results(self, actual_result, expected_result, missing_count = 1, extra_count = 1):
         self.log.info(" Analyzing Actual Result")
@@ -239,9 +356,7 @@ class N1QLHelper():
             actual_result = []
         if check:
             actual_result = self._gen_dict(n1ql_result)
-
-        actual_result = sorted(actual_result)
-        expected_result = sorted(sql_result)
+        expected_result = sql_result
 
         if len(actual_result) != len(expected_result):
             extra_msg = self._get_failure_message(expected_result, actual_result)
@@ -249,6 +364,8 @@ class N1QLHelper():
 
         msg = "The number of rows match but the results mismatch, please check"
         if subquery:
+            actual_result = sorted(actual_result)
+            expected_result = sorted(expected_result)
             for x, y in zip(actual_result, expected_result):
                 if aggregate:
                     productId = x['ABC'][0]['$1']
@@ -267,15 +384,55 @@ class N1QLHelper():
                     extra_msg = self._get_failure_message(expected_result, actual_result)
                     raise Exception(msg+"\n "+extra_msg)
         else:
-            if self._sort_data(actual_result) != self._sort_data(expected_result):
-                extra_msg = self._get_failure_message(expected_result, actual_result)
+            missing, extra = self._result_multiset_difference(expected_result, actual_result)
+            if missing or extra:
+                extra_msg = "mismatch in results :: expected but not returned :: {0}, returned but not expected :: {1} "\
+                    .format(missing[:5], extra[:5])
                 raise Exception(msg+"\n "+extra_msg)
 
-    def _sort_data(self, result):
-        new_data = []
-        for data in result:
-            new_data.append(sorted(data))
-        return new_data
+    def _canonical_value(self, value):
+        """A hashable form of a result value in which the numbers sql and
+        n1ql return for the same value compare equal"""
+        value_type = type(value)
+        if value_type is dict:
+            canonical_value = self._canonical_value
+            return frozenset([(key, val if type(val) in _PLAIN_TYPES else canonical_value(val))
+                              for key, val in value.iteritems()])
+        if value_type is list:
+            return tuple([self._canonical_value(val) for val in value])
+        if value_type is float:
+            # sql results are rounded the same way when they are converted
+            value = round(value, 0)
+            try:
+                return int(value)
+            except (OverflowError, ValueError):
+                return value
+        return value
+
+    def _result_multiset_difference(self, expected_result, actual_result):
+        """Returns the rows of expected_result missing from actual_result and
+        the rows of actual_result not in expected_result, duplicates counted"""
+        canonical_value = self._canonical_value
+        counts = {}
+        for row in expected_result:
+            row = canonical_value(row)
+            counts[row] = counts.get(row, 0) + 1
+        extra = []
+        for row in actual_result:
+            canonical_row = canonical_value(row)
+            count = counts.get(canonical_row, 0)
+            if count:
+                counts[canonical_row] = count - 1
+            else:
+                extra.append(row)
+        missing = []
+        if extra or any(counts.itervalues()):
+            for row in expected_result:
+                canonical_row = canonical_value(row)
+                if counts.get(canonical_row, 0):
+                    counts[canonical_row] -= 1
+                    missing.append(row)
+        return missing, extra
 
     def _verify_results_crud_rqg(self, n1ql_result=[], sql_result=[], hints=["primary_key_id"]):
         new_n1ql_result = []
@@ -633,45 +790,17 @@ class N1QLHelper():
         return index_names
 
     def is_index_online_and_in_list(self, bucket, index_name, server=None, timeout=600.0):
-        check = self._is_index_in_list(bucket, index_name, server=server)
-        init_time = time.time()
-        while not check:
-            time.sleep(1)
-            check = self._is_index_in_list(bucket, index_name, server=server)
-            next_time = time.time()
-            if check or (next_time - init_time > timeout):
-                return check
-        return check
+        return self.index_tracker(server).wait([(bucket, index_name)], index_built, timeout)
 
     def is_index_ready_and_in_list(self, bucket, index_name, server=None, timeout=600.0):
-        query = "SELECT * FROM system:indexes where name = \'{0}\'".format(index_name)
-        if server is None:
-            server = self.master
-        init_time = time.time()
-        check = False
-        while not check:
-            res = self.run_cbq_query(query=query, server=server)
-            for item in res['results']:
-                if 'keyspace_id' not in item['indexes']:
-                    check = False
-                elif item['indexes']['keyspace_id'] == str(bucket) \
-                        and item['indexes']['name'] == index_name \
-                        and item['indexes']['state'] == "online":
-                    check = True
-            time.sleep(1)
-            next_time = time.time()
-            check = check or (next_time - init_time > timeout)
-        return check
+        self.index_tracker(server).wait_for_online([(bucket, index_name)], timeout)
+        # a timeout has never been reported as a failure here
+        return True
 
     def is_index_online_and_in_list_bulk(self, bucket, index_names=[], server=None, index_state="online", timeout=600.0):
-        check, index_names = self._is_index_in_list_bulk(bucket, index_names, server=server, index_state=index_state)
-        init_time = time.time()
-        while not check:
-            check, index_names = self._is_index_in_list_bulk(bucket, index_names, server=server, index_state=index_state)
-            next_time = time.time()
-            if check or (next_time - init_time > timeout):
-                return check
-        return check
+        return self.index_tracker(server).wait(
+            [(bucket, index_name) for index_name in index_names],
+            lambda state: state is not None and state not in index_state, timeout)
 
     def gen_build_index_query(self, bucket="default", index_list=[]):
         return "BUILD INDEX on {0}({1}) USING GSI".format(bucket, ",".join(index_list))
@@ -732,8 +861,8 @@ class N1QLHelper():
         map= {}
         if server is None:
             server = self.master
-        for bucket in buckets:
-            res = self.run_cbq_query(query=query.format(bucket.name), server=server)
+        results = self.run_cbq_queries([query.format(bucket.name) for bucket in buckets], server=server)
+        for bucket, res in zip(buckets, results):
             map[bucket.name] = int(res["results"][0]["$1"])
         return map
 
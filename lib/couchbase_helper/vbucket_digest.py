@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Per-vbucket digests of a cbtransfer CSV dump.
+
+Runs on a Couchbase node (python 2 or 3, standard library only) so that only
+the digests of a dump have to be sent back to the test client:
+
+    python vbucket_digest.py <dump.csv>
+        prints {vbucket: {"count": n, "root": hex, "leaves": [hex, ...]}} as JSON
+    python vbucket_digest.py <dump.csv> --rows <vb>[,<vb>...] <out.csv>
+        copies the header and the rows of the given vbuckets to out.csv
+
+Every row is hashed over key, revId, CAS and a hash of the value. A leaf is
+the sum of the row hashes of the keys that fall into it, so the digest does
+not depend on the order cbtransfer writes the rows in, and the root is a hash
+of the leaves, so two copies of a vbucket can be compared by root and the
+differing keys narrowed down by leaf."""
+
+import csv
+import hashlib
+import json
+import sys
+
+LEAVES = 8
+_MOD = 1 << 64
+
+
+def _open(path, mode):
+    if sys.version_info[0] >= 3:
+        return open(path, mode, newline='', encoding='utf-8', errors='surrogateescape')
+    return open(path, mode + 'b')
+
+
+def _bytes(text):
+    if sys.version_info[0] >= 3:
+        return text.encode('utf-8', 'surrogateescape')
+    return text
+
+
+def _columns(header):
+    names = [name.strip() for name in header]
+    def index(name, default):
+        if name in names:
+            return names.index(name)
+        return default
+    return index("id", 0), index("cas", 3), index("value", 4), index("rev", 5), index("vbid", -1)
+
+
+def digest_csv(path):
+    """Returns {vbucket: {"count": n, "root": hex, "leaves": [hex, ...]}}"""
+    sums = {}
+    counts = {}
+    with _open(path, 'r') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return {}
+        key_index, cas_index, value_index, rev_index, vb_index = _columns(header)
+        for fields in reader:
+            if not fields:
+                continue
+            key = _bytes(fields[key_index])
+            value_hash = hashlib.md5(_bytes(fields[value_index])).hexdigest()
+            row = b"\0".join([key, _bytes(fields[rev_index]), _bytes(fields[cas_index]),
+                              value_hash.encode('ascii')])
+            leaf = int(hashlib.md5(key).hexdigest()[:8], 16) % LEAVES
+            vbucket = fields[vb_index]
+            if vbucket not in sums:
+                sums[vbucket] = [0] * LEAVES
+                counts[vbucket] = 0
+            sums[vbucket][leaf] = (sums[vbucket][leaf] + int(hashlib.md5(row).hexdigest()[:16], 16)) % _MOD
+            counts[vbucket] += 1
+    digests = {}
+    for vbucket, leaves in sums.items():
+        leaves = ["%016x" % leaf for leaf in leaves]
+        root = hashlib.md5((",".join(leaves) + ",%d" % counts[vbucket]).encode('ascii')).hexdigest()
+        digests[vbucket] = {"count": counts[vbucket], "root": root, "leaves": leaves}
+    return digests
+
+
+def copy_vbucket_rows(path, vbuckets, out_path):
+    """Copies the header and the rows of the given vbuckets to out_path"""
+    vbuckets = set(vbuckets)
+    count = 0
+    with _open(path, 'r') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return 0
+        vb_index = _columns(header)[4]
+        with _open(out_path, 'w') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            writer.writerow(header)
+            for fields in reader:
+                if fields and fields[vb_index] in vbuckets:
+                    writer.writerow(fields)
+                    count += 1
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2:
+        sys.stdout.write(json.dumps(digest_csv(sys.argv[1])))
+    elif len(sys.argv) == 5 and sys.argv[2] == "--rows":
+        copy_vbucket_rows(sys.argv[1], sys.argv[3].split(","), sys.argv[4])
+    else:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
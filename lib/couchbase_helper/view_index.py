@@ -0,0 +1,84 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from threading import Lock
+
+from document_corpus import DOCS_CACHE
+
+# ExpectedViewIndex: the rows a view emits for a set of documents, sorted
+#   once by key and document id the way the view returns them, ascending
+#   and descending. key_bounds() finds the rows of a key range by binary
+#   search, so a query only looks at the rows it can return.
+# ExpectedViewIndexCache: indexes by map function, row shape and generator
+#   set, so the queries run against one view share the index built for the
+#   first of them. Only sets of generators DOCS_CACHE can serve are cached,
+#   their output depends on nothing but their template and range.
+
+MAX_VIEW_INDEXES = 8
+
+
+def cmp_result_rows(x, y):
+    rc = cmp(x['key'], y['key'])
+    if rc == 0:
+        # sort by id is tie breaker
+        rc = cmp(x['id'], y['id'])
+    return rc
+
+
+class ExpectedViewIndex(object):
+    def __init__(self, rows):
+        self.rows = sorted(rows, cmp=cmp_result_rows)
+        self.rows_desc = sorted(rows, cmp=cmp_result_rows, reverse=True)
+        self.keys = [row['key'] for row in self.rows]
+
+    def key_bounds(self, low, high, descending=False):
+        """(start, end) such that rows[start:end], or rows_desc[start:end]
+        when descending, are the rows with low <= key <= high"""
+        start = bisect_left(self.keys, low)
+        end = max(start, bisect_right(self.keys, high))
+        if descending:
+            return len(self.keys) - end, len(self.keys) - start
+        return start, end
+
+
+class ExpectedViewIndexCache(object):
+    def __init__(self, max_indexes=MAX_VIEW_INDEXES):
+        self.max_indexes = max_indexes
+        self._indexes = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _generators_id(doc_generators):
+        ids = []
+        for gen in doc_generators:
+            if not DOCS_CACHE.cacheable(gen):
+                return None
+            ids.append((DOCS_CACHE._template_id(gen), gen.itr, gen.end))
+        return tuple(ids)
+
+    def index(self, doc_generators, map_func, row_shape, emit_rows):
+        """The index of the rows emit_rows() returns for doc_generators,
+        built by the first caller for map_func and row_shape"""
+        generators_id = self._generators_id(doc_generators)
+        if generators_id is None:
+            return ExpectedViewIndex(emit_rows())
+        key = (generators_id, map_func, row_shape)
+        with self._lock:
+            index = self._indexes.pop(key, None)
+            if index is None:
+                self.misses += 1
+                index = ExpectedViewIndex(emit_rows())
+            else:
+                self.hits += 1
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+            return index
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+VIEW_INDEXES = ExpectedViewIndexCache()
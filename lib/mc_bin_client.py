@@ -126,6 +126,12 @@ class MemcachedClient(object):
         else:
             raise exceptions.EOFError("Timeout waiting for socket send. from {0}".format(self.host))
 
+    def pipeline(self, window=64):
+        """Return a MemcachedPipeline that keeps up to window requests in
+        flight on this connection. Don't mix pipelined and plain calls on
+        the same client while the pipeline has outstanding requests."""
+        return MemcachedPipeline(self, window)
+
 
 
 
@@ -182,15 +188,18 @@ class MemcachedClient(object):
         assert myopaque is None or opaque == myopaque, \
             "expected opaque %x, got %x" % (myopaque, opaque)
         if errcode != 0:
-            if self.error_map is None:
-                msg = rv
-            else:
-                err = self.error_map['errors'].get(errcode, rv)
-                msg = "{name} : {desc} : {rv}".format(rv=rv, **err)
-
-            raise MemcachedError(errcode,  msg)
+            raise self._error(errcode, rv)
         return cmd, opaque, cas, keylen, extralen, rv, frameextralen
 
+    def _error(self, errcode, rv):
+        if self.error_map is None:
+            msg = rv
+        else:
+            err = self.error_map['errors'].get(errcode, rv)
+            msg = "{name} : {desc} : {rv}".format(rv=rv, **err)
+
+        return MemcachedError(errcode,  msg)
+
     def _handleSingleResponse(self, myopaque):
         cmd, opaque, cas, keylen, extralen, data, frameextralen = self._handleKeyedResponse(myopaque)
         return opaque, cas, data
@@ -545,6 +554,10 @@ class MemcachedClient(object):
         else:
             extras = ''
         opaque, cas, data = self._doCmd(memcacheConstants.CMD_GET_META, key, '', extras, collection=collection)
+        return self._parseMeta(cas, data, request_extended_meta_data)
+
+    @staticmethod
+    def _parseMeta(cas, data, request_extended_meta_data=False):
         deleted = struct.unpack('>I', data[0:4])[0]
         flags = struct.unpack('>I', data[4:8])[0]
         exp = struct.unpack('>I', data[8:12])[0]
@@ -1088,6 +1101,193 @@ class MemcachedClient(object):
             except KeyError:
                 pass
 
+
+class MemcachedOp(object):
+    """Result handle for a request sent through a MemcachedPipeline."""
+
+    def __init__(self, pipeline, key, parse, callback=None):
+        self.pipeline = pipeline
+        self.key = key
+        self.parse = parse
+        self.callback = callback
+        self._done = False
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        return self._done
+
+    def _complete(self, result=None, exception=None):
+        self._result = result
+        self._exception = exception
+        self._done = True
+        if self.callback:
+            self.callback(self)
+
+    def exception(self):
+        """Wait for the response and return the MemcachedError, if any."""
+        if not self._done:
+            self.pipeline.wait(self)
+        return self._exception
+
+    def result(self):
+        """Wait for the response and return what the equivalent
+        MemcachedClient call returns, or raise its error."""
+        if not self._done:
+            self.pipeline.wait(self)
+        if self._exception:
+            raise self._exception
+        return self._result
+
+
+class MemcachedPipeline(object):
+    """Keeps a window of requests in flight on one MemcachedClient connection.
+
+    Requests are tagged with their own opaque and responses are matched back
+    to the MemcachedOp that sent them, so the caller pays one round trip per
+    window instead of one per op. Responses are read into a reusable buffer
+    with recv_into. All I/O happens in the calling thread: when the window is
+    full, or when result()/wait()/drain() is called, responses are read until
+    there is room or the op is done."""
+
+    RECV_BUFFER_SIZE = 256 * 1024
+
+    def __init__(self, client, window=64):
+        self.client = client
+        self.window = max(1, window)
+        self._inflight = {}
+        self._opaque = client.r.randint(0, 2 ** 31)
+        self._buf = bytearray(self.RECV_BUFFER_SIZE)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def _next_opaque(self):
+        self._opaque = (self._opaque + 1) & 0xffffffff
+        return self._opaque
+
+    def _submit(self, cmd, key, val, extra, cas, vbucket, collection, parse, callback):
+        while len(self._inflight) >= self.window:
+            self._read()
+        client = self.client
+        collection = client.collection_name(collection)
+        client._set_vbucket(key, vbucket, collection=collection)
+        wire_key = key
+        if collection:
+            wire_key = client._encodeCollectionId(key, collection)
+        opaque = self._next_opaque()
+        msg = struct.pack(REQ_PKT_FMT, REQ_MAGIC_BYTE, cmd, len(wire_key), len(extra), 0,
+                          client.vbucketId, len(wire_key) + len(extra) + len(val), opaque, cas)
+        op = MemcachedOp(self, key, parse, callback)
+        self._inflight[opaque] = op
+        _, w, _ = select.select([], [client.s], [], client.timeout)
+        if not w:
+            raise exceptions.EOFError("Timeout waiting for socket send. from {0}".format(client.host))
+        client.s.sendall(msg + extra + wire_key + val)
+        return op
+
+    def set(self, key, exp, flags, val, vbucket=-1, collection=None, callback=None):
+        return self._submit(memcacheConstants.CMD_SET, key, val, struct.pack(SET_PKT_FMT, flags, exp),
+                            0, vbucket, collection, lambda opaque, cas, klen, elen, data: (opaque, cas, data), callback)
+
+    def get(self, key, vbucket=-1, collection=None, callback=None):
+        return self._submit(memcacheConstants.CMD_GET, key, '', '', 0, vbucket, collection,
+                            lambda opaque, cas, klen, elen, data: (struct.unpack(
+                                memcacheConstants.GET_RES_FMT, data[:4])[0], cas, data[4:]),
+                            callback)
+
+    def getr(self, key, vbucket=-1, collection=None, callback=None):
+        return self._submit(memcacheConstants.CMD_GET_REPLICA, key, '', '', 0, vbucket, collection,
+                            lambda opaque, cas, klen, elen, data: (struct.unpack(
+                                memcacheConstants.GET_RES_FMT, data[:4])[0], cas, data[elen + klen:]),
+                            callback)
+
+    def delete(self, key, cas=0, vbucket=-1, collection=None, callback=None):
+        return self._submit(memcacheConstants.CMD_DELETE, key, '', '', cas, vbucket, collection,
+                            lambda opaque, cas, klen, elen, data: (opaque, cas, data), callback)
+
+    def touch(self, key, exp, vbucket=-1, collection=None, callback=None):
+        return self._submit(memcacheConstants.CMD_TOUCH, key, '', struct.pack(TOUCH_PKT_FMT, exp),
+                            0, vbucket, collection,
+                            lambda opaque, cas, klen, elen, data: (opaque, cas, data), callback)
+
+    def getMeta(self, key, request_extended_meta_data=False, vbucket=-1, collection=None,
+                callback=None):
+        extras = struct.pack('>B', 1) if request_extended_meta_data else ''
+        return self._submit(memcacheConstants.CMD_GET_META, key, '', extras, 0, vbucket, collection,
+                            lambda opaque, cas, klen, elen, data: MemcachedClient._parseMeta(
+                                cas, data, request_extended_meta_data),
+                            callback)
+
+    def wait(self, op):
+        while not op.done():
+            if not self._inflight:
+                raise exceptions.RuntimeError("op for key {0} is not in flight".format(op.key))
+            self._read()
+
+    def drain(self):
+        """Wait for every outstanding response."""
+        while self._inflight:
+            self._read()
+
+    def _fill(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buf):
+            pending = self._end - self._start
+            if self._start == 0:
+                # a single response larger than the buffer
+                self._view = None
+                self._buf.extend(bytearray(len(self._buf)))
+                self._view = memoryview(self._buf)
+            else:
+                self._buf[0:pending] = self._buf[self._start:self._end]
+                self._start, self._end = 0, pending
+        client = self.client
+        r, _, _ = select.select([client.s], [], [], client.timeout)
+        if not r:
+            raise exceptions.EOFError("Timeout waiting for socket recv. from {0}".format(client.host))
+        n = client.s.recv_into(self._view[self._end:])
+        if n == 0:
+            raise exceptions.EOFError("Got empty data (remote died?). from {0}".format(client.host))
+        self._end += n
+
+    def _read(self):
+        """Read until at least one complete response has been dispatched."""
+        while True:
+            available = self._end - self._start
+            if available >= MIN_RECV_PACKET:
+                remaining = struct.unpack_from(">I", self._buf, self._start + 8)[0]
+                if available >= MIN_RECV_PACKET + remaining:
+                    self._dispatch()
+                    return
+            self._fill()
+
+    def _dispatch(self):
+        start = self._start
+        magic = self._buf[start]
+        if magic in (ALT_RES_MAGIC_BYTE, ALT_REQ_MAGIC_BYTE):
+            _, _, frameextralen, keylen, extralen, _, errcode, remaining, opaque, cas = \
+                struct.unpack_from(ALT_RES_PKT_FMT, self._buf, start)
+        else:
+            _, _, keylen, extralen, _, errcode, remaining, opaque, cas = \
+                struct.unpack_from(RES_PKT_FMT, self._buf, start)
+        body_start = start + MIN_RECV_PACKET
+        data = str(self._buf[body_start:body_start + remaining])
+        self._start = body_start + remaining
+        op = self._inflight.pop(opaque, None)
+        if op is None:
+            self.client.log.warn("dropping response with unknown opaque {0}".format(opaque))
+            return
+        if errcode != 0:
+            op._complete(exception=self.client._error(errcode, data))
+        else:
+            op._complete(result=op.parse(opaque, cas, keylen, extralen, data))
+
+
 def error_to_str(errno):
     if errno == 0x01:
         return "Not found"
@@ -0,0 +1,187 @@
+import time
+import errno
+import socket
+import httplib
+import urlparse
+import httplib2
+import logger
+from threading import Condition, Lock
+
+log = logger.Logger.get_logger()
+
+# HttpConnectionPool: a bounded set of keep-alive httplib2.Http objects for
+#   one scheme://host:port. RestConnection instances talking to the same
+#   endpoint share the pool via get_pool()/request(), so polling loops reuse
+#   open sockets instead of doing a TCP handshake for every call.
+
+MAX_CONNECTIONS_PER_HOST = 8
+IDLE_TIMEOUT = 30
+
+
+class HttpConnectionPool(object):
+    def __init__(self, authority, max_size=MAX_CONNECTIONS_PER_HOST,
+                 idle_timeout=IDLE_TIMEOUT):
+        self.authority = authority
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._cond = Condition()
+        # idle entries are [http, last_used]; the most recently used is last
+        self._idle = []
+        self._size = 0
+        self.requests = 0
+        self.reused = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.evicted = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _evict_idle(self, now):
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            http, _ = self._idle.pop(0)
+            self._close(http)
+            self._size -= 1
+            self.evicted += 1
+
+    def acquire(self):
+        with self._cond:
+            start = None
+            while True:
+                now = time.time()
+                self._evict_idle(now)
+                if self._idle:
+                    http = self._idle.pop()[0]
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    http = httplib2.Http()
+                    break
+                if start is None:
+                    start = now
+                    self.waits += 1
+                self._cond.wait(1)
+            if start is not None:
+                self.wait_time += time.time() - start
+            return http
+
+    def release(self, http, discard=False):
+        with self._cond:
+            if discard:
+                self._close(http)
+                self._size -= 1
+            else:
+                self._idle.append([http, time.time()])
+            self._cond.notify()
+
+    @staticmethod
+    def _close(http):
+        for conn in http.connections.values():
+            try:
+                conn.close()
+            except Exception:
+                pass
+        http.connections.clear()
+
+    @staticmethod
+    def _is_connected(http):
+        for conn in http.connections.values():
+            if conn.sock is not None:
+                return True
+        return False
+
+    @staticmethod
+    def _set_timeout(http, timeout):
+        http.timeout = timeout
+        for conn in http.connections.values():
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+
+    @staticmethod
+    def _is_stale(error):
+        """Whether error is a kept-alive socket the server had closed, the
+        only failure safe to resend a POST after. Anything else, a timeout
+        above all, may come after the server acted on the request. httplib2
+        itself resends once on a stale socket that returned no status line."""
+        if isinstance(error, socket.timeout) or not isinstance(error, socket.error):
+            return False
+        return error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+    def request(self, uri, method="GET", body=None, headers=None, timeout=120):
+        http = self.acquire()
+        discard = True
+        try:
+            self._set_timeout(http, timeout)
+            reused = self._is_connected(http)
+            with self._cond:
+                self.requests += 1
+                if reused:
+                    self.reused += 1
+                else:
+                    self.connects += 1
+            try:
+                response, content = http.request(uri, method, body, headers)
+            except (socket.error, httplib.HTTPException), e:
+                if not (reused and self._is_stale(e)):
+                    raise
+                # the server closed a kept-alive socket, retry once on a new one
+                log.debug("connection to {0} was reset, reconnecting".format(self.authority))
+                self._close(http)
+                with self._cond:
+                    self.reconnects += 1
+                    self.connects += 1
+                response, content = http.request(uri, method, body, headers)
+            discard = False
+            return response, content
+        finally:
+            self.release(http, discard)
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.pop()[0])
+                self._size -= 1
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size,
+                    "idle": len(self._idle),
+                    "requests": self.requests,
+                    "reused": self.reused,
+                    "connects": self.connects,
+                    "reconnects": self.reconnects,
+                    "evicted": self.evicted,
+                    "waits": self.waits,
+                    "wait_time": self.wait_time}
+
+
+_pools = {}
+_pools_lock = Lock()
+
+
+def get_pool(uri):
+    scheme, netloc = urlparse.urlsplit(uri)[:2]
+    key = "{0}://{1}".format(scheme, netloc)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = HttpConnectionPool(key)
+        return _pools[key]
+
+
+def request(uri, method="GET", body=None, headers=None, timeout=120):
+    """Drop-in for httplib2.Http(timeout=timeout).request(uri, method, body, headers)
+    that goes through the shared pool for the uri's host and port."""
+    return get_pool(uri).request(uri, method, body, headers, timeout)
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = _pools.items()
+    return dict((key, pool.stats()) for key, pool in pools)
+
+
+def close_all():
+    with _pools_lock:
+        pools = _pools.values()
+    for pool in pools:
+        pool.close()
@@ -20,8 +20,9 @@ try:
 except ImportError:
     from lib.couchbase_helper.document import DesignDocument, View
 
-from memcached.helper.kvstore import KVStore
+from memcached.helper.kvstore import create_kv_store
 from exception import ServerAlreadyJoinedException, ServerUnavailableException, InvalidArgumentException
+from membase.api import http_pool
 from membase.api.exception import BucketCreationException, ServerSelfJoinException, ClusterRemoteException, \
     RebalanceFailedException, FailoverFailedException, DesignDocCreationException, QueryViewException, \
     ReadDocumentException, GetBucketInfoFailed, CompactViewFailed, SetViewInfoNotFound, AddNodeException, \
@@ -820,8 +821,8 @@ class RestConnection(object):
         count = 1
         while True:
             try:
-                response, content = httplib2.Http(timeout=timeout).request(api, method,
-                                                                           params, headers)
+                response, content = http_pool.request(api, method, params, headers,
+                                                      timeout=timeout)
                 if response['status'] in ['200', '201', '202']:
                     return True, content, response
                 else:
@@ -3332,64 +3333,57 @@ class RestConnection(object):
 
     '''Start Monitoring/Profiling Rest Calls'''
     def set_completed_requests_collection_duration(self, server, min_time):
-        http = httplib2.Http()
         n1ql_port = 8093
         api = "http://%s:%s/" % (server.ip, n1ql_port) + "admin/settings"
         body = {"completed-threshold": min_time}
         headers = self._create_headers_with_auth('Administrator','password')
-        response,content = http.request(api, "POST", headers=headers, body=json.dumps(body))
+        response,content = http_pool.request(api, "POST", headers=headers, body=json.dumps(body))
         return response,content
 
     def set_completed_requests_max_entries(self, server, no_entries):
-        http = httplib2.Http()
         n1ql_port = 8093
         api = "http://%s:%s/" % (server.ip, n1ql_port) + "admin/settings"
         body = {"completed-limit": no_entries}
         headers = self._create_headers_with_auth('Administrator','password')
-        response,content = http.request(api, "POST", headers=headers, body=json.dumps(body))
+        response,content = http_pool.request(api, "POST", headers=headers, body=json.dumps(body))
         return response,content
 
     def set_profiling(self, server, setting):
-        http = httplib2.Http()
         n1ql_port = 8093
         api = "http://%s:%s/" % (server.ip, n1ql_port) + "admin/settings"
         body = {"profile": setting}
         headers = self._create_headers_with_auth('Administrator','password')
-        response,content = http.request(api, "POST", headers=headers, body=json.dumps(body))
+        response,content = http_pool.request(api, "POST", headers=headers, body=json.dumps(body))
         return response,content
 
     def set_profiling_controls(self, server, setting):
-        http = httplib2.Http()
         n1ql_port = 8093
         api = "http://%s:%s/" % (server.ip, n1ql_port) + "admin/settings"
         body = {"controls": setting}
         headers = self._create_headers_with_auth('Administrator','password')
-        response,content = http.request(api, "POST", headers=headers, body=json.dumps(body))
+        response,content = http_pool.request(api, "POST", headers=headers, body=json.dumps(body))
         return response,content
 
     def get_query_admin_settings(self, server):
-        http = httplib2.Http()
         n1ql_port = 8093
         api = "http://%s:%s/" % (server.ip, n1ql_port) + "admin/settings"
         headers = self._create_headers_with_auth('Administrator', 'password')
-        response, content = http.request(api, "GET", headers=headers)
+        response, content = http_pool.request(api, "GET", headers=headers)
         result = json.loads(content)
         return result
 
     def get_query_vitals(self,server):
-        http = httplib2.Http()
         n1ql_port = 8093
         api = "http://%s:%s/" % (server.ip, n1ql_port) + "admin/vitals"
         headers = self._create_headers_with_auth('Administrator', 'password')
-        response, content = http.request(api, "GET", headers=headers)
+        response, content = http_pool.request(api, "GET", headers=headers)
         return response, content
     '''End Monitoring/Profiling Rest Calls'''
 
     def create_whitelist(self, server, whitelist):
-        http = httplib2.Http()
         api = "http://%s:%s/" % (server.ip, server.port) + "settings/querySettings/curlWhitelist"
         headers = self._create_headers_with_auth('Administrator', 'password')
-        response,content = http.request(api, "POST", headers=headers, body=json.dumps(whitelist))
+        response,content = http_pool.request(api, "POST", headers=headers, body=json.dumps(whitelist))
         return response,content
 
     def query_tool(self, query, port=8093, timeout=1300, query_params={}, is_prepared=False, named_prepare=None,
@@ -3400,7 +3394,6 @@ class RestConnection(object):
         prepared = json.dumps(query)
         if is_prepared:
             if named_prepare and encoded_plan:
-                http = httplib2.Http()
                 if len(servers)>1:
                     url = "http://%s:%s/query/service" % (servers[1].ip, port)
                 else:
@@ -3409,7 +3402,8 @@ class RestConnection(object):
                 headers = self._create_headers_encoded_prepared()
                 body = {'prepared': named_prepare, 'encoded_plan':encoded_plan}
 
-                response, content = http.request(url, 'POST', headers=headers, body=json.dumps(body))
+                response, content = http_pool.request(url, 'POST', headers=headers, body=json.dumps(body),
+                                                      timeout=timeout)
 
                 return eval(content)
 
@@ -4846,7 +4840,7 @@ class Bucket(object):
         self.saslPassword = saslPassword
         self.authType = ""
         self.bucket_size = bucket_size
-        self.kvs = {1:KVStore()}
+        self.kvs = {1:create_kv_store()}
         self.authType = authType
         self.master_id = master_id
         self.eviction_policy = eviction_policy
@@ -4854,6 +4848,7 @@ class Bucket(object):
         self.uuid = uuid
         self.lww = lww
         self.maxttl = maxttl
+        self.rev = None
 
 
     def __str__(self):
@@ -5056,6 +5051,7 @@ class RestParser(object):
             bucket.port = parsed['proxyPort']
         bucket.authType = parsed["authType"]
         bucket.saslPassword = parsed["saslPassword"]
+        bucket.rev = parsed.get('rev')
         bucket.nodes = list()
         if 'vBucketServerMap' in parsed:
             vBucketServerMap = parsed['vBucketServerMap']
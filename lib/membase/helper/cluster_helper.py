@@ -1,6 +1,6 @@
 from membase.api.rest_client import RestConnection, RestHelper
 from memcached.helper.data_helper import MemcachedClientHelper
-from remote.remote_util import RemoteMachineShellConnection
+from remote.remote_util import RemoteMachineShellConnection, RemoteClusterExecutor
 from mc_bin_client import MemcachedClient, MemcachedError
 from membase.api.exception import ServerAlreadyJoinedException
 from membase.helper.rebalance_helper import RebalanceHelper
@@ -221,21 +221,21 @@ class ClusterOperationHelper(object):
 
     @staticmethod
     def start_cluster(servers):
-        for server in servers:
-            shell = RemoteMachineShellConnection(server)
+        def _start(shell, server):
             if shell.is_couchbase_installed():
                 shell.start_couchbase()
             else:
                 shell.start_membase()
+        RemoteClusterExecutor(servers).run(_start).raise_on_failure("start server failed")
 
     @staticmethod
     def stop_cluster(servers):
-        for server in servers:
-            shell = RemoteMachineShellConnection(server)
+        def _stop(shell, server):
             if shell.is_couchbase_installed():
                 shell.stop_couchbase()
             else:
                 shell.stop_membase()
+        RemoteClusterExecutor(servers).run(_stop).raise_on_failure("stop server failed")
 
     @staticmethod
     def cleanup_cluster(servers, wait_for_rebalance=True, master = None):
@@ -305,13 +305,9 @@ class MemcachedClientHelper(object):
         RestHelper(rest).vbucket_map_ready(bucket, 60)
         vBuckets = RestConnection(server).get_vbuckets(bucket)
         if isinstance(server, dict):
-            client = MemcachedClient(server["ip"], node.memcached, timeout=timeout)
+            ip = server["ip"]
         else:
-            client = MemcachedClient(server.ip, node.memcached, timeout=timeout)
-        if vBuckets != None:
-            client.vbucket_count = len(vBuckets)
-        else:
-            client.vbucket_count = 0
+            ip = server.ip
         bucket_info = rest.get_bucket(bucket)
         # todo raise exception for not bucket_info
 
@@ -320,6 +316,18 @@ class MemcachedClientHelper(object):
             pre_spock = True
         else:
             pre_spock = not cluster_compatibility
+        return MemcachedClientHelper.direct_client_for_node(ip, node.memcached, bucket, bucket_info,
+                                                            len(vBuckets or []), pre_spock,
+                                                            timeout=timeout, admin_user=admin_user,
+                                                            admin_pass=admin_pass)
+
+    @staticmethod
+    def direct_client_for_node(ip, memcached_port, bucket, bucket_info, vbucket_count, pre_spock,
+                               timeout=30, admin_user='cbadminbucket', admin_pass='password'):
+        """Opens and authenticates a direct client from topology the caller
+        already fetched, without any REST round trips of its own."""
+        client = MemcachedClient(ip, memcached_port, timeout=timeout)
+        client.vbucket_count = vbucket_count
         if pre_spock:
             log.info("Atleast 1 of the server is on pre-spock "
                      "version. Using the old ssl auth to connect to "
@@ -761,6 +769,10 @@ class WorkerThread(threading.Thread):
 
 
 class VBucketAwareMemcached(object):
+    # (rest ip, rest port, bucket) -> nodes and auth mode for a bucket config rev
+    _topology_cache = {}
+    _topology_lock = threading.Lock()
+
     def __init__(self, rest, bucket, info=None, collection=None):
         self.log = logger.Logger.get_logger()
         self.info = info
@@ -816,32 +828,92 @@ class VBucketAwareMemcached(object):
                     del self.memcacheds[rm_cl]
                 self.vBucketMapReplica[vBucket.id] = vBucket.replica
                 for replica in vBucket.replica:
-                    self.add_memcached(replica, self.memcacheds, self.rest, self.bucket)
+                    self.add_memcached(replica, self.memcacheds, self.rest, self.bucket, nodes=nodes)
         return True
 
     def request_map(self, rest, bucket):
-        memcacheds = {}
+        """Builds direct clients for every node in the vbucket map from a
+        single bucket fetch. The node list and auth mode are cached per
+        bucket and only refetched when the bucket config rev changes."""
         vBucketMap = {}
         vBucketMapReplica = {}
-        vb_ready = RestHelper(rest).vbucket_map_ready(bucket, 60)
-        if not vb_ready:
-            raise Exception("vbucket map is not ready for bucket {0}".format(bucket))
-        vBuckets = rest.get_vbuckets(bucket)
-        for vBucket in vBuckets:
+        end_time = time.time() + 60
+        bucket_info = rest.get_bucket(bucket)
+        while not (bucket_info and bucket_info.vbuckets):
+            if time.time() > end_time:
+                raise Exception("vbucket map is not ready for bucket {0}".format(bucket))
+            time.sleep(0.5)
+            bucket_info = rest.get_bucket(bucket)
+        server_strs = set()
+        for vBucket in bucket_info.vbuckets:
             vBucketMap[vBucket.id] = vBucket.master
-            self.add_memcached(vBucket.master, memcacheds, rest, bucket)
-
             vBucketMapReplica[vBucket.id] = vBucket.replica
-            for replica in vBucket.replica:
-                self.add_memcached(replica, memcacheds, rest, bucket)
+            server_strs.add(vBucket.master)
+            server_strs.update(vBucket.replica)
+        topology = self._get_topology(rest, bucket_info)
+        if not server_strs.issubset(topology["nodes"]):
+            topology = self._get_topology(rest, bucket_info, refresh=True)
+        memcacheds = self._direct_clients(rest, server_strs, topology, bucket_info)
         return memcacheds, vBucketMap, vBucketMapReplica
 
+    def _get_topology(self, rest, bucket_info, refresh=False):
+        cache_key = (rest.ip, rest.port, bucket_info.name)
+        with VBucketAwareMemcached._topology_lock:
+            topology = VBucketAwareMemcached._topology_cache.get(cache_key)
+        if topology and not refresh and bucket_info.rev is not None and \
+           topology["rev"] == bucket_info.rev and topology["uuid"] == bucket_info.uuid:
+            return topology
+        nodes = rest.get_nodes()
+        # same check as RestConnection.check_cluster_compatibility("5.0")
+        pre_spock = not nodes or \
+            any(int(node.clusterCompatibility) < 5 * 65536 for node in nodes)
+        topology = {"rev": bucket_info.rev,
+                    "uuid": bucket_info.uuid,
+                    "nodes": dict(("{0}:{1}".format(node.ip, node.memcached), node)
+                                  for node in nodes),
+                    "pre_spock": pre_spock}
+        with VBucketAwareMemcached._topology_lock:
+            VBucketAwareMemcached._topology_cache[cache_key] = topology
+        return topology
+
+    def _direct_clients(self, rest, server_strs, topology, bucket_info, admin_user='cbadminbucket',
+                        admin_pass='password'):
+        memcacheds = {}
+        errors = []
+        ip_override = None
+        if TestInputSingleton.input.param("alt_addr", False):
+            ip_override = rest.get_ip_from_ini_file()
+
+        def connect(server_str, node):
+            try:
+                memcacheds[server_str] = MemcachedClientHelper.direct_client_for_node(
+                    ip_override or node.ip, node.memcached, bucket_info.name, bucket_info,
+                    len(bucket_info.vbuckets),
+                    topology["pre_spock"], admin_user=admin_user, admin_pass=admin_pass)
+            except Exception as ex:
+                errors.append((server_str, ex))
+
+        threads = [Thread(target=connect, args=(server_str, topology["nodes"][server_str]))
+                   for server_str in server_strs if server_str in topology["nodes"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            msg = "unable to establish connection to {0}. cleanup open connections"
+            self.log.warn(msg.format(errors[0][0].rsplit(":", 1)[0]))
+            for client in memcacheds.values():
+                client.close()
+            raise errors[0][1]
+        return memcacheds
+
     def add_memcached(self, server_str, memcacheds, rest, bucket, admin_user='cbadminbucket',
-                                                                      admin_pass='password'):
+                                                                      admin_pass='password', nodes=None):
         if not server_str in memcacheds:
             serverIp = server_str.rsplit(":", 1)[0]
             serverPort = int(server_str.rsplit(":", 1)[1])
-            nodes = rest.get_nodes()
+            if nodes is None:
+                nodes = rest.get_nodes()
             server = TestInputServer()
             server.ip = serverIp
             if TestInputSingleton.input.param("alt_addr", False):
@@ -1281,16 +1353,94 @@ class VBucketAwareMemcached(object):
             keys_vals.update(future.result())
         return keys_vals
 
-    def _get_server_keys_dic(self, keys):
+    def _get_server_keys_dic(self, keys, replica_index=None):
         server_keys = {}
         for key in keys:
             vBucketId = self._get_vBucket_id(key)
-            server_str = self.vBucketMap[vBucketId]
+            if replica_index is None:
+                server_str = self.vBucketMap[vBucketId]
+            else:
+                server_str = self.vBucketMapReplica[vBucketId][replica_index]
             if server_str not in server_keys :
                 server_keys[server_str] = []
             server_keys[server_str].append(key)
         return server_keys
 
+    def deleteMulti(self, keys, cas=0, collection=None, window=256):
+        """Deletes keys through pipelined requests, one pipeline per server.
+
+        Returns (results, errors): dicts of key to the delete response and
+        key to the error for keys that could not be deleted."""
+        return self._pipelined_multi(keys, lambda pipe, key, vb: pipe.delete(
+            key, cas=cas, vbucket=vb, collection=collection), window=window)
+
+    def getMetaMulti(self, keys, request_extended_meta_data=False, collection=None, window=256):
+        """Pipelined getMeta for many keys. Returns (results, errors) where
+        results maps each key to the same tuple as MemcachedClient.getMeta."""
+        return self._pipelined_multi(keys, lambda pipe, key, vb: pipe.getMeta(
+            key, request_extended_meta_data, vbucket=vb, collection=collection), window=window)
+
+    def getrMulti(self, keys, replica_index=0, collection=None, window=256):
+        """Pipelined replica get from the given replica of each key's vbucket.
+        Returns (results, errors) with (flags, cas, value) results."""
+        return self._pipelined_multi(keys, lambda pipe, key, vb: pipe.getr(
+            key, vbucket=vb, collection=collection), replica_index=replica_index, window=window)
+
+    def touchMulti(self, keys, exp, collection=None, window=256):
+        """Pipelined touch for many keys. Returns (results, errors)."""
+        return self._pipelined_multi(keys, lambda pipe, key, vb: pipe.touch(
+            key, exp, vbucket=vb, collection=collection), window=window)
+
+    def _pipelined_multi(self, keys, submit, replica_index=None, window=256, max_retries=5):
+        results = {}
+        errors = {}
+        pending = list(keys)
+        retries = 0
+        backoff = .001
+        while pending:
+            retry = {}
+            server_keys = self._get_server_keys_dic(pending, replica_index)
+            for server_str, server_key_lst in server_keys.items():
+                if server_str not in self.memcacheds:
+                    for key in server_key_lst:
+                        retry[key] = MemcachedError(ERR_NOT_MY_VBUCKET,
+                                                    "no connection to {0}".format(server_str))
+                    continue
+                ops = {}
+                conn_error = None
+                try:
+                    pipe = self.memcacheds[server_str].pipeline(window)
+                    for key in server_key_lst:
+                        ops[key] = submit(pipe, key, self._get_vBucket_id(key))
+                    pipe.drain()
+                except (EOFError, IOError, socket.error), error:
+                    # the connection is gone, reset_vbuckets below opens a new one
+                    self.log.warn("{0} while talking to {1}".format(error, server_str))
+                    self.memcacheds.pop(server_str).close()
+                    conn_error = MemcachedError(ERR_NOT_MY_VBUCKET,
+                                                "Connection reset with error: {0}".format(error))
+                for key in server_key_lst:
+                    op = ops.get(key)
+                    if op is None or not op.done():
+                        retry[key] = conn_error
+                    elif op.exception() is None:
+                        results[key] = op.result()
+                    elif op.exception().status in [ERR_NOT_MY_VBUCKET, ERR_ETMPFAIL]:
+                        retry[key] = op.exception()
+                    else:
+                        errors[key] = op.exception()
+            pending = retry.keys()
+            if pending:
+                if retries >= max_retries:
+                    errors.update(retry)
+                    break
+                retries += 1
+                time.sleep(backoff)
+                backoff *= 2
+                if any(error.status == ERR_NOT_MY_VBUCKET for error in retry.values()):
+                    self.reset_vbuckets(self.rest, self._get_vBucket_ids(pending))
+        return results, errors
+
     def _get_vBucket_ids(self, keys, collection=None):
         return set([self._get_vBucket_id(key) for key in keys])
 
@@ -2,7 +2,11 @@ import threading
 import random
 import zlib
 import time
-import copy
+import heapq
+import mmap
+import os
+import struct
+from array import array
 
 class KVStore(object):
     def __init__(self, num_locks=1000):
@@ -14,7 +18,10 @@ class KVStore(object):
         self.cache = {}
         for itr in range(self.num_locks):
             self.cache[itr] = {"lock": threading.Lock(),
-                               "partition": Partition(itr)}
+                               "partition": self._new_partition(itr)}
+
+    def _new_partition(self, part_id):
+        return Partition(part_id)
 
 
     def partition(self, key, collection=None, bucket="default"):
@@ -114,6 +121,66 @@ class KVStore(object):
             # release
             self.cache[itr]["lock"].release()
 
+    def merge_record_file(self, path):
+        """
+        merges the items written by a KVRecordWriter into the store, taking
+        each partition lock once
+
+        arguments:
+            path -- file written by KVRecordWriter for a store with the
+                    same num_locks
+
+        returns the number of items merged
+        """
+        items = {}
+        count = 0
+        for part_id, item in read_records(path):
+            if part_id not in items:
+                items[part_id] = []
+            items[part_id].append(item)
+            count += 1
+        for part_id, part_items in items.iteritems():
+            self.cache[part_id]["lock"].acquire()
+            try:
+                self.cache[part_id]["partition"].merge_items(part_items)
+            finally:
+                self.cache[part_id]["lock"].release()
+        return count
+
+    def merge_from(self, src, key_filter=None, lww=False):
+        """
+        merges the keys of another KVStore into this one the way XDCR
+        replicates them, partition by partition, see
+        Partition.merge_replicated
+
+        arguments:
+            src -- KVStore with the same num_locks to merge from
+            key_filter -- compiled regex, only the valid src keys it matches
+                          are set
+            lww -- leave keys whose timestamp here is newer than in src
+
+        returns a dict with the number of valid src keys, the ones that
+        matched key_filter and the keys set and deleted here
+        """
+        if src.num_locks != self.num_locks:
+            raise Exception("can not merge a KVStore with %s partitions into one with %s"
+                            % (src.num_locks, self.num_locks))
+        stats = {"valid": 0, "matched": 0, "set": 0, "deleted": 0}
+        # a merge the other way round at the same time takes the locks in the same order
+        first, second = sorted([self, src], key=id)
+        for itr in range(self.num_locks):
+            first.cache[itr]["lock"].acquire()
+            second.cache[itr]["lock"].acquire()
+            try:
+                counts = self.cache[itr]["partition"].merge_replicated(
+                    src.cache[itr]["partition"], key_filter, lww)
+            finally:
+                second.cache[itr]["lock"].release()
+                first.cache[itr]["lock"].release()
+            for name, count in zip(["valid", "matched", "set", "deleted"], counts):
+                stats[name] += count
+        return stats
+
     def __len__(self):
         return sum([len(self.cache[itr]["partition"]) for itr in range(self.num_locks)])
 
@@ -129,13 +196,12 @@ class Partition(object):
         self.__valid = {}
         self.__deleted = {}
         self.__timestamp = {}
-        self.__expired_keys = []
+        self.__expired_keys = set()
 
     def set(self, key, value, exp=0, flag=0):
         if key in self.__deleted:
             del self.__deleted[key]
-        if key in self.__expired_keys:
-            self.__expired_keys.remove(key)
+        self.__expired_keys.discard(key)
         if exp != 0:
             exp = (time.time() + exp)
         self.__valid[key] = {"value": value,
@@ -185,19 +251,16 @@ class Partition(object):
         return None
 
     def valid_key_set(self):
-        valid_keys = copy.copy(self.__valid.keys())
-        [self.__expire_key(key) for key in valid_keys]
+        self.__expire_keys()
         return self.__valid.keys()
 
     def deleted_key_set(self):
-        valid_keys = copy.copy(self.__valid.keys())
-        [self.__expire_key(key) for key in valid_keys]
+        self.__expire_keys()
         return self.__deleted.keys()
 
     def expired_key_set(self):
-        valid_keys = copy.copy(self.__valid.keys())
-        [self.__expire_key(key) for key in valid_keys]
-        return self.__expired_keys
+        self.__expire_keys()
+        return list(self.__expired_keys)
 
     def merge(self, partition):
         """
@@ -207,6 +270,10 @@ class Partition(object):
             partition -- type Partition
         """
 
+        if not isinstance(partition, Partition):
+            self.merge_items(partition.valid_items())
+            return
+
         # update valid keys
         valid_items = partition.__valid
         self.__valid.update(valid_items)
@@ -217,13 +284,79 @@ class Partition(object):
             del self.__deleted[key]
 
         # make sure key no longer marked as expired
-        expired_keys = set(valid_items.keys()) & set(self.__expired_keys)
-        for key in expired_keys:
-            self.__expired_keys.remove(key)
+        self.__expired_keys.difference_update(valid_items.keys())
 
         # update timestamps
         self.__timestamp.update(partition.__timestamp)
 
+    def valid_items(self):
+        """
+        yields (key, value, expires, flag, timestamp) for every valid key,
+        expires being the absolute expiry time or 0
+        """
+        for key, item in self.__valid.items():
+            yield key, item["value"], item["expires"], item["flag"], self.__timestamp.get(key, 0)
+
+    def merge_items(self, items):
+        """
+        sets (key, value, expires, flag, timestamp) items as they are,
+        expires being an absolute expiry time or 0
+        """
+        for key, value, expires, flag, timestamp in items:
+            self.__set(key, value, expires, flag, timestamp)
+
+    def merge_replicated(self, partition, key_filter=None, lww=False):
+        """
+        merges the partition of another store the way XDCR replicates it:
+        its valid keys are set here as set() would and its deleted keys
+        deleted, except keys that are deleted here already
+
+        arguments:
+            partition -- type Partition or CompactPartition
+            key_filter -- compiled regex, only the valid keys it matches are set
+            lww -- leave keys whose timestamp here is newer than there
+
+        returns (valid keys there, keys that matched key_filter, keys set,
+        keys deleted)
+        """
+        num_valid, valid_keys, deleted_keys = _replicated_keys(self, partition, key_filter)
+        if not isinstance(partition, Partition):
+            return (num_valid, len(valid_keys)) + \
+                _replicate_keys(self, partition, valid_keys, deleted_keys, lww)
+        if lww:
+            valid_keys = [key for key in valid_keys
+                          if partition.__timestamp.get(key, 0) >= self.__timestamp.get(key, 0)]
+            deleted_keys = [key for key in deleted_keys
+                            if partition.__timestamp.get(key, 0) >= self.__timestamp.get(key, 0)]
+        # the same items set() would store, none of the keys is deleted here
+        now = time.time()
+        items = partition.__valid
+        for key in valid_keys:
+            item = items[key]
+            if item["expires"] != 0:
+                item = {"value": item["value"],
+                        "expires": now + item["expires"],
+                        "flag": item["flag"]}
+            self.__valid[key] = item
+        self.__timestamp.update(dict.fromkeys(valid_keys, now))
+        self.__expired_keys.difference_update(valid_keys)
+        num_deleted = 0
+        for key in deleted_keys:
+            if key in self.__valid:
+                self.__deleted[key] = self.__valid.pop(key)["value"]
+                self.__timestamp[key] = now
+                num_deleted += 1
+        return num_valid, len(valid_keys), len(valid_keys), num_deleted
+
+    def __set(self, key, value, expires, flag, timestamp):
+        if key in self.__deleted:
+            del self.__deleted[key]
+        self.__expired_keys.discard(key)
+        self.__valid[key] = {"value": value,
+                             "expires": expires,
+                             "flag": flag}
+        self.__timestamp[key] = timestamp
+
     def has_valid_keys(self):
         return len(self.__valid) > 0
 
@@ -234,9 +367,18 @@ class Partition(object):
         if key in self.__valid:
             if self.__valid[key]["expires"] != 0 and self.__valid[key]["expires"] < time.time():
                 self.__deleted[key] = self.__valid[key]["value"]
-                self.__expired_keys.append(key)
+                self.__expired_keys.add(key)
                 del self.__valid[key]
 
+    def __expire_keys(self):
+        # one pass over the items instead of __expire_key per key
+        now = time.time()
+        expired = [key for key, item in self.__valid.iteritems()
+                   if item["expires"] != 0 and item["expires"] < now]
+        for key in expired:
+            self.__deleted[key] = self.__valid.pop(key)["value"]
+            self.__expired_keys.add(key)
+
     def expired(self, key):
         if key not in self.__valid and key not in self.__deleted:
             raise Exception("Key: %s is not a valid key" % key)
@@ -244,8 +386,8 @@ class Partition(object):
         return key in self.__expired_keys
 
     def __len__(self):
-        [self.__expire_key(key) for key in self.__valid.keys()]
-        return len(self.__valid.keys())
+        self.__expire_keys()
+        return len(self.__valid)
 
     def __eq__(self, other):
         if isinstance(other, Partition):
@@ -254,3 +396,421 @@ class Partition(object):
 
     def __hash__(self):
         return self.part_id.__hash__()
+
+
+def _replicated_keys(dest, src, key_filter):
+    """
+    returns the number of valid keys in partition src, the ones of them
+    that match key_filter and its deleted keys, both without the keys that
+    are deleted in partition dest
+    """
+    valid_keys = src.valid_key_set()
+    num_valid = len(valid_keys)
+    if key_filter is not None:
+        valid_keys = [key for key in valid_keys if key_filter.search(key) is not None]
+    deleted_here = set(dest.deleted_key_set())
+    if deleted_here:
+        valid_keys = [key for key in valid_keys if key not in deleted_here]
+        deleted_keys = [key for key in src.deleted_key_set() if key not in deleted_here]
+    else:
+        deleted_keys = src.deleted_key_set()
+    return num_valid, valid_keys, deleted_keys
+
+
+def _replicate_keys(dest, src, valid_keys, deleted_keys, lww):
+    """
+    sets valid_keys and deletes deleted_keys of partition src in partition
+    dest key by key, returns the number of keys set and deleted
+    """
+    num_set = num_deleted = 0
+    for key in valid_keys:
+        if lww and src.get_timestamp(key) < dest.get_timestamp(key):
+            continue
+        item = src.get_key(key)
+        dest.set(key, item["value"], item["expires"], item["flag"])
+        num_set += 1
+    for key in deleted_keys:
+        if lww and src.get_timestamp(key) < dest.get_timestamp(key):
+            continue
+        if dest.get_key(key) is not None:
+            dest.delete(key)
+            num_deleted += 1
+    return num_set, num_deleted
+
+
+def create_kv_store(num_locks=1000):
+    """
+    returns the KVStore selected with the kvstore test param:
+    kvstore=compact gives a CompactKVStore, anything else the dict based one
+    """
+    from TestInput import TestInputSingleton
+    if TestInputSingleton.input is not None and \
+            TestInputSingleton.input.param("kvstore", "dict") == "compact":
+        return CompactKVStore(num_locks)
+    return KVStore(num_locks)
+
+
+# CompactPartition slot states
+_VALID = 1
+_DELETED = 2
+_EXPIRED = 4
+_RAW_VALUE = 8
+_NO_VALUE = 16
+
+
+class CompactKVStore(KVStore):
+    """
+    KVStore backed by CompactPartition, for runs that track too many keys
+    to keep a dict per key in memory
+    """
+
+    def _new_partition(self, part_id):
+        return CompactPartition(part_id)
+
+
+class CompactPartition(object):
+    """
+    Drop-in replacement for Partition that keeps each key in a slot of
+    array-backed columns instead of a dict per key.
+
+    Values that are CRC strings (what the loaders store with
+    only_store_hash) are kept as integers in the crc column, anything else
+    goes to a side dict. The key index maps each key to its slot number once
+    and keys never leave it, a delete only flips the slot's state. Keys with a ttl are kept in a heap
+    ordered by expiry time so they are expired in bulk instead of by
+    scanning every valid key.
+    """
+
+    def __init__(self, part_id):
+        self.part_id = part_id
+        self._slots = {}
+        self._keys = []
+        self._state = array('B')
+        self._crc = array('I')
+        self._flag = array('I')
+        self._expires = array('d')
+        self._timestamp = array('d')
+        self._raw_values = {}
+        self._raw_flags = {}
+        self._expiry_heap = []
+        self._num_valid = 0
+        self._num_deleted = 0
+
+    def _slot(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = len(self._keys)
+            self._slots[key] = slot
+            self._keys.append(key)
+            self._state.append(0)
+            self._crc.append(0)
+            self._flag.append(0)
+            self._expires.append(0)
+            self._timestamp.append(0)
+        return slot
+
+    def _set_slot(self, slot, value, expires, flag, timestamp):
+        state = self._state[slot]
+        if state & _VALID:
+            self._num_valid -= 1
+        elif state & _DELETED:
+            self._num_deleted -= 1
+        if state & _RAW_VALUE:
+            del self._raw_values[slot]
+        if value is None:
+            state = _VALID | _NO_VALUE
+            crc = 0
+        elif value.__class__ is str and value.isdigit() and len(value) <= 10 \
+                and (value[0] != '0' or len(value) == 1) and int(value) < 0x100000000:
+            state = _VALID
+            crc = int(value)
+        else:
+            state = _VALID | _RAW_VALUE
+            crc = 0
+            self._raw_values[slot] = value
+        self._crc[slot] = crc
+        if self._raw_flags:
+            self._raw_flags.pop(slot, None)
+        try:
+            self._flag[slot] = flag
+        except (OverflowError, TypeError):
+            self._flag[slot] = 0
+            self._raw_flags[slot] = flag
+        self._state[slot] = state
+        self._expires[slot] = expires
+        self._timestamp[slot] = timestamp
+        self._num_valid += 1
+        if expires != 0:
+            heapq.heappush(self._expiry_heap, (expires, slot))
+
+    def _value(self, slot):
+        state = self._state[slot]
+        if state & _RAW_VALUE:
+            return self._raw_values[slot]
+        if state & _NO_VALUE:
+            return None
+        return str(self._crc[slot])
+
+    def _get_flag(self, slot):
+        if slot in self._raw_flags:
+            return self._raw_flags[slot]
+        return self._flag[slot]
+
+    def _expire_due(self):
+        now = time.time()
+        heap = self._expiry_heap
+        while heap and heap[0][0] < now:
+            expires, slot = heapq.heappop(heap)
+            # entries left behind by a later set or delete of the key are stale
+            if self._state[slot] & _VALID and self._expires[slot] == expires:
+                self._state[slot] = (self._state[slot] & ~_VALID) | _DELETED | _EXPIRED
+                self._num_valid -= 1
+                self._num_deleted += 1
+
+    def _valid_slot(self, key):
+        self._expire_due()
+        slot = self._slots.get(key)
+        if slot is not None and self._state[slot] & _VALID:
+            return slot
+        return None
+
+    def set(self, key, value, exp=0, flag=0):
+        now = time.time()
+        if exp != 0:
+            exp = (now + exp)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slot(key)
+        self._set_slot(slot, value, exp, flag, now)
+
+    def delete(self, key):
+        slot = self._slots.get(key)
+        if slot is not None and self._state[slot] & _VALID:
+            self._state[slot] = (self._state[slot] & ~_VALID) | _DELETED
+            self._timestamp[slot] = time.time()
+            self._num_valid -= 1
+            self._num_deleted += 1
+
+    def get_timestamp(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            return 0
+        return self._timestamp[slot]
+
+    def get_key(self, key):
+        slot = self._slots.get(key)
+        if slot is None or not self._state[slot] & _VALID:
+            return None
+        return {"value": self._value(slot),
+                "expires": self._expires[slot],
+                "flag": self._get_flag(slot)}
+
+    def get_valid(self, key):
+        slot = self._valid_slot(key)
+        if slot is None:
+            return None
+        return self._value(slot)
+
+    def get_deleted(self, key):
+        self._expire_due()
+        slot = self._slots.get(key)
+        if slot is None or not self._state[slot] & _DELETED:
+            return None
+        return self._value(slot)
+
+    def get_flag(self, key):
+        slot = self._valid_slot(key)
+        if slot is None:
+            return None
+        return self._get_flag(slot)
+
+    def _random_key(self, state, count):
+        if count == 0:
+            return None
+        # sample slots first, a full scan is only needed when few match
+        for _ in range(10):
+            slot = random.randrange(len(self._keys))
+            if self._state[slot] & state:
+                return self._keys[slot]
+        keys = self._keys_with(state)
+        if not keys:
+            return None
+        return random.choice(keys)
+
+    def get_random_valid_key(self):
+        self._expire_due()
+        return self._random_key(_VALID, self._num_valid)
+
+    def get_random_deleted_key(self):
+        return self._random_key(_DELETED, self._num_deleted)
+
+    def _keys_with(self, state):
+        keys = self._keys
+        return [keys[slot] for slot, s in enumerate(self._state) if s & state]
+
+    def valid_key_set(self):
+        self._expire_due()
+        return self._keys_with(_VALID)
+
+    def deleted_key_set(self):
+        self._expire_due()
+        return self._keys_with(_DELETED)
+
+    def expired_key_set(self):
+        self._expire_due()
+        return self._keys_with(_EXPIRED)
+
+    def valid_items(self):
+        """
+        yields (key, value, expires, flag, timestamp) for every valid key,
+        expires being the absolute expiry time or 0
+        """
+        for slot, state in enumerate(self._state):
+            if state & _VALID:
+                yield (self._keys[slot], self._value(slot), self._expires[slot],
+                       self._get_flag(slot), self._timestamp[slot])
+
+    def merge(self, partition):
+        """
+        merges a partition with self
+
+        arguments:
+            partition -- type Partition or CompactPartition
+        """
+        self.merge_items(partition.valid_items())
+
+    def merge_items(self, items):
+        """
+        sets (key, value, expires, flag, timestamp) items as they are,
+        expires being an absolute expiry time or 0
+        """
+        for key, value, expires, flag, timestamp in items:
+            self._set_slot(self._slot(key), value, expires, flag, timestamp)
+
+    def merge_replicated(self, partition, key_filter=None, lww=False):
+        """
+        merges the partition of another store the way XDCR replicates it,
+        see Partition.merge_replicated
+        """
+        num_valid, valid_keys, deleted_keys = _replicated_keys(self, partition, key_filter)
+        return (num_valid, len(valid_keys)) + \
+            _replicate_keys(self, partition, valid_keys, deleted_keys, lww)
+
+    def has_valid_keys(self):
+        return self._num_valid > 0
+
+    def has_deleted_keys(self):
+        return self._num_deleted > 0
+
+    def expired(self, key):
+        slot = self._slots.get(key)
+        if slot is None or not self._state[slot] & (_VALID | _DELETED):
+            raise Exception("Key: %s is not a valid key" % key)
+        self._expire_due()
+        return bool(self._state[slot] & _EXPIRED)
+
+    def __len__(self):
+        self._expire_due()
+        return self._num_valid
+
+    def __eq__(self, other):
+        if isinstance(other, CompactPartition):
+            return self.part_id == other.part_id
+        return False
+
+    def __hash__(self):
+        return self.part_id.__hash__()
+
+
+# KVRecordWriter record: partition, key length, value kind, crc, expires,
+# flag, timestamp, value length, followed by the key and value bytes
+_RECORD = struct.Struct("<HHBIdIdI")
+_CRC_VALUE = 0
+_STR_VALUE = 1
+_UNICODE_VALUE = 2
+_NONE_VALUE = 3
+
+
+class KVRecordWriter(object):
+    """
+    Writes the items a loader sets to a flat binary file, so a child
+    process can hand them to the parent without pickling a KVStore. The
+    parent merges the file with KVStore.merge_record_file. CRC values take
+    four bytes, other values are stored as they are.
+    """
+
+    def __init__(self, path, kv_store, buffer_items=10000):
+        self.path = path
+        self.kv_store = kv_store
+        self.buffer_items = buffer_items
+        self.count = 0
+        self._buffer = []
+        self._file = open(path, "ab")
+
+    def set(self, key, value, exp=0, flag=0, bucket="default", collection=None):
+        now = time.time()
+        if exp != 0:
+            exp = now + exp
+        part_id = self.kv_store._hash(key, bucket, collection)
+        crc = 0
+        if value is None:
+            kind, data = _NONE_VALUE, ""
+        elif isinstance(value, unicode):
+            kind, data = _UNICODE_VALUE, value.encode("utf-8")
+        elif value.isdigit() and len(value) <= 10 and (value[0] != '0' or len(value) == 1) \
+                and int(value) < 0x100000000:
+            kind, data, crc = _CRC_VALUE, "", int(value)
+        else:
+            kind, data = _STR_VALUE, value
+        # memcached flags are 32 bits, the server returns -1 as 0xffffffff
+        self._buffer.append(_RECORD.pack(part_id, len(key), kind, crc, exp,
+                                         flag & 0xffffffff, now, len(data)))
+        self._buffer.append(key)
+        self._buffer.append(data)
+        self.count += 1
+        if len(self._buffer) >= 3 * self.buffer_items:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write("".join(self._buffer))
+            self._buffer = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def read_records(path):
+    """
+    yields (partition id, (key, value, expires, flag, timestamp)) for every
+    record in a file written by KVRecordWriter
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        try:
+            offset = 0
+            header_size = _RECORD.size
+            unpack_from = _RECORD.unpack_from
+            while offset < size:
+                part_id, key_len, kind, crc, expires, flag, timestamp, value_len = \
+                    unpack_from(data, offset)
+                offset += header_size
+                key = data[offset:offset + key_len]
+                offset += key_len
+                if kind == _CRC_VALUE:
+                    value = str(crc)
+                elif kind == _STR_VALUE:
+                    value = data[offset:offset + value_len]
+                elif kind == _UNICODE_VALUE:
+                    value = data[offset:offset + value_len].decode("utf-8")
+                else:
+                    value = None
+                offset += value_len
+                yield part_id, (key, value, expires, flag, timestamp)
+        finally:
+            data.close()
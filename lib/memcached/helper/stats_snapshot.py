@@ -0,0 +1,121 @@
+import socket
+import time
+import logger
+from threading import Condition, Lock
+
+from membase.api.rest_client import Bucket
+from memcached.helper.data_helper import MemcachedClientHelper
+
+log = logger.Logger.get_logger()
+
+# StatsSnapshotCache: memcached stats per node, bucket and stat group,
+#   shared by everyone polling them. A snapshot younger than ttl seconds is
+#   handed out as is, and when it is older exactly one caller fetches a new
+#   one while the others wait for it, so any number of concurrent waiters on
+#   a node cost one `stats <group>` call per ttl. Every node and bucket has
+#   one direct client, opened on first use and reopened when it fails.
+#   Buckets are keyed by name, the waits on a bucket get different Bucket
+#   objects and forget_bucket() only gets its name.
+
+STATS_TTL = 1
+
+
+class _Snapshot(object):
+    def __init__(self):
+        self.stats = None
+        self.time = 0
+        self.fetching = False
+
+
+class StatsSnapshotCache(object):
+    def __init__(self, ttl=STATS_TTL):
+        self.ttl = ttl
+        self._cond = Condition()
+        self._snapshots = {}
+        self._clients = {}
+        self._client_locks = {}
+        self.fetches = 0
+
+    def get(self, server, bucket, group="", admin_user='cbadminbucket', admin_pass='password'):
+        """The stats dict of group for bucket (a Bucket or its name) on server,
+        at most ttl seconds old"""
+        name = bucket.name if isinstance(bucket, Bucket) else bucket
+        key = (server.ip, server.port, name, group)
+        with self._cond:
+            snapshot = self._snapshots.setdefault(key, _Snapshot())
+            while snapshot.fetching:
+                self._cond.wait(1)
+            if snapshot.stats is not None and time.time() - snapshot.time < self.ttl:
+                return snapshot.stats
+            snapshot.fetching = True
+        started = time.time()
+        stats = None
+        try:
+            stats = self._fetch(server, bucket, name, group, admin_user, admin_pass)
+        finally:
+            with self._cond:
+                snapshot.fetching = False
+                if stats is not None:
+                    self.fetches += 1
+                    snapshot.stats = stats
+                    snapshot.time = started
+                self._cond.notify_all()
+        return stats
+
+    def _fetch(self, server, bucket, name, group, admin_user, admin_pass):
+        key = (server.ip, server.port, name)
+        with self._cond:
+            lock = self._client_locks.setdefault(key, Lock())
+        # the groups of a bucket share its client, one stats call at a time
+        with lock:
+            try:
+                return self._client(key, server, bucket, admin_user, admin_pass).stats(group)
+            except (EOFError, socket.error):
+                # the bucket may have been recreated since the client was opened
+                self._close_client(key)
+                return self._client(key, server, bucket, admin_user, admin_pass).stats(group)
+
+    def _client(self, key, server, bucket, admin_user, admin_pass):
+        if key not in self._clients:
+            for i in xrange(3):
+                try:
+                    self._clients[key] = MemcachedClientHelper.direct_client(server, bucket, admin_user=admin_user,
+                                                                             admin_pass=admin_pass)
+                    return self._clients[key]
+                except (EOFError, socket.error):
+                    log.error("failed to create direct client, retry in 1 sec")
+                    time.sleep(1)
+            self._clients[key] = MemcachedClientHelper.direct_client(server, bucket, admin_user=admin_user,
+                                                                     admin_pass=admin_pass)
+        return self._clients[key]
+
+    def _close_client(self, key):
+        client = self._clients.pop(key, None)
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def forget_bucket(self, bucket):
+        """Drops the snapshots and closes the clients of a deleted bucket"""
+        bucket = bucket.name if isinstance(bucket, Bucket) else bucket
+        with self._cond:
+            for key in self._snapshots.keys():
+                if key[2] == bucket:
+                    del self._snapshots[key]
+            keys = [key for key in self._clients.keys() if key[2] == bucket]
+        for key in keys:
+            with self._client_locks[key]:
+                self._close_client(key)
+
+    def close(self):
+        with self._cond:
+            self._snapshots.clear()
+            keys = self._clients.keys()
+        for key in keys:
+            with self._client_locks[key]:
+                self._close_client(key)
+
+
+STATS_CACHE = StatsSnapshotCache()
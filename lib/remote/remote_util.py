@@ -8,6 +8,10 @@ import time
 import logging
 import stat
 import json
+import atexit
+import Queue
+import tempfile
+import threading
 import TestInput
 from subprocess import Popen, PIPE
 
@@ -51,6 +55,7 @@ from testconstants import LINUX_NONROOT_CB_BIN_PATH,\
                           NR_INSTALL_LOCATION_FILE, LINUX_DIST_CONFIG
 
 from membase.api.rest_client import RestConnection, RestHelper
+from couchbase_helper import vbucket_digest
 
 log = logger.Logger.get_logger()
 logging.getLogger("paramiko").setLevel(logging.WARNING)
@@ -171,8 +176,144 @@ class RemoteMachineHelper(object):
             return None
 
 
+class _SSHPoolEntry(object):
+    def __init__(self, client):
+        self.client = client
+        self.refs = 0
+        self.last_used = time.time()
+
+
+class SSHConnectionPool(object):
+    """Process-wide pool of authenticated paramiko SSHClients keyed by
+    (host, username, ssh key). RemoteMachineShellConnection instances for the
+    same node share a transport and open a new channel per command, so only
+    the first connection to a node pays for the ssh handshake.
+
+    A transport is handed to at most MAX_SHARED_PER_TRANSPORT connections at
+    once to stay under sshd's MaxSessions limit. Transports that are no longer
+    active, or that fail a channel probe after being idle, are evicted and
+    replaced on the next acquire."""
+
+    MAX_SHARED_PER_TRANSPORT = 8
+    PROBE_AFTER_IDLE = 10
+    IDLE_TIMEOUT = 600
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._entries = {}
+        self._key_locks = {}
+        self.connects = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def _get_entries(self, key):
+        with self._lock:
+            if self._pid != os.getpid():
+                # transports inherited across fork() can't be used by the child
+                self._entries = {}
+                self._key_locks = {}
+                self._pid = os.getpid()
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+                self._entries[key] = []
+            return self._key_locks[key], self._entries[key]
+
+    def _is_alive(self, entry, now):
+        transport = entry.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        if now - entry.last_used > self.PROBE_AFTER_IDLE:
+            # a node that was rebooted or firewalled can leave a transport that
+            # still looks active, so make a round trip before reusing it
+            try:
+                transport.open_session(timeout=10).close()
+            except Exception:
+                return False
+        return True
+
+    def acquire(self, key, connect):
+        """Returns a connected SSHClient for key, calling connect() to open a
+        new one if no pooled transport can be reused."""
+        key_lock, entries = self._get_entries(key)
+        with key_lock:
+            now = time.time()
+            for entry in list(entries):
+                if entry.refs == 0 and now - entry.last_used > self.IDLE_TIMEOUT \
+                        or not self._is_alive(entry, now):
+                    entries.remove(entry)
+                    self._close(entry.client)
+                    self.evicted += 1
+            entry = None
+            if entries:
+                entry = min(entries, key=lambda e: e.refs)
+                if entry.refs >= self.MAX_SHARED_PER_TRANSPORT:
+                    entry = None
+            if entry is None:
+                entry = _SSHPoolEntry(connect())
+                entries.append(entry)
+                self.connects += 1
+            else:
+                self.reused += 1
+            entry.refs += 1
+            entry.last_used = now
+            return entry.client
+
+    def release(self, key, client):
+        key_lock, entries = self._get_entries(key)
+        with key_lock:
+            for entry in entries:
+                if entry.client is client:
+                    entry.refs = max(0, entry.refs - 1)
+                    entry.last_used = time.time()
+                    break
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._lock:
+            entries = [e for es in self._entries.values() for e in es]
+            return {"transports": len(entries),
+                    "in_use": sum(e.refs for e in entries),
+                    "connects": self.connects,
+                    "reused": self.reused,
+                    "evicted": self.evicted}
+
+    def close_all(self):
+        with self._lock:
+            entries = [e for es in self._entries.values() for e in es]
+            for es in self._entries.values():
+                del es[:]
+        for entry in entries:
+            self._close(entry.client)
+
+
+SSH_POOL = SSHConnectionPool()
+atexit.register(SSH_POOL.close_all)
+
+_test_input = {}
+_test_input_lock = threading.Lock()
+
+
+def _get_test_input():
+    argv = tuple(sys.argv)
+    with _test_input_lock:
+        if argv not in _test_input:
+            _test_input[argv] = TestInput.TestInputParser.get_test_input(sys.argv)
+        return _test_input[argv]
+
+
 class RemoteMachineShellConnection:
     _ssh_client = None
+    _pool_key = None
+    # RemoteMachineInfo per ip, shared by every connection in the process
+    _info_cache = {}
+    _info_cache_lock = threading.Lock()
 
     def __init__(self, username='root',
                  pkey_location='',
@@ -214,7 +355,7 @@ class RemoteMachineShellConnection:
         self.username = serverInfo.ssh_username
         self.password = serverInfo.ssh_password
         self.ssh_key = serverInfo.ssh_key
-        self.input = TestInput.TestInputParser.get_test_input(sys.argv)
+        self.input = _get_test_input()
         self.use_sudo = True
         self.nonroot = False
         self.nr_home_path = "/home/%s/" % self.username
@@ -223,47 +364,14 @@ class RemoteMachineShellConnection:
         elif self.username != "Administrator":
             self.use_sudo = False
             self.nonroot = True
-        self._ssh_client = paramiko.SSHClient()
         self.ip = serverInfo.ip
         self.remote = (self.ip != "localhost" and self.ip != "127.0.0.1")
         self.port = serverInfo.port
-        self._ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        msg = 'connecting to {0} with username:{1} '
-        log.info(msg.format(serverInfo.ip, serverInfo.ssh_username))
-        # added attempts for connection because of PID check failed.
-        # RNG must be re-initialized after fork() error
-        # That's a paramiko bug
-        max_attempts_connect = 2
-        attempt = 0
-        while True:
-            try:
-                if self.remote and serverInfo.ssh_key == '':
-                    self._ssh_client.connect(hostname=serverInfo.ip.replace('[', '').replace(']',''),
-                                             username=serverInfo.ssh_username,
-                                             password=serverInfo.ssh_password)
-                elif self.remote:
-                    self._ssh_client.connect(hostname=serverInfo.ip.replace('[', '').replace(']',''),
-                                             username=serverInfo.ssh_username,
-                                             key_filename=serverInfo.ssh_key)
-                break
-            except paramiko.AuthenticationException:
-                log.error("Authentication failed")
-                exit(1)
-            except paramiko.BadHostKeyException:
-                log.error("Invalid Host key")
-                exit(1)
-            except Exception as e:
-                if str(e).find('PID check failed. RNG must be re-initialized') != -1 and\
-                        attempt != max_attempts_connect:
-                    log.error("Can't establish SSH session to node {1} :\
-                              {0}. Will try again in 1 sec".format(e, self.ip))
-                    attempt += 1
-                    time.sleep(1)
-                else:
-                    log.error("Can't establish SSH session to node {1} :\
-                                                   {0}".format(e, self.ip))
-                    exit(1)
-        log.info("Connected to {0}".format(serverInfo.ip))
+        if self.remote:
+            self._acquire_ssh_client(serverInfo.ssh_username)
+        else:
+            self._ssh_client = paramiko.SSHClient()
+            self._ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         """ self.info.distribution_type.lower() == "ubuntu" """
         self.cmd_ext = ""
         self.bin_path = LINUX_COUCHBASE_BIN_PATH
@@ -279,26 +387,30 @@ class RemoteMachineShellConnection:
         if self.nonroot:
             self.bin_path = self.nr_home_path + self.bin_path
 
-    """
-        In case of non root user, we need to switch to root to
-        run command
-    """
-    def connect_with_user(self, user="root"):
-        if self.info.distribution_type.lower() == "mac":
-            log.info("This is Mac Server.  Skip re-connect to it as %s" % user)
-            return
+    def _connect(self, username, ssh_key=''):
+        """Opens a new ssh session to self.ip, exiting on failure."""
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        msg = 'connecting to {0} with username:{1} '
+        log.info(msg.format(self.ip, username))
+        # added attempts for connection because of PID check failed.
+        # RNG must be re-initialized after fork() error
+        # That's a paramiko bug
         max_attempts_connect = 2
         attempt = 0
         while True:
             try:
-                log.info("Connect to node: %s as user: %s" % (self.ip, user))
-                if self.remote and self.ssh_key == '':
-                    self._ssh_client.connect(hostname=self.ip.replace('[', '').replace(']',''),
-                                             username=user,
-                                             password=self.password)
+                if ssh_key == '':
+                    ssh_client.connect(hostname=self.ip.replace('[', '').replace(']',''),
+                                       username=username,
+                                       password=self.password)
+                else:
+                    ssh_client.connect(hostname=self.ip.replace('[', '').replace(']',''),
+                                       username=username,
+                                       key_filename=ssh_key)
                 break
             except paramiko.AuthenticationException:
-                log.error("Authentication for root failed")
+                log.error("Authentication failed for {0} as {1}".format(self.ip, username))
                 exit(1)
             except paramiko.BadHostKeyException:
                 log.error("Invalid Host key")
@@ -306,7 +418,7 @@ class RemoteMachineShellConnection:
             except Exception as e:
                 if str(e).find('PID check failed. RNG must be re-initialized') != -1 and\
                         attempt != max_attempts_connect:
-                    log.error("Can't establish SSH session to node {1} as root:\
+                    log.error("Can't establish SSH session to node {1} :\
                               {0}. Will try again in 1 sec".format(e, self.ip))
                     attempt += 1
                     time.sleep(1)
@@ -314,7 +426,36 @@ class RemoteMachineShellConnection:
                     log.error("Can't establish SSH session to node {1} :\
                                                    {0}".format(e, self.ip))
                     exit(1)
-        log.info("Connected to {0} as {1}".format(self.ip, user))
+        log.info("Connected to {0} as {1}".format(self.ip, username))
+        return ssh_client
+
+    def _acquire_ssh_client(self, username, ssh_key=None):
+        """Takes a session for username from the process-wide SSH_POOL,
+        giving back the one this connection held before."""
+        if ssh_key is None:
+            ssh_key = self.ssh_key
+        pool_key = (self.ip, username, ssh_key)
+        ssh_client = SSH_POOL.acquire(pool_key, lambda: self._connect(username, ssh_key))
+        self._release_ssh_client()
+        self._ssh_client = ssh_client
+        self._pool_key = pool_key
+
+    def _release_ssh_client(self):
+        if self._pool_key is not None:
+            SSH_POOL.release(self._pool_key, self._ssh_client)
+            self._pool_key = None
+
+    """
+        In case of non root user, we need to switch to root to
+        run command
+    """
+    def connect_with_user(self, user="root"):
+        if self.info.distribution_type.lower() == "mac":
+            log.info("This is Mac Server.  Skip re-connect to it as %s" % user)
+            return
+        log.info("Connect to node: %s as user: %s" % (self.ip, user))
+        if self.remote and self.ssh_key == '':
+            self._acquire_ssh_client(user, ssh_key='')
 
     def sleep(self, timeout=1, message=""):
         log.info("{0}:sleep for {1} secs. {2} ...".format(self.ip, timeout, message))
@@ -3281,6 +3422,30 @@ class RemoteMachineShellConnection:
             log.info('command executed successfully')
         return output, error
 
+    def execute_command_status(self, command, debug=True, timeout=600):
+        """Runs command and returns (output, error, exit_status), where output
+        and error are lists of lines."""
+        if debug:
+            log.info("running command on {0}: {1}".format(self.ip, command))
+        if not self.remote:
+            p = Popen(command, shell=True, stdout=PIPE, stderr=PIPE)
+            output, error = p.communicate()
+            return output.splitlines(), error.splitlines(), p.returncode
+        channel = self._ssh_client.get_transport().open_session()
+        try:
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            stdout = channel.makefile('rb')
+            stderro = channel.makefile_stderr('rb')
+            output = stdout.read().splitlines()
+            error = stderro.read().splitlines()
+            exit_status = channel.recv_exit_status()
+        finally:
+            channel.close()
+        if debug:
+            log.info("command on {0} exited with {1}".format(self.ip, exit_status))
+        return output, error, exit_status
+
     def execute_non_sudo_command(self, command, info=None, debug=True, use_channel=False):
         info = info or self.extract_remote_info()
         self.info = info
@@ -3306,21 +3471,46 @@ class RemoteMachineShellConnection:
                 self.log_command_output(o, r, debug=False)
 
     def disconnect(self):
-        self._ssh_client.close()
+        if self._pool_key is not None:
+            # the session stays open in SSH_POOL for the next connection
+            self._release_ssh_client()
+        else:
+            self._ssh_client.close()
 
     def extract_remote_info(self):
+        self.use_sudo = False
+        if getattr(self, "info", None) is not None and isinstance(self.info, RemoteMachineInfo):
+            return self.info
+        # the os of a node doesn't change during a run, so only the first
+        # connection to each node runs the detection commands
+        with RemoteMachineShellConnection._info_cache_lock:
+            info = RemoteMachineShellConnection._info_cache.get(self.ip)
+        if info is not None:
+            self.info = copy.copy(info)
+            return self.info
+        self.info = self._extract_remote_info()
+        with RemoteMachineShellConnection._info_cache_lock:
+            RemoteMachineShellConnection._info_cache[self.ip] = copy.copy(self.info)
+        return self.info
+
+    @staticmethod
+    def clear_remote_info_cache(ip=None):
+        with RemoteMachineShellConnection._info_cache_lock:
+            if ip is None:
+                RemoteMachineShellConnection._info_cache.clear()
+            else:
+                RemoteMachineShellConnection._info_cache.pop(ip, None)
+
+    def _extract_remote_info(self):
         # initialize params
         os_distro = "linux"
         os_version = "default"
         is_linux_distro = True
-        self.use_sudo = False
         is_mac = False
         arch = "local"
         ext = "local"
         # use ssh to extract remote machine info
         # use sftp to if certain types exists or not
-        if getattr(self, "info", None) is not None and isinstance(self.info, RemoteMachineInfo):
-            return self.info
         mac_check_cmd = "sw_vers | grep ProductVersion | awk '{ print $2 }'"
         if self.remote:
             stdin, stdout, stderro = self._ssh_client.exec_command(mac_check_cmd)
@@ -4075,6 +4265,115 @@ class RemoteMachineShellConnection:
 
     def get_data_map_using_cbtransfer(self, buckets, data_path=None, userId="Administrator",
                                       password="password", getReplica=False, mode="memory"):
+        headerInfo = ""
+        bucketMap = {}
+        files = self.get_data_files_using_cbtransfer(buckets, data_path=data_path, userId=userId,
+                                                     password=password, getReplica=getReplica,
+                                                     mode=mode)
+        for bucket_name, dest_path in files.iteritems():
+            with open(dest_path) as f:
+                headerInfo = f.readline()
+                content = f.readlines()
+            bucketMap[bucket_name] = content
+            os.remove(dest_path)
+        return headerInfo, bucketMap
+
+    def get_data_files_using_cbtransfer(self, buckets, data_path=None, userId="Administrator",
+                                        password="password", getReplica=False, mode="memory",
+                                        local_dir="/tmp/"):
+        """Runs cbtransfer on the node for every bucket and copies the CSV dumps
+        to local_dir without reading them. Returns {bucket name: local path},
+        the caller is responsible for removing the files."""
+        files = {}
+        dumps = self._dump_buckets_using_cbtransfer(buckets, data_path=data_path, userId=userId,
+                                                    password=password, getReplica=getReplica,
+                                                    mode=mode)
+        for bucket_name, path in dumps.iteritems():
+            dest_path = os.path.join(local_dir, os.path.basename(path))
+            self.copy_file_remote_to_local(path, dest_path)
+            self.delete_files(path)
+            files[bucket_name] = dest_path
+        return files
+
+    def get_vbucket_digests_using_cbtransfer(self, buckets, data_path=None, userId="Administrator",
+                                             password="password", getReplica=False, mode="memory"):
+        """Runs cbtransfer on the node and computes per-vbucket digests of the dump
+        there with couchbase_helper/vbucket_digest.py, so only the digests are
+        transferred. Falls back to copying the dump and digesting it locally when
+        the node can't run the script. Returns {bucket name: {vbucket: digest}}."""
+        digests = {}
+        dumps = self._dump_buckets_using_cbtransfer(buckets, data_path=data_path, userId=userId,
+                                                    password=password, getReplica=getReplica,
+                                                    mode=mode)
+        for bucket_name, path in dumps.iteritems():
+            try:
+                output, error = self._run_vbucket_digest(path)
+                if output is not None:
+                    digests[bucket_name] = json.loads(output)
+                else:
+                    log.warn("digest script failed on {0}, digesting locally: {1}".format(self.ip, error))
+                    fd, dest_path = tempfile.mkstemp(suffix=".csv")
+                    os.close(fd)
+                    try:
+                        self.copy_file_remote_to_local(path, dest_path)
+                        digests[bucket_name] = vbucket_digest.digest_csv(dest_path)
+                    finally:
+                        os.remove(dest_path)
+            finally:
+                self.delete_files(path)
+        return digests
+
+    def get_vbucket_rows_using_cbtransfer(self, buckets, vbuckets, data_path=None, userId="Administrator",
+                                          password="password", getReplica=False, mode="memory",
+                                          local_dir="/tmp/"):
+        """Like get_data_files_using_cbtransfer, but only the rows of the given
+        vbuckets ({bucket name: [vbucket, ...]}) are copied back."""
+        buckets = [bucket for bucket in buckets if vbuckets.get(bucket.name)]
+        files = {}
+        dumps = self._dump_buckets_using_cbtransfer(buckets, data_path=data_path, userId=userId,
+                                                    password=password, getReplica=getReplica,
+                                                    mode=mode)
+        for bucket_name, path in dumps.iteritems():
+            vb_list = [str(vb) for vb in vbuckets[bucket_name]]
+            dest_path = os.path.join(local_dir, os.path.basename(path))
+            rows_path = path[:-len(".csv")] + "_rows.csv"
+            try:
+                output, error = self._run_vbucket_digest(path, "--rows %s %s" % (",".join(vb_list), rows_path))
+                if output is not None:
+                    self.copy_file_remote_to_local(rows_path, dest_path)
+                    self.delete_files(rows_path)
+                else:
+                    log.warn("digest script failed on {0}, filtering locally: {1}".format(self.ip, error))
+                    self.copy_file_remote_to_local(path, dest_path + ".all")
+                    vbucket_digest.copy_vbucket_rows(dest_path + ".all", vb_list, dest_path)
+                    os.remove(dest_path + ".all")
+            finally:
+                self.delete_files(path)
+            files[bucket_name] = dest_path
+        return files
+
+    def _run_vbucket_digest(self, csv_path, args=""):
+        """Runs vbucket_digest.py on the node, returns (output, None) or
+        (None, error) if the node has no usable python."""
+        self.extract_remote_info()
+        if self.info.type.lower() == 'windows':
+            return None, "not supported on windows"
+        script = os.path.join(os.path.dirname(csv_path),
+                              "vbucket_digest_{0}.py".format(uuid.uuid1()))
+        self.copy_file_local_to_remote(vbucket_digest.__file__.replace(".pyc", ".py"), script)
+        command = "PY=$(command -v python3 || command -v python) && $PY {0} {1} {2}"\
+                  .format(script, csv_path, args)
+        try:
+            output, error, exit_status = self.execute_command_status(command, debug=False)
+        finally:
+            self.delete_files(script)
+        if exit_status != 0:
+            return None, error
+        return "".join(output), None
+
+    def _dump_buckets_using_cbtransfer(self, buckets, data_path=None, userId="Administrator",
+                                       password="password", getReplica=False, mode="memory"):
+        """Runs cbtransfer to CSV on the node, returns {bucket name: remote path}"""
         self.extract_remote_info()
         temp_path = "/tmp/"
         if self.info.type.lower() == 'windows':
@@ -4091,10 +4390,7 @@ class RemoteMachineShellConnection:
         elif mode == "backup":
             source = data_path
             fileName = ""
-        # Initialize Output
-        bucketMap = {}
-        headerInfo = ""
-        # Iterate per bucket and generate maps
+        dumps = {}
         for bucket in buckets:
             if data_path == None:
                 options = " -b " + bucket.name + " -u " + userId + " -p " + password + \
@@ -4110,23 +4406,12 @@ class RemoteMachineShellConnection:
             csv_path = temp_path + fileName
             if self.info.type.lower() == 'windows':
                 csv_path = WIN_TMP_PATH_RAW + fileName
-            path = temp_path + genFileName
-            dest_path = "/tmp/" + fileName
             destination = "csv:" + csv_path
             log.info("Run cbtransfer to get data map")
             self.execute_cbtransfer(source, destination, options)
-            file_existed = self.file_exists(temp_path, genFileName)
-            if file_existed:
-                self.copy_file_remote_to_local(path, dest_path)
-                self.delete_files(path)
-                content = []
-                headerInfo = ""
-                with open(dest_path) as f:
-                    headerInfo = f.readline()
-                    content = f.readlines()
-                bucketMap[bucket.name] = content
-                os.remove(dest_path)
-        return headerInfo, bucketMap
+            if self.file_exists(temp_path, genFileName):
+                dumps[bucket.name] = temp_path + genFileName
+        return dumps
 
     def execute_cbtransfer(self, source, destination, command_options=''):
         transfer_command = "%scbtransfer" % (LINUX_COUCHBASE_BIN_PATH)
@@ -5080,3 +5365,200 @@ class RemoteUtilHelper(object):
                 is_txt_found = True
                 break
         return is_txt_found
+
+
+class NodeResult(object):
+    """Outcome of one node's share of a RemoteClusterExecutor run."""
+
+    def __init__(self, server):
+        self.server = server
+        self.ip = server.ip
+        # cluster_run nodes share an ip and differ by port
+        self.node = node_key(server)
+        self.output = []
+        self.error = []
+        self.exit_status = None
+        self.result = None
+        self.exception = None
+        self.timed_out = False
+        self.start_time = None
+        self.elapsed = 0.0
+        self.done = False
+
+    @property
+    def ok(self):
+        return self.exception is None and not self.timed_out \
+            and self.exit_status in (None, 0)
+
+    def __repr__(self):
+        if self.timed_out:
+            state = "timed out"
+        elif self.exception is not None:
+            state = "failed: {0}".format(self.exception)
+        else:
+            state = "exit status {0}".format(self.exit_status)
+        return "<{0} {1} in {2:.1f}s>".format(self.node, state, self.elapsed)
+
+
+def node_key(server):
+    return "{0}:{1}".format(server.ip, server.port)
+
+
+class NodeResults(dict):
+    """NodeResult per server, keyed by "ip:port"."""
+
+    def failed(self):
+        return dict((node, result) for node, result in self.iteritems() if not result.ok)
+
+    def raise_on_failure(self, message="remote operation failed"):
+        failed = self.failed()
+        if failed:
+            raise Exception("{0} on {1} of {2} nodes: {3}".format(
+                message, len(failed), len(self), sorted(failed.values(), key=lambda r: r.node)))
+        return self
+
+
+class RemoteClusterExecutor(object):
+    """Runs the same or per-node shell work on many nodes concurrently.
+
+    Each node gets its own RemoteMachineShellConnection (sessions come from
+    SSH_POOL) and at most max_workers nodes are worked on at once, so a
+    node-wide operation takes about as long as the slowest node instead of
+    the sum over all nodes. A node still running after timeout seconds is
+    reported as timed out and no longer waited for. Failures never stop the
+    other nodes; check the returned NodeResults, e.g. with raise_on_failure().
+
+        executor = RemoteClusterExecutor(self.servers)
+        results = executor.execute_command("df -h").raise_on_failure()
+    """
+
+    MAX_WORKERS = 16
+
+    def __init__(self, servers, max_workers=MAX_WORKERS, timeout=600):
+        self.servers = list(servers)
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def run(self, func, servers=None, timeout=None):
+        """Calls func(shell, server) on every server and stores its return
+        value in NodeResult.result. Returns NodeResults keyed by ip:port."""
+        servers = self.servers if servers is None else list(servers)
+        timeout = self.timeout if timeout is None else timeout
+        results = NodeResults()
+        jobs = Queue.Queue()
+        cond = threading.Condition()
+        for server in servers:
+            result = NodeResult(server)
+            results[node_key(server)] = result
+            jobs.put(result)
+        if not servers:
+            return results
+
+        def worker():
+            while True:
+                try:
+                    result = jobs.get_nowait()
+                except Queue.Empty:
+                    return
+                with cond:
+                    result.start_time = time.time()
+                    cond.notify_all()
+                value, exception = None, None
+                shell = None
+                try:
+                    shell = RemoteMachineShellConnection(result.server)
+                    value = func(shell, result.server)
+                except (Exception, SystemExit) as e:
+                    exception = e
+                finally:
+                    if shell is not None:
+                        shell.disconnect()
+                with cond:
+                    if not result.timed_out:
+                        result.result, result.exception = value, exception
+                        result.elapsed = time.time() - result.start_time
+                        result.done = True
+                    cond.notify_all()
+                if exception is not None and not result.timed_out:
+                    log.error("{0}: {1}".format(result.node, exception))
+
+        def start_worker():
+            t = threading.Thread(target=worker, name="remote_executor")
+            t.daemon = True
+            t.start()
+
+        for _ in range(min(self.max_workers, len(servers))):
+            start_worker()
+        with cond:
+            while True:
+                pending = [r for r in results.itervalues() if not r.done]
+                if not pending:
+                    break
+                now = time.time()
+                wait_time = timeout
+                expired = False
+                for result in pending:
+                    if result.start_time is None:
+                        continue
+                    remaining = result.start_time + timeout - now
+                    if remaining <= 0:
+                        result.timed_out = expired = True
+                        result.done = True
+                        result.elapsed = now - result.start_time
+                        log.error("{0}: timed out after {1}s".format(result.node, timeout))
+                        # the hung worker keeps its thread, start another one
+                        # so the nodes still queued are not starved
+                        start_worker()
+                    else:
+                        wait_time = min(wait_time, remaining)
+                if not expired:
+                    cond.wait(max(wait_time, 0.1))
+        return results
+
+    def execute_command(self, command, servers=None, timeout=None, debug=True):
+        """Runs command on every server. command is either one command for
+        all nodes, a dict of ip:port or ip to command or a callable(server) returning
+        the command. Fills output, error and exit_status of each NodeResult."""
+        timeout = self.timeout if timeout is None else timeout
+
+        def _execute(shell, server):
+            if isinstance(command, dict):
+                node = node_key(server)
+                cmd = command[node] if node in command else command[server.ip]
+            elif callable(command):
+                cmd = command(server)
+            else:
+                cmd = command
+            return shell.execute_command_status(cmd, debug=debug, timeout=timeout)
+
+        results = self.run(_execute, servers=servers, timeout=timeout)
+        for result in results.itervalues():
+            if result.result is not None:
+                result.output, result.error, result.exit_status = result.result
+        return results
+
+    def copy_file_local_to_remote(self, src_path, des_path, servers=None, timeout=None):
+        """Uploads src_path to des_path on every server."""
+        def _put(shell, server):
+            sftp = shell._ssh_client.open_sftp()
+            try:
+                sftp.put(src_path, des_path)
+            finally:
+                sftp.close()
+            return des_path
+        return self.run(_put, servers=servers, timeout=timeout)
+
+    def get_file(self, remote_path, local_dir, servers=None, timeout=None):
+        """Downloads remote_path from every server into local_dir as
+        <ip>.<port>-<file name>. NodeResult.result is the local path."""
+        def _get(shell, server):
+            local_path = os.path.join(local_dir, "{0}-{1}".format(
+                node_key(server).replace('[', '').replace(']', '').replace(':', '.'),
+                os.path.basename(remote_path)))
+            sftp = shell._ssh_client.open_sftp()
+            try:
+                sftp.get(remote_path, local_path)
+            finally:
+                sftp.close()
+            return local_path
+        return self.run(_get, servers=servers, timeout=timeout)
@@ -632,6 +632,16 @@ class SDKSmartClient(object):
       def delete(self, key, collection=None):
           return self.client.remove(key)
 
+      def deleteMulti(self, keys_lst, collection=None):
+          deleted = {}
+          errors = {}
+          for key in keys_lst:
+              try:
+                  deleted[key] = self.client.remove(key)
+              except Exception as error:
+                  errors[key] = error
+          return deleted, errors
+
 class SDKBasedKVStoreAwareSmartClient(SDKSmartClient):
     def __init__(self, rest, bucket, kv_store=None, info=None, store_enabled=True):
         SDKSmartClient.__init__(self, rest, bucket, info)
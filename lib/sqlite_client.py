@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Python based SQLite interface
+"""
+import os
+import sqlite3
+
+# MySQL TINYINT(1) and DECIMAL(10,0) columns come back as bool and int
+# the way mysql.connector values are converted for the RQG comparisons
+sqlite3.register_converter("TINYINT", lambda value: bool(int(value)))
+sqlite3.register_converter("DECIMAL", lambda value: int(round(float(value), 0)))
+
+
+class SQLiteClient(object):
+    """Python SQLiteClient Client Implementation for testrunner, with the
+    same connection and query methods as MySQLClient. A database is the
+    file <database>.db in directory."""
+    def __init__(self, database=None, directory="/tmp"):
+        self.database = database
+        self.directory = directory
+        self._set_sqlite_client(self.database)
+
+    def _database_path(self, database):
+        if not database:
+            return ":memory:"
+        return os.path.join(self.directory, "{0}.db".format(database))
+
+    def _reset_client_connection(self):
+        self._close_connection()
+        self._set_sqlite_client(self.database)
+
+    def _set_sqlite_client(self, database=None):
+        self.sqlite_client = sqlite3.connect(self._database_path(database), timeout=60,
+                                             detect_types=sqlite3.PARSE_DECLTYPES,
+                                             check_same_thread=False)
+
+    def _close_connection(self):
+        self.sqlite_client.close()
+
+    def _insert_execute_query(self, query=""):
+        try:
+            self.sqlite_client.execute(query)
+            self.sqlite_client.commit()
+        except Exception, ex:
+            print ex
+            raise
+
+    def _db_execute_query(self, query=""):
+        try:
+            self.sqlite_client.executescript(query)
+        except Exception, ex:
+            print ex
+            raise
+
+    def _execute_query(self, query=""):
+        cur = self.sqlite_client.cursor()
+        try:
+            cur.execute(query)
+            rows = cur.fetchall()
+            columns = []
+            for index, row in enumerate(cur.description or []):
+                columns.append({"column_name": row[0], "type": self._column_type(rows, index)})
+        finally:
+            cur.close()
+        return columns, rows
+
+    @staticmethod
+    def _column_type(rows, index):
+        # sqlite has no result column types, name them after the values
+        # the way mysql.connector's FieldType does
+        for row in rows:
+            value = row[index]
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                return "tiny"
+            if isinstance(value, (int, long)):
+                return "longlong"
+            if isinstance(value, float):
+                return "double"
+            return "var_string"
+        return "null"
+
+    def _execute_sub_query(self, query=""):
+        row_subquery = []
+        cur = self.sqlite_client.cursor()
+        cur.execute(query)
+        rows = cur.fetchall()
+        for row in rows:
+            if len(rows) == 1:
+                return row[0]
+            row_subquery.append(row[0])
+        return row_subquery
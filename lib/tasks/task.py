@@ -9,7 +9,10 @@ import json
 import re
 import math
 import crc32
+import shutil
+import tempfile
 import traceback
+import Queue
 import testconstants
 from httplib import IncompleteRead
 from threading import Thread
@@ -17,12 +20,16 @@ from memcacheConstants import ERR_NOT_FOUND,NotFoundError
 from membase.api.rest_client import RestConnection, Bucket, RestHelper
 from membase.api.exception import BucketCreationException
 from membase.helper.bucket_helper import BucketOperationHelper
-from memcached.helper.data_helper import KVStoreAwareSmartClient, MemcachedClientHelper
-from memcached.helper.kvstore import KVStore
+from memcached.helper.data_helper import KVStoreAwareSmartClient
+from memcached.helper.kvstore import KVRecordWriter
+from memcached.helper.stats_snapshot import STATS_CACHE
 from couchbase_helper.document import DesignDocument, View
 from mc_bin_client import MemcachedError, MemcachedClient
 from tasks.future import Future
 from couchbase_helper.stats_tools import StatsCommon
+from couchbase_helper.document_corpus import DOCS_CACHE
+from couchbase_helper.view_index import VIEW_INDEXES, cmp_result_rows
+from couchbase_helper.query_compare import ORACLE_RESULTS, submit
 from membase.api.exception import N1QLQueryException, DropIndexException, CreateIndexException, DesignDocCreationException, QueryViewException, ReadDocumentException, RebalanceFailedException, \
                                     GetBucketInfoFailed, CompactViewFailed, SetViewInfoNotFound, FailoverFailedException, \
                                     ServerUnavailableException, BucketFlushFailed, CBRecoveryFailedException, BucketCompactionException, AutoFailoverException
@@ -32,7 +39,8 @@ from TestInput import TestInputServer, TestInputSingleton
 from testconstants import MIN_KV_QUOTA, INDEX_QUOTA, FTS_QUOTA, COUCHBASE_FROM_4DOT6,\
                           THROUGHPUT_CONCURRENCY, ALLOW_HTP, CBAS_QUOTA, COUCHBASE_FROM_VERSION_4,\
                           CLUSTER_QUOTA_RATIO
-from multiprocessing import Process, Manager, Semaphore
+from multiprocessing import Process, Semaphore
+from multiprocessing import Queue as ProcessQueue
 import memcacheConstants
 from membase.api.exception import CBQError
 
@@ -371,6 +379,7 @@ class BucketDeleteTask(Task):
         try:
             rest = RestConnection(self.server)
             if rest.delete_bucket(self.bucket):
+                STATS_CACHE.forget_bucket(self.bucket.name if isinstance(self.bucket, Bucket) else self.bucket)
                 self.state = CHECKING
                 task_manager.schedule(self)
             else:
@@ -609,7 +618,6 @@ class StatsWaitTask(Task):
         self.stat = stat
         self.comparison = comparison
         self.value = value
-        self.conns = {}
 
     def execute(self, task_manager):
         self.state = CHECKING
@@ -619,8 +627,8 @@ class StatsWaitTask(Task):
         stat_result = 0
         for server in self.servers:
             try:
-                client = self._get_connection(server)
-                stats = client.stats(self.param)
+                # shared with the other waits on the node and bucket
+                stats = STATS_CACHE.get(server, self.bucket, self.param)
                 if not stats.has_key(self.stat):
                     self.state = FINISHED
                     self.set_exception(Exception("Stat {0} not found".format(self.stat)))
@@ -640,29 +648,12 @@ class StatsWaitTask(Task):
             return
         self.log.info("Saw %s %s %s %s expected on %s,%s bucket" % (self.stat, stat_result,
                       self.comparison, self.value, self._stringify_servers(), self.bucket))
-
-        for server, conn in self.conns.items():
-            conn.close()
         self.state = FINISHED
         self.set_result(True)
 
     def _stringify_servers(self):
         return ''.join([`server.ip + ":" + str(server.port)` for server in self.servers])
 
-    def _get_connection(self, server, admin_user='cbadminbucket',admin_pass='password'):
-        if not self.conns.has_key(server):
-            for i in xrange(3):
-                try:
-                    self.conns[server] = MemcachedClientHelper.direct_client(server, self.bucket, admin_user=admin_user,
-                                                                             admin_pass=admin_pass)
-                    return self.conns[server]
-                except (EOFError, socket.error):
-                    self.log.error("failed to create direct client, retry in 1 sec")
-                    time.sleep(1)
-            self.conns[server] = MemcachedClientHelper.direct_client(server, self.bucket, admin_user=admin_user,
-                                                                     admin_pass=admin_pass)
-        return self.conns[server]
-
     def _compare(self, cmp_type, a, b):
         if isinstance(b, (int, long)) and a.isdigit():
             a = long(a)
@@ -702,9 +693,6 @@ class XdcrStatsWaitTask(StatsWaitTask):
             return
         self.log.info("Saw %s %s %s %s expected on %s,%s bucket" % (self.stat, stat_result,
                       self.comparison, self.value, self._stringify_servers(), self.bucket))
-
-        for server, conn in self.conns.items():
-            conn.close()
         self.state = FINISHED
         self.set_result(True)
 
@@ -725,14 +713,12 @@ class GenericLoadingTask(Thread, Task):
         else:
             self.client = VBucketAwareMemcached(RestConnection(server), bucket, compression=compression)
         self.process_concurrency = THROUGHPUT_CONCURRENCY
-        # task queue's for synchronization
-        process_manager = Manager()
-        self.wait_queue = process_manager.Queue()
-        self.shared_kvstore_queue = process_manager.Queue()
 
     def execute(self, task_manager):
-        self.start()
+        # the loop runs on the task manager's bounded blocking pool, cancel()
+        # stops it before its next item
         self.state = EXECUTING
+        task_manager.run_blocking(self, self.run)
 
     def check(self, task_manager):
         pass
@@ -741,7 +727,8 @@ class GenericLoadingTask(Thread, Task):
         while self.has_next() and not self.done():
             self.next()
         self.state = FINISHED
-        self.set_result(True)
+        if not self.done():
+            self.set_result(True)
 
     def has_next(self):
         raise NotImplementedError
@@ -912,22 +899,34 @@ class GenericLoadingTask(Thread, Task):
             self.set_exception(error)
 
 
+    def _get_meta_data_batch(self, client, keys, collection=None):
+        """Fetch metadata for keys with one pipelined getMetaMulti call.
+        Returns a dict of key to metadata dict and a dict of key to error."""
+        metas, errors = client.getMetaMulti(keys, collection=collection)
+        meta_data = dict((key, dict(zip(('deleted', 'flags', 'expiration', 'seqno', 'cas'), meta)))
+                         for key, meta in metas.iteritems())
+        return meta_data, errors
+
     def _delete_batch(self, partition_keys_dic, key_val):
+        keys = [key for keys in partition_keys_dic.values() for key in keys]
+        try:
+            deleted, errors = self.client.deleteMulti(keys, collection=self.collection)
+        except (MemcachedError, ServerUnavailableException, socket.error, EOFError, AttributeError) as error:
+            self.state = FINISHED
+            self.set_exception(error)
+            return
         for partition, keys in partition_keys_dic.items():
             for key in keys:
-                try:
-                    self.client.delete(key, collection=self.collection)
+                if key in deleted:
                     partition.delete(key)
-                except MemcachedError as error:
-                    if error.status == ERR_NOT_FOUND and partition.get_valid(key) is None:
-                        pass
-                    else:
-                        self.state = FINISHED
-                        self.set_exception(error)
-                        return
-                except (ServerUnavailableException, socket.error, EOFError, AttributeError) as error:
-                    self.state = FINISHED
-                    self.set_exception(error)
+                    continue
+                error = errors[key]
+                if isinstance(error, MemcachedError) and error.status == ERR_NOT_FOUND \
+                        and partition.get_valid(key) is None:
+                    continue
+                self.state = FINISHED
+                self.set_exception(error)
+                return
 
 
     def _read_batch(self, partition_keys_dic, key_val):
@@ -1104,7 +1103,8 @@ class LoadDocumentsGeneratorsTask(LoadDocumentsTask):
             self.run_normal_throughput_mode()
 
         self.state = FINISHED
-        self.set_result(True)
+        if not self.done():
+            self.set_result(True)
 
     def run_normal_throughput_mode(self):
         iterator = 0
@@ -1139,47 +1139,79 @@ class LoadDocumentsGeneratorsTask(LoadDocumentsTask):
                 self.generators.append(batch_gen)
 
 
-        iterator = 0
-        all_processes = []
-        for generator in self.generators:
-
-            # only start processing when there resources available
-            CONCURRENCY_LOCK.acquire()
-
-            generator_process = Process(
-                target=self.run_generator,
-                args=(generator, iterator))
-            generator_process.start()
-            iterator += 1
-            all_processes.append(generator_process)
-
-            # add child process to wait queue
-            self.wait_queue.put(iterator)
-
-        # wait for all child processes to finish
-        self.wait_queue.join()
-
-        # merge kvstore partitions
-        while self.shared_kvstore_queue.empty() is False:
-
-            # get partitions created by child process
-            rv =  self.shared_kvstore_queue.get()
-            if rv["err"] is not None:
-                raise Exception(rv["err"])
-
-            # merge child partitions with parent
-            generator_partitions = rv["partitions"]
-            self.kv_store.merge_partitions(generator_partitions)
-
-            # terminate child process
-            iterator-=1
-            all_processes[iterator].terminate()
-
-    def run_generator(self, generator, iterator):
-
-        tmp_kv_store = KVStore()
-        rv = {"err": None, "partitions": None}
+        # a fixed pool of forked workers takes the slices from a queue, each
+        # worker writes the items it loaded to its own record file and the
+        # parent merges a file as soon as its worker is done
+        slices = ProcessQueue()
+        results = ProcessQueue()
+        num_workers = min(self.process_concurrency, len(self.generators))
+        for iterator in range(len(self.generators)):
+            slices.put(iterator)
+        for _ in range(num_workers):
+            slices.put(None)
+
+        record_dir = tempfile.mkdtemp(prefix="kvstore_records_")
+        workers = []
+        errors = []
+        try:
+            for worker_id in range(num_workers):
+                path = os.path.join(record_dir, "worker-{0}".format(worker_id))
+                worker = Process(target=self.run_generator_worker,
+                                 args=(slices, results, path))
+                worker.start()
+                workers.append(worker)
+
+            pending = num_workers
+            while pending:
+                try:
+                    rv = results.get(timeout=5)
+                except Queue.Empty:
+                    if not any(worker.is_alive() for worker in workers) and results.empty():
+                        errors.append("{0} loader processes exited without a result".format(pending))
+                        break
+                    continue
+                pending -= 1
+                if rv["err"] is not None:
+                    errors.append(rv["err"])
+                if rv["path"] is not None:
+                    self.kv_store.merge_record_file(rv["path"])
+        finally:
+            for worker in workers:
+                worker.join(30)
+                if worker.is_alive():
+                    worker.terminate()
+            shutil.rmtree(record_dir, ignore_errors=True)
+        if errors:
+            raise Exception(errors[0])
+
+    def run_generator_worker(self, slices, results, path):
+        """
+            loads generator slices taken from the slices queue until it
+            gets None, then reports the record file with its items
+        """
+        rv = {"err": None, "path": None}
+        writer = None
+        try:
+            writer = KVRecordWriter(path, self.kv_store)
+            while rv["err"] is None:
+                iterator = slices.get()
+                if iterator is None:
+                    break
+                rv["err"] = self.run_generator(self.generators[iterator], iterator, writer)
+            writer.close()
+            rv["path"] = path
+        except Exception as ex:
+            rv["err"] = "{0}: {1}".format(ex.__class__.__name__, ex)
+        finally:
+            results.put(rv)
 
+    def run_generator(self, generator, iterator, writer):
+        """
+            loads one generator slice and records its items with writer,
+            returns an error message or None
+        """
+        # only start processing when there resources available
+        CONCURRENCY_LOCK.acquire()
         try:
 
             if CHECK_FLAG:
@@ -1203,35 +1235,35 @@ class LoadDocumentsGeneratorsTask(LoadDocumentsTask):
                 self._create_batch_client(key_value, client)
 
                 # cache
-                self.cache_items(tmp_kv_store, key_value)
+                self.cache_items(writer, key_value)
 
+            if CHECK_FLAG:
+                client.done()
+            if self._exception is not None:
+                return "{0}: {1}".format(self._exception.__class__.__name__, self._exception)
         except Exception as ex:
-            rv["err"] = ex
-        else:
-            rv["partitions"] = tmp_kv_store.get_partitions()
+            return "{0}: {1}".format(ex.__class__.__name__, ex)
         finally:
-            # share the kvstore from this generator
-            self.shared_kvstore_queue.put(rv)
-            self.wait_queue.task_done()
             # release concurrency lock
             CONCURRENCY_LOCK.release()
-
+        return None
 
     def cache_items(self, store, key_value):
         """
-            unpacks keys,values and adds them to provided store
+            unpacks keys,values and adds them to provided KVRecordWriter
         """
         for key, value in key_value.iteritems():
 
             if self.only_store_hash:
                 value = str(crc32.crc32_hash(value))
 
-            partition = store.partition(key,self.collection,self.bucket)
-            partition["partition"].set(
+            store.set(
             key,
             value,
             self.exp,
-            self.flag)
+            self.flag,
+            bucket=self.bucket,
+            collection=self.collection)
 
 
 class ESLoadGeneratorTask(Task):
@@ -1281,48 +1313,59 @@ class ESBulkLoadGeneratorTask(Task):
         self.op_type = op_type
         self.batch_size = batch
         self.collection=collection
+        self.failed = 0
+        self.errors = []
         self.log.info("Starting operation '%s' on Elastic Search ..." % op_type)
 
     def check(self, task_manager):
-        self.state = FINISHED
-        self.set_result(True)
+        pass
 
     def execute(self, task_manager):
-        es_filename = "/tmp/es_bulk.txt"
-        es_bulk_docs = []
-        loaded = 0
-        batched = 0
-        for key, doc in self.generator:
-            doc = json.loads(doc)
-            es_doc = {
-                self.op_type: {
-                    "_index": self.index_name,
-                    "_type": doc['type'],
-                    "_id": key,
-                }
-            }
-            es_bulk_docs.append(json.dumps(es_doc))
-            if self.op_type == "create":
-                es_bulk_docs.append(json.dumps(doc))
-            elif self.op_type == "update":
-                doc['mutated'] += 1
-                es_bulk_docs.append(json.dumps({"doc": doc}))
-            batched += 1
-            if batched == self.batch_size or not self.generator.has_next():
-                es_file = open(es_filename, "wb")
-                for line in es_bulk_docs:
-                    es_file.write("%s\n" %line)
-                es_file.close()
-                self.es_instance.load_bulk_data(es_filename)
-                loaded += batched
-                self.log.info("{0} documents bulk loaded into ES".format(loaded))
-                self.es_instance.update_index(self.index_name)
-                batched = 0
+        # the bulk requests wait on ES, keep them off the scheduler thread
+        self.state = EXECUTING
+        task_manager.run_blocking(self, self.run)
+
+    def run(self):
+        _, self.failed, self.errors = self.es_instance.bulk_load_generator(
+            self.index_name, self.generator, self.op_type, self.batch_size)
         indexed = self.es_instance.get_index_count(self.index_name)
         self.log.info("ES index count for '{0}': {1}".
                               format(self.index_name, indexed))
         self.state = FINISHED
-        self.set_result(True)
+        if not self.done():
+            self.set_result(True)
+
+
+class ReferenceIndexLoadTask(Task):
+    """
+        Class to load/update/delete documents into/from a reference index
+        (pytests/fts/reference_index.py), the in-process stand in for ES
+    """
+
+    def __init__(self, es_instance, index_name, generator, op_type="create"):
+        Task.__init__(self, "Reference_index_loader_task")
+        self.es_instance = es_instance
+        self.index_name = index_name
+        self.generator = generator
+        self.op_type = op_type
+        self.log.info("Starting operation '%s' on the reference index ..." % op_type)
+
+    def check(self, task_manager):
+        pass
+
+    def execute(self, task_manager):
+        # indexing is CPU bound, keep it off the scheduler thread
+        self.state = EXECUTING
+        task_manager.run_blocking(self, self.run)
+
+    def run(self):
+        loaded = self.es_instance.load_generator(self.index_name, self.generator, self.op_type)
+        self.log.info("{0} documents '{1}' in reference index '{2}', {3} live".
+                      format(loaded, self.op_type, self.index_name,
+                             self.es_instance.get_index_count(self.index_name)))
+        self.state = FINISHED
+        if not self.done():
+            self.set_result(True)
 
 
 class ESRunQueryCompare(Task):
@@ -1341,10 +1384,15 @@ class ESRunQueryCompare(Task):
         self.n1ql_executor = n1ql_executor
 
     def check(self, task_manager):
-        self.state = FINISHED
-        self.set_result(self.result)
+        pass
 
     def execute(self, task_manager):
+        # the queries wait on the cluster and ES, keep them off the scheduler
+        # thread. The TaskManager limits how many comparisons run at once.
+        self.state = EXECUTING
+        task_manager.run_blocking(self, self.run)
+
+    def run(self):
         self.es_compare = True
         should_verify_n1ql = True
         try:
@@ -1352,6 +1400,16 @@ class ESRunQueryCompare(Task):
                           "-------------- Query # %s -------------"
                           "---------------------------------------"
                           % str(self.query_index+1))
+            # ES and N1QL are queried while FTS is, the N1QL result is only
+            # looked at if FTS or ES found something
+            es_future = None
+            if self.es and self.es_query:
+                es_future = submit(self.run_es_query, self.es_query)
+            n1ql_future = None
+            if self.n1ql_executor:
+                n1ql_query = self.n1ql_query()
+                self.log.info("Running N1QL query: "+str(n1ql_query))
+                n1ql_future = submit(self.n1ql_executor.run_n1ql_query, query=n1ql_query)
             try:
                 fts_hits, fts_doc_ids, fts_time, fts_status = \
                     self.run_fts_query(self.fts_query)
@@ -1383,8 +1441,8 @@ class ESRunQueryCompare(Task):
                 self.log.error("ERROR: FTS Query timed out (client timeout=70s)!")
                 self.passed = False
             es_hits = 0
-            if self.es and self.es_query:
-                es_hits, es_doc_ids, es_time = self.run_es_query(self.es_query)
+            if es_future:
+                es_hits, es_doc_ids, es_time = es_future.result()
                 self.log.info("ES hits for query: %s on %s is %s (took %sms)" % \
                               (json.dumps(self.es_query,  ensure_ascii=False),
                                self.es_index_name,
@@ -1416,23 +1474,7 @@ class ESRunQueryCompare(Task):
                 should_verify_n1ql = False
 
             if self.n1ql_executor and should_verify_n1ql:
-                if self.fts_index.dataset == 'all':
-                    query_type = 'emp'
-                    if int(TestInputSingleton.input.param("doc_maps", 1)) > 1:
-                        query_type = 'wiki'
-                    wiki_fields = ["revision.text", "title"]
-                    if any(field in str(json.dumps(self.fts_query)) for field in wiki_fields):
-                        query_type = 'wiki'
-                else:
-                    query_type = self.fts_index.dataset
-                geo_strings = ["geo"]
-                if any(geo_str in str(json.dumps(self.fts_query)) for geo_str in geo_strings):
-                    query_type = 'earthquake'
-
-                n1ql_query = "select meta().id from default where type='" + str(query_type) + "' and search(default, " + str(
-                    json.dumps(self.fts_query)) + ")"
-                self.log.info("Running N1QL query: "+str(n1ql_query))
-                n1ql_result = self.n1ql_executor.run_n1ql_query(query=n1ql_query)
+                n1ql_result = n1ql_future.result()
                 if n1ql_result['status'] == 'success':
                     n1ql_hits = n1ql_result['metrics']['resultCount']
                     n1ql_doc_ids = []
@@ -1469,22 +1511,44 @@ class ESRunQueryCompare(Task):
                     self.passed = False
                     self.log.info("N1QL query execution is failed.")
                     self.log.error(n1ql_result["errors"][0]['msg'])
-            self.state = CHECKING
-            task_manager.schedule(self)
 
             if not should_verify_n1ql and self.n1ql_executor:
                 self.log.info("Skipping N1QL result validation since FTS results are - "+str(fts_hits)+" and es results are - "+str(es_hits)+".")
+            self.state = FINISHED
+            if not self.done():
+                self.set_result(self.result)
 
         except Exception as e:
             self.log.error(e)
-            self.set_exception(e)
             self.state = FINISHED
+            if not self.done():
+                self.set_exception(e)
+
+    def n1ql_query(self):
+        if self.fts_index.dataset == 'all':
+            query_type = 'emp'
+            if int(TestInputSingleton.input.param("doc_maps", 1)) > 1:
+                query_type = 'wiki'
+            wiki_fields = ["revision.text", "title"]
+            if any(field in str(json.dumps(self.fts_query)) for field in wiki_fields):
+                query_type = 'wiki'
+        else:
+            query_type = self.fts_index.dataset
+        geo_strings = ["geo"]
+        if any(geo_str in str(json.dumps(self.fts_query)) for geo_str in geo_strings):
+            query_type = 'earthquake'
+
+        return "select meta().id from default where type='" + str(query_type) + "' and search(default, " + str(
+            json.dumps(self.fts_query)) + ")"
 
     def run_fts_query(self, query):
         return self.fts_index.execute_query(query)
 
     def run_es_query(self, query):
-        return self.es.search(index_name=self.es_index_name, query=query)
+        # the same query on the same data got the same ES hits before
+        return ORACLE_RESULTS.result(self.es, self.es_index_name, query,
+                                     lambda: self.es.search(index_name=self.es_index_name,
+                                                            query=query))
 
 
 # This will be obsolete with the implementation of batch operations in LoadDocumentsTaks
@@ -1551,24 +1615,6 @@ class BatchedLoadDocumentsTask(GenericLoadingTask):
             self.set_exception(error)
 
 
-    def _delete_batch(self, partition_keys_dic, key_val):
-        for partition, keys in partition_keys_dic.items():
-            for key in keys:
-                try:
-                    self.client.delete(key, collection=self.collection)
-                    partition.delete(key)
-                except MemcachedError as error:
-                    if error.status == ERR_NOT_FOUND and partition.get_valid(key) is None:
-                        pass
-                    else:
-                        self.state = FINISHED
-                        self.set_exception(error)
-                        return
-                except (ServerUnavailableException, socket.error, EOFError, AttributeError) as error:
-                    self.state = FINISHED
-                    self.set_exception(error)
-
-
     def _read_batch(self, partition_keys_dic, key_val):
         try:
             self.client.getMulti(key_val.keys(), self.pause, self.timeout, collection=self.collection)
@@ -2001,14 +2047,17 @@ class BatchedValidateDataTask(GenericLoadingTask):
 
 class VerifyRevIdTask(GenericLoadingTask):
     def __init__(self, src_server, dest_server, bucket, src_kv_store, dest_kv_store, max_err_count=200000,
-                 max_verify=None, compression=True, collection=None):
-        GenericLoadingTask.__init__(self, src_server, bucket, src_kv_store, compression=compression, collection=collection)
+                 max_verify=None, compression=True, collection=None, batch_size=1000):
+        GenericLoadingTask.__init__(self, src_server, bucket, src_kv_store, batch_size=batch_size,
+                                    compression=compression, collection=collection)
         from memcached.helper.data_helper import VBucketAwareMemcached as SmartClient
         self.collection=collection
         self.client_src = SmartClient(RestConnection(src_server), bucket)
         self.client_dest = SmartClient(RestConnection(dest_server), bucket)
         self.src_valid_keys, self.src_deleted_keys = src_kv_store.key_set(bucket=self.bucket,collection=self.collection)
         self.dest_valid_keys, self.dest_del_keys = dest_kv_store.key_set(bucket=self.bucket,collection=self.collection)
+        self.src_deleted_key_set = set(self.src_deleted_keys)
+        self.dest_key_set = set(self.dest_valid_keys + self.dest_del_keys)
         self.num_valid_keys = len(self.src_valid_keys)
         self.num_deleted_keys = len(self.src_deleted_keys)
         self.keys_not_found = {self.client.rest.ip: [], self.client_dest.rest.ip: []}
@@ -2051,29 +2100,45 @@ class VerifyRevIdTask(GenericLoadingTask):
         return False
 
     def next(self):
+        prev_itr = self.itr
+        end = min(self.itr + self.batch_size, self.max_verify)
         if self.itr < self.num_valid_keys:
-            self._check_key_revId(self.src_valid_keys[self.itr], collection=self.collection)
-        elif self.itr < (self.num_valid_keys + self.num_deleted_keys):
+            keys = self.src_valid_keys[self.itr:min(end, self.num_valid_keys)]
+            ignore_meta_data = []
+        else:
             # verify deleted/expired keys
-            self._check_key_revId(self.src_deleted_keys[self.itr - self.num_valid_keys],
-                                  ignore_meta_data=['expiration','cas'], collection=self.collection)
-        self.itr += 1
+            keys = self.src_deleted_keys[self.itr - self.num_valid_keys:end - self.num_valid_keys]
+            ignore_meta_data = ['expiration', 'cas']
+        src_meta_data = self.__get_meta_data(self.client_src, keys, collection=self.collection)
+        dest_meta_data = self.__get_meta_data(self.client_dest, keys, collection=self.collection)
+        for key in keys:
+            if self.done():
+                break
+            self._check_key_revId(key, src_meta_data.get(key), dest_meta_data.get(key),
+                                  ignore_meta_data=ignore_meta_data)
+        self.itr += len(keys)
 
         # show progress of verification for every 50k items
-        if math.fmod(self.itr, 50000) == 0.0:
+        if self.itr // 50000 > prev_itr // 50000:
             self.log.info("{0} items have been verified".format(self.itr))
 
 
-    def __get_meta_data(self, client, key, collection=None):
+    def __get_meta_data(self, client, keys, collection=None):
         try:
-            mc = client.memcached(key)
-            meta_data = eval("{'deleted': %s, 'flags': %s, 'expiration': %s, 'seqno': %s, 'cas': %s}" % (mc.getMeta(key, collection=collection)))
-            return meta_data
-        except MemcachedError as error:
+            meta_data, errors = self._get_meta_data_batch(client, keys, collection=collection)
+        # catch and set all unexpected exceptions
+        except Exception as e:
+            self.state = FINISHED
+            self.set_unexpected_exception(e)
+            return {}
+        for key in keys:
+            if key not in errors:
+                continue
+            error = errors[key]
             if error.status == ERR_NOT_FOUND:
                 # if a filter was specified, the key will not be found in
                 # target kv store if key did not match filter expression
-                if key not in self.src_deleted_keys and key in (self.dest_valid_keys+self.dest_del_keys):
+                if key not in self.src_deleted_key_set and key in self.dest_key_set:
                     self.err_count += 1
                     self.keys_not_found[client.rest.ip].append(("key: %s" % key, "vbucket: %s" % client._get_vBucket_id(key, collection=collection)))
                 else:
@@ -2081,14 +2146,10 @@ class VerifyRevIdTask(GenericLoadingTask):
             else:
                 self.state = FINISHED
                 self.set_exception(error)
-        # catch and set all unexpected exceptions
-        except Exception as e:
-            self.state = FINISHED
-            self.set_unexpected_exception(e)
+                break
+        return meta_data
 
-    def _check_key_revId(self, key, ignore_meta_data=[], collection=None):
-        src_meta_data = self.__get_meta_data(self.client_src, key, collection=collection)
-        dest_meta_data = self.__get_meta_data(self.client_dest, key, collection=collection)
+    def _check_key_revId(self, key, src_meta_data, dest_meta_data, ignore_meta_data=[]):
         if not src_meta_data or not dest_meta_data:
             return
         prev_error_count = self.err_count
@@ -2123,12 +2184,15 @@ class VerifyRevIdTask(GenericLoadingTask):
             self.state = FINISHED
 
 class VerifyMetaDataTask(GenericLoadingTask):
-    def __init__(self, dest_server, bucket, kv_store, meta_data_store, max_err_count=100, compression=True, collection=None):
-        GenericLoadingTask.__init__(self, dest_server, bucket, kv_store, compression=compression, collection=collection)
+    def __init__(self, dest_server, bucket, kv_store, meta_data_store, max_err_count=100, compression=True, collection=None,
+                 batch_size=1000):
+        GenericLoadingTask.__init__(self, dest_server, bucket, kv_store, batch_size=batch_size,
+                                    compression=compression, collection=collection)
         from memcached.helper.data_helper import VBucketAwareMemcached as SmartClient
         self.collections=collection
         self.client = SmartClient(RestConnection(dest_server), bucket)
         self.valid_keys, self.deleted_keys = kv_store.key_set(bucket=self.bucket,collection=self.collection)
+        self.deleted_key_set = set(self.deleted_keys)
         self.num_valid_keys = len(self.valid_keys)
         self.num_deleted_keys = len(self.deleted_keys)
         self.keys_not_found = {self.client.rest.ip: [], self.client.rest.ip: []}
@@ -2148,35 +2212,44 @@ class VerifyMetaDataTask(GenericLoadingTask):
         return False
 
     def next(self):
+        prev_itr = self.itr
         if self.itr < self.num_valid_keys:
-            self._check_key_meta_data(self.valid_keys[self.itr], self.collections)
-        elif self.itr < (self.num_valid_keys + self.num_deleted_keys):
+            keys = self.valid_keys[self.itr:self.itr + self.batch_size]
+            ignore_meta_data = []
+        else:
             # verify deleted/expired keys
-            self._check_key_meta_data(self.deleted_keys[self.itr - self.num_valid_keys],
-                                  ignore_meta_data=['expiration'], collection=self.collections)
-        self.itr += 1
+            start = self.itr - self.num_valid_keys
+            keys = self.deleted_keys[start:start + self.batch_size]
+            ignore_meta_data = ['expiration']
+        dest_meta_data = self.__get_meta_data(self.client, keys, collection=self.collections)
+        for key in keys:
+            if self.done():
+                break
+            self._check_key_meta_data(key, dest_meta_data.get(key), ignore_meta_data=ignore_meta_data)
+        self.itr += len(keys)
 
         # show progress of verification for every 50k items
-        if math.fmod(self.itr, 50000) == 0.0:
+        if self.itr // 50000 > prev_itr // 50000:
             self.log.info("{0} items have been verified".format(self.itr))
 
-    def __get_meta_data(self, client, key, collection=None):
-        try:
-            mc = client.memcached(key)
-            meta_data = eval("{'deleted': %s, 'flags': %s, 'expiration': %s, 'seqno': %s, 'cas': %s}" % (mc.getMeta(key, collection=collection)))
-            return meta_data
-        except MemcachedError as error:
+    def __get_meta_data(self, client, keys, collection=None):
+        meta_data, errors = self._get_meta_data_batch(client, keys, collection=collection)
+        for key in keys:
+            if key not in errors:
+                continue
+            error = errors[key]
             if error.status == ERR_NOT_FOUND:
-                if key not in self.deleted_keys:
+                if key not in self.deleted_key_set:
                     self.err_count += 1
                     self.keys_not_found[client.rest.ip].append(("key: %s" % key, "vbucket: %s" % client._get_vBucket_id(key)))
             else:
                 self.state = FINISHED
                 self.set_exception(error)
+                break
+        return meta_data
 
-    def _check_key_meta_data(self, key, ignore_meta_data=[], collection=None):
+    def _check_key_meta_data(self, key, dest_meta_data, ignore_meta_data=[]):
         src_meta_data = self.meta_data_store[key]
-        dest_meta_data = self.__get_meta_data(self.client, key, collection=collection)
         if not src_meta_data or not dest_meta_data:
             return
         prev_error_count = self.err_count
@@ -2203,12 +2276,14 @@ class VerifyMetaDataTask(GenericLoadingTask):
             self.state = FINISHED
 
 class GetMetaDataTask(GenericLoadingTask):
-    def __init__(self, dest_server, bucket, kv_store, compression=True, collection=None):
-        GenericLoadingTask.__init__(self, dest_server, bucket, kv_store, compression=compression, collection=collection)
+    def __init__(self, dest_server, bucket, kv_store, compression=True, collection=None, batch_size=1000):
+        GenericLoadingTask.__init__(self, dest_server, bucket, kv_store, batch_size=batch_size,
+                                    compression=compression, collection=collection)
         from memcached.helper.data_helper import VBucketAwareMemcached as SmartClient
         self.collection=collection
         self.client = SmartClient(RestConnection(dest_server), bucket)
         self.valid_keys, self.deleted_keys = kv_store.key_set(bucket=self.bucket,collection=self.collection)
+        self.deleted_key_set = set(self.deleted_keys)
         self.num_valid_keys = len(self.valid_keys)
         self.num_deleted_keys = len(self.deleted_keys)
         self.keys_not_found = {self.client.rest.ip: [], self.client.rest.ip: []}
@@ -2229,24 +2304,30 @@ class GetMetaDataTask(GenericLoadingTask):
 
     def next(self):
         if self.itr < self.num_valid_keys:
-            self.meta_data_store[self.valid_keys[self.itr]] = self.__get_meta_data(self.client,self.valid_keys[self.itr], self.collection)
-        elif self.itr < (self.num_valid_keys + self.num_deleted_keys):
-            self.meta_data_store[self.deleted_keys[self.itr - self.num_valid_keys]] = self.__get_meta_data(self.client,self.deleted_keys[self.itr - self.num_valid_keys], collection=self.collection)
-        self.itr += 1
+            keys = self.valid_keys[self.itr:self.itr + self.batch_size]
+        else:
+            start = self.itr - self.num_valid_keys
+            keys = self.deleted_keys[start:start + self.batch_size]
+        meta_data = self.__get_meta_data(self.client, keys, collection=self.collection)
+        for key in keys:
+            self.meta_data_store[key] = meta_data.get(key)
+        self.itr += len(keys)
 
-    def __get_meta_data(self, client, key, collection=None):
-        try:
-            mc = client.memcached(key)
-            meta_data = eval("{'deleted': %s, 'flags': %s, 'expiration': %s, 'seqno': %s, 'cas': %s}" % (mc.getMeta(key, collection=collection)))
-            return meta_data
-        except MemcachedError as error:
+    def __get_meta_data(self, client, keys, collection=None):
+        meta_data, errors = self._get_meta_data_batch(client, keys, collection=collection)
+        for key in keys:
+            if key not in errors:
+                continue
+            error = errors[key]
             if error.status == ERR_NOT_FOUND:
-                if key not in self.deleted_keys:
+                if key not in self.deleted_key_set:
                     self.err_count += 1
                     self.keys_not_found[client.rest.ip].append(("key: %s" % key, "vbucket: %s" % client._get_vBucket_id(key)))
             else:
                 self.state = FINISHED
                 self.set_exception(error)
+                break
+        return meta_data
 
     def get_meta_data_store(self):
         return self.meta_data_store
@@ -3549,6 +3630,7 @@ class GenerateExpectedViewResultsTask(Task):
                          (not 'reduce' in query))
         self.custom_red_fn = self.is_reduced and not self.view.red_func in ['_count', '_sum', '_stats']
         self.type_filter = None
+        self.index = None
 
 
     def execute(self, task_manager):
@@ -3560,7 +3642,7 @@ class GenerateExpectedViewResultsTask(Task):
             task_manager.schedule(self)
         except Exception, ex:
             self.state = FINISHED
-            self.set_unexpected_exception(e)
+            self.set_unexpected_exception(ex)
 
     def check(self, task_manager):
         self.state = FINISHED
@@ -3583,31 +3665,44 @@ class GenerateExpectedViewResultsTask(Task):
             emit_value = re.sub(r'\);.*', '', re.sub(r'.*emit\([ +]?\[*],[ +]?doc\.', '', self.view.map_func))
             if self.view.map_func.count("[") <= 1:
                 emit_value = re.sub(r'\);.*', '', re.sub(r'.*emit\([ +]?.*,[ +]?doc\.', '', self.view.map_func))
-        for doc_gen in self.doc_generators:
+        with_value = not (not self.is_reduced or self.view.red_func == "_count" or self.custom_red_fn)
+        # built by the first query of the view and shared by the others
+        self.index = VIEW_INDEXES.index(self.doc_generators, self.view.map_func, with_value,
+                                        lambda: self._emit_rows(emit_key, emit_value, with_value))
+        self.emitted_rows = self.index.rows
 
+    def _docs(self):
+        for doc_gen in self.doc_generators:
+            if DOCS_CACHE.cacheable(doc_gen):
+                for _id, val in DOCS_CACHE.docs(doc_gen):
+                    yield _id, val
+                continue
             query_doc_gen = copy.deepcopy(doc_gen)
             while query_doc_gen.has_next():
-
                 _id, val = query_doc_gen.next()
-                val = json.loads(val)
-
-                if isinstance(emit_key, list):
-                    val_emit_key = []
-                    for ek in emit_key:
-                        val_emit_key.append(val[ek])
-                else:
-                    val_emit_key = val[emit_key]
-                if self.type_filter:
-                    filter_expr = r'\A{0}.*'.format(self.type_filter["filter_expr"])
-                    if re.match(filter_expr, val[self.type_filter["filter_what"]]) is None:
-                        continue
-                if isinstance(val_emit_key, unicode):
-                    val_emit_key = val_emit_key.encode('utf-8')
-                if not self.is_reduced or self.view.red_func == "_count" or self.custom_red_fn:
-                    self.emitted_rows.append({'id' : _id, 'key' : val_emit_key})
-                else:
-                    val_emit_value = val[emit_value]
-                    self.emitted_rows.append({'value' : val_emit_value, 'key' : val_emit_key, 'id' : _id, })
+                yield _id, json.loads(val)
+
+    def _emit_rows(self, emit_key, emit_value, with_value):
+        emitted_rows = []
+        for _id, val in self._docs():
+            if isinstance(emit_key, list):
+                val_emit_key = []
+                for ek in emit_key:
+                    val_emit_key.append(val[ek])
+            else:
+                val_emit_key = val[emit_key]
+            if self.type_filter:
+                filter_expr = r'\A{0}.*'.format(self.type_filter["filter_expr"])
+                if re.match(filter_expr, val[self.type_filter["filter_what"]]) is None:
+                    continue
+            if isinstance(val_emit_key, unicode):
+                val_emit_key = val_emit_key.encode('utf-8')
+            if not with_value:
+                emitted_rows.append({'id' : _id, 'key' : val_emit_key})
+            else:
+                val_emit_value = val[emit_value]
+                emitted_rows.append({'value' : val_emit_value, 'key' : val_emit_key, 'id' : _id, })
+        return emitted_rows
 
     def filter_emitted_rows(self):
 
@@ -3621,10 +3716,11 @@ class GenerateExpectedViewResultsTask(Task):
         key_set = 'key' in query
 
 
-        # sort expected results to match view results
-        expected_rows = sorted(self.emitted_rows,
-                               cmp=GenerateExpectedViewResultsTask.cmp_result_rows,
-                               reverse=descending_set)
+        # the index keeps the rows sorted the way the view returns them
+        if descending_set:
+            expected_rows = self.index.rows_desc
+        else:
+            expected_rows = self.index.rows
 
         # filter rows according to query flags
         if startkey_set:
@@ -3653,12 +3749,15 @@ class GenerateExpectedViewResultsTask(Task):
         if descending_set:
             start_key, end_key = end_key, start_key
 
+        # both key filters select a run of the sorted rows, find it by binary
+        # search and only check the rows in it
+        first, last = 0, len(expected_rows)
         if startkey_set or endkey_set:
             if isinstance(start_key, str):
                 start_key = start_key.strip("\"")
             if isinstance(end_key, str):
                 end_key = end_key.strip("\"")
-            expected_rows = [row for row in expected_rows if row['key'] >= start_key and row['key'] <= end_key]
+            first, last = self.index.key_bounds(start_key, end_key, descending_set)
 
         if key_set:
             key_ = query['key']
@@ -3666,6 +3765,13 @@ class GenerateExpectedViewResultsTask(Task):
                 key_ = key_[1:-1].split(',')
                 key_ = map(lambda x:int(x) if x != 'null' else None, key_)
             start_key, end_key = key_, key_
+            key_first, key_last = self.index.key_bounds(key_, key_, descending_set)
+            first, last = max(first, key_first), min(last, key_last)
+
+        expected_rows = expected_rows[first:last]
+        if startkey_set or endkey_set:
+            expected_rows = [row for row in expected_rows if row['key'] >= start_key and row['key'] <= end_key]
+        if key_set:
             expected_rows = [row for row in expected_rows if row['key'] == key_]
 
 
@@ -3781,7 +3887,7 @@ class GenerateExpectedViewResultsTask(Task):
                     group = [int(k) for k in group]
                 expected_rows.append({"key" : group, "value" : value})
             expected_rows = sorted(expected_rows,
-                               cmp=GenerateExpectedViewResultsTask.cmp_result_rows,
+                               cmp=cmp_result_rows,
                                reverse=descending_set)
         if 'skip' in query:
             expected_rows = expected_rows[(int(query['skip'])):]
@@ -3790,13 +3896,7 @@ class GenerateExpectedViewResultsTask(Task):
 
         self.emitted_rows = expected_rows
 
-    @staticmethod
-    def cmp_result_rows(x, y):
-        rc = cmp(x['key'], y['key'])
-        if rc == 0:
-            # sort by id is tie breaker
-            rc = cmp(x['id'], y['id'])
-        return rc
+    cmp_result_rows = staticmethod(cmp_result_rows)
 
 class ViewQueryVerificationTask(Task):
 
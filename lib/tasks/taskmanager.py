@@ -1,51 +1,180 @@
 import time
-import Queue
+import heapq
+import itertools
 
-from threading import Thread
+from collections import deque
+from threading import Thread, Condition
 from tasks.task import Task
 
+# at most this many threads run blocking task bodies, such as the loops of
+# the loading tasks, the rest of the blocking tasks queue for them
+MAX_BLOCKING_WORKERS = 32
+# a blocking worker idle for this many seconds exits
+BLOCKING_IDLE_SECS = 30
+
 class TaskManager(Thread):
-    def __init__(self, thread_name=None):
+    """Runs scheduled tasks until they finish.
+
+    Ready tasks are kept in a FIFO and sleeping tasks in a min-heap ordered by
+    wakeup time, so a task rescheduled with a sleep_time is picked up as soon
+    as its deadline passes and a new schedule() call wakes idle workers
+    immediately. With num_workers > 1 extra worker threads take tasks from the
+    same queues, so a slow execute() step does not hold up unrelated tasks.
+    A given task is only ever stepped by one worker at a time.
+
+    Work that blocks for long, like the loops of the loading tasks, is handed
+    to run_blocking() instead of getting a thread of its own. It runs on a
+    pool of at most max_blocking_workers threads, started as needed, and
+    blocking_limits caps how many tasks of one class run at once, e.g.
+    {"BatchedValidateDataTask": 4}. The scheduler workers stay free to poll
+    the REST and memcached waits."""
+
+    def __init__(self, thread_name=None, num_workers=1,
+                 max_blocking_workers=MAX_BLOCKING_WORKERS, blocking_limits=None):
         Thread.__init__(self)
-        self.readyq = Queue.Queue()
-        self.sleepq = Queue.Queue()
+        self.readyq = deque()
+        self.sleepq = []
         self.running = True
+        self.num_workers = max(1, num_workers)
+        self._cond = Condition()
+        self._counter = itertools.count()
+        self._active = 0
+        self._workers = []
+        self.max_blocking_workers = max(1, max_blocking_workers)
+        self.blocking_limits = dict(blocking_limits or {})
+        self._blocking_cond = Condition()
+        self._blockingq = deque()
+        self._blocking_running = {}
+        self._blocking_workers = 0
+        self._blocking_idle = 0
         if thread_name is not None:
             self.name = thread_name
 
     def schedule(self, task, sleep_time=0):
         if not isinstance(task, Task):
             raise TypeError("Tried to schedule somthing that's not a task")
-        if sleep_time <= 0:
-            self.readyq.put(task)
-        else:
-            wakeup_time = time.time() + sleep_time
-            self.sleepq.put({'task': task, 'time': wakeup_time})
-
-    def run(self):
-        while (self.running == True or self.readyq.empty() != True or self.sleepq.empty() != True):
-            if self.readyq.empty():
-                time.sleep(1)
+        with self._cond:
+            if sleep_time <= 0:
+                self.readyq.append(task)
             else:
-                task = self.readyq.get()
-                task.step(self)
-            for i in range(self.sleepq.qsize()):
-                s_task = self.sleepq.get()
-                if time.time() >= s_task['time']:
-                    self.readyq.put(s_task['task'])
+                wakeup_time = time.time() + sleep_time
+                heapq.heappush(self.sleepq, (wakeup_time, next(self._counter), task))
+            self._cond.notify()
+
+    def run_blocking(self, task, target):
+        """Runs target() for task on the blocking pool. Nothing runs if the
+        task is done, e.g. cancelled, by the time it gets a worker, and an
+        exception from target is set on the task."""
+        with self._blocking_cond:
+            self._blockingq.append((task, target))
+            if self._blocking_idle == 0 and self._blocking_workers < self.max_blocking_workers:
+                self._blocking_workers += 1
+                worker = Thread(target=self._work_blocking,
+                                name="{0}_blocking_{1}".format(self.name, self._blocking_workers))
+                worker.daemon = True
+                worker.start()
+            self._blocking_cond.notify()
+
+    def _next_blocking(self):
+        """Returns the first queued (task, target) whose class is under its
+        limit, or None once the worker was idle for BLOCKING_IDLE_SECS."""
+        with self._blocking_cond:
+            idle_since = time.time()
+            while True:
+                for item in self._blockingq:
+                    kind = item[0].__class__.__name__
+                    limit = self.blocking_limits.get(kind)
+                    if limit is None or self._blocking_running.get(kind, 0) < limit:
+                        self._blockingq.remove(item)
+                        self._blocking_running[kind] = self._blocking_running.get(kind, 0) + 1
+                        return item
+                remaining = idle_since + BLOCKING_IDLE_SECS - time.time()
+                if remaining <= 0:
+                    self._blocking_workers -= 1
+                    return None
+                self._blocking_idle += 1
+                self._blocking_cond.wait(remaining)
+                self._blocking_idle -= 1
+
+    def _work_blocking(self):
+        while True:
+            item = self._next_blocking()
+            if item is None:
+                break
+            task, target = item
+            try:
+                if not task.done():
+                    target()
+            except Exception, ex:
+                if not task.done():
+                    task.set_unexpected_exception(ex)
+            finally:
+                with self._blocking_cond:
+                    self._blocking_running[task.__class__.__name__] -= 1
+                    # a task of that class may have been held back by its limit
+                    self._blocking_cond.notify_all()
+
+    def _next_task(self):
+        """Blocks until a task is due and returns it, or returns None once the
+        manager is shut down and there is nothing left to run."""
+        with self._cond:
+            while True:
+                now = time.time()
+                while self.sleepq and self.sleepq[0][0] <= now:
+                    self.readyq.append(heapq.heappop(self.sleepq)[2])
+                if self.readyq:
+                    self._active += 1
+                    return self.readyq.popleft()
+                if not self.running and not self.sleepq and self._active == 0:
+                    self._cond.notify_all()
+                    return None
+                if self.sleepq:
+                    self._cond.wait(self.sleepq[0][0] - now)
                 else:
-                    self.sleepq.put(s_task)
+                    self._cond.wait()
+
+    def _task_done(self):
+        with self._cond:
+            self._active -= 1
+            if not self.running:
+                self._cond.notify_all()
+
+    def _work(self):
+        while True:
+            task = self._next_task()
+            if task is None:
+                break
+            try:
+                task.step(self)
+            finally:
+                self._task_done()
+
+    def run(self):
+        for i in range(1, self.num_workers):
+            worker = Thread(target=self._work, name="{0}_worker_{1}".format(self.name, i))
+            worker.daemon = self.daemon
+            worker.start()
+            self._workers.append(worker)
+        self._work()
+        for worker in self._workers:
+            worker.join()
 
     def shutdown(self, force=False):
-        self.running = False
-        if force:
-            while not self.sleepq.empty():
-                task = self.sleepq.get()['task']
-                task.cancel()
-                self.readyq.put(task)
-            while not self.readyq.empty():
-                try:
-                    task = self.readyq.get()
+        with self._cond:
+            self.running = False
+            if force:
+                while self.sleepq:
+                    task = heapq.heappop(self.sleepq)[2]
                     task.cancel()
-                except Exception, ex:
-                    raise ex
\ No newline at end of file
+                    self.readyq.append(task)
+                while self.readyq:
+                    try:
+                        task = self.readyq.popleft()
+                        task.cancel()
+                    except Exception, ex:
+                        raise ex
+            self._cond.notify_all()
+        if force:
+            with self._blocking_cond:
+                while self._blockingq:
+                    self._blockingq.popleft()[0].cancel()
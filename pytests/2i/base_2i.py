@@ -8,7 +8,7 @@ from newtuq import QueryTests
 from couchbase_helper.cluster import Cluster
 from couchbase_helper.tuq_generators import TuqGenerators
 from couchbase_helper.query_definitions import SQLDefinitionGenerator
-from membase.api.rest_client import RestConnection
+from membase.api.rest_client import RestConnection, Bucket
 
 log = logging.getLogger(__name__)
 
@@ -123,11 +123,37 @@ class BaseSecondaryIndexingTests(QueryTests):
         if not query_definitions:
             query_definitions = self.query_definitions
         for bucket in buckets:
+            to_create = []
             for query_definition in query_definitions:
                 index_info = "{0}:{1}".format(bucket.name, query_definition.index_name)
                 if index_info not in self.memory_create_list:
                     self.memory_create_list.append(index_info)
-                    self.create_index(bucket.name, query_definition, deploy_node_info)
+                    to_create.append(query_definition)
+            self.create_index_batch(bucket.name, to_create, deploy_node_info)
+
+    def create_index_batch(self, bucket, query_definitions, deploy_node_info=None):
+        """Creates the GSI indexes of query_definitions deferred, builds them
+        with one BUILD INDEX and waits for all of them with one poll per
+        tick. Indexes that create_index would leave unbuilt, primary and
+        view indexes are created one by one."""
+        bucket_name = bucket.name if isinstance(bucket, Bucket) else bucket
+        statements = {}
+        for query_definition in query_definitions:
+            if not (self.use_gsi_for_secondary and self.build_index_after_create) \
+                    or "primary" in query_definition.index_name:
+                self.create_index(bucket, query_definition, deploy_node_info)
+                continue
+            index_where_clause = None
+            if self.use_where_clause_in_index:
+                index_where_clause = query_definition.index_where_clause
+            statements[query_definition.index_name] = query_definition.generate_index_create_query(
+                bucket=bucket_name, use_gsi_for_secondary=self.use_gsi_for_secondary,
+                deploy_node_info=deploy_node_info, defer_build=True,
+                index_where_clause=index_where_clause, num_replica=self.num_index_replicas)
+            self.log.info(statements[query_definition.index_name])
+        check = self.n1ql_helper.create_indexes(bucket_name, statements, server=self.n1ql_node,
+                                                timeout=self.timeout_for_index_online)
+        self.assertTrue(check, "indexes {0} failed to be created".format(sorted(statements)))
 
     def multi_create_index_using_rest(self, buckets=None, query_definitions=None, deploy_node_info=None):
         self.index_id_map = {}
@@ -201,14 +227,38 @@ class BaseSecondaryIndexingTests(QueryTests):
         if not query_definitions:
             query_definitions = self.query_definitions
         for bucket in buckets:
+            to_drop = []
             for query_definition in query_definitions:
                 index_info = query_definition.generate_index_drop_query(bucket = bucket.name)
                 index_create_info = "{0}:{1}".format(bucket.name, query_definition.index_name)
                 if index_info not in self.memory_drop_list:
                     self.memory_drop_list.append(index_info)
-                    self.drop_index(bucket.name, query_definition)
+                    to_drop.append(query_definition)
                 if index_create_info in self.memory_create_list:
                     self.memory_create_list.remove(index_create_info)
+            self.drop_index_batch(bucket.name, to_drop)
+
+    def drop_index_batch(self, bucket, query_definitions):
+        """Drops the indexes of query_definitions and waits for all of them
+        with one poll per tick. Failures are logged, as by drop_index."""
+        bucket_name = bucket.name if isinstance(bucket, Bucket) else bucket
+        statements = {}
+        for query_definition in query_definitions:
+            if "primary" in query_definition.index_name:
+                # dropped as the bucket's primary index, not by its name
+                self.drop_index(bucket_name, query_definition)
+                continue
+            statements[query_definition.index_name] = query_definition.generate_index_drop_query(
+                bucket=bucket_name, use_gsi_for_secondary=self.use_gsi_for_secondary,
+                use_gsi_for_primary=self.use_gsi_for_primary)
+        try:
+            if not self.n1ql_helper.drop_indexes(bucket_name, statements, server=self.n1ql_node):
+                self.log.info("indexes {0} failed to be deleted".format(sorted(statements)))
+        except Exception, ex:
+                self.log.info(ex)
+                query = "select * from system:indexes"
+                actual_result = self.n1ql_helper.run_cbq_query(query = query, server = self.n1ql_node)
+                self.log.info(actual_result)
 
     def async_multi_drop_index(self, buckets=None, query_definitions=None):
         if not buckets:
@@ -18,6 +18,7 @@ from couchbase_helper.documentgenerator import BlobGenerator
 from couchbase_helper.cluster import Cluster
 from couchbase_helper.document import View
 from couchbase_helper.documentgenerator import DocumentGenerator
+from couchbase_helper.document_corpus import DOCS_CACHE
 from couchbase_helper.stats_tools import StatsCommon
 from TestInput import TestInputSingleton, TestInputServer
 from membase.api.rest_client import RestConnection, Bucket, RestHelper
@@ -25,7 +26,7 @@ from membase.helper.bucket_helper import BucketOperationHelper
 from membase.helper.cluster_helper import ClusterOperationHelper
 from membase.helper.rebalance_helper import RebalanceHelper
 from memcached.helper.data_helper import MemcachedClientHelper
-from remote.remote_util import RemoteMachineShellConnection, RemoteUtilHelper
+from remote.remote_util import RemoteMachineShellConnection, RemoteUtilHelper, RemoteClusterExecutor
 from membase.api.exception import ServerUnavailableException
 from couchbase_helper.data_analysis_helper import *
 from testconstants import STANDARD_BUCKET_PORT
@@ -148,6 +149,12 @@ class BaseTestCase(unittest.TestCase):
             self.active_resident_threshold = float(self.input.param("active_resident_threshold", 100))
             # max items number to verify in ValidateDataTask, None - verify all
             self.max_verify = self.input.param("max_verify", None)
+            # memory bound of the generated documents cache, see generate_full_docs_list
+            DOCS_CACHE.max_bytes = self.input.param("docs_cache_mb", 512) * 1024 * 1024
+            # keep cbtransfer data sets sorted on local disk instead of in memory
+            self.sorted_data_analysis = self.input.param("sorted_data_analysis", True)
+            # compare active and replica data by per-vbucket digests computed on the nodes
+            self.digest_data_analysis = self.input.param("digest_data_analysis", False)
             # we don't change consistent_view on server by default
             self.disabled_consistent_view = self.input.param("disabled_consistent_view", None)
             self.rebalanceIndexWaitingDisabled = self.input.param("rebalanceIndexWaitingDisabled", None)
@@ -1611,10 +1618,8 @@ class BaseTestCase(unittest.TestCase):
             remote_client.disconnect()
 
     def kill_memcached(self):
-        for server in self.servers:
-            remote_client = RemoteMachineShellConnection(server)
-            remote_client.kill_memcached()
-            remote_client.disconnect()
+        RemoteClusterExecutor(self.servers).run(
+            lambda shell, server: shell.kill_memcached()).raise_on_failure("kill memcached failed")
 
     def get_vbucket_seqnos(self, servers, buckets, skip_consistency=False, per_node=True):
         """
@@ -1740,16 +1745,24 @@ class BaseTestCase(unittest.TestCase):
             data_map[bucket.name] = task.get_meta_data_store()
         return data_map
 
+    def collect_data_set_all(self, servers, buckets, path=None, mode="disk", getReplica=False):
+        """ Method to get the union of the data of all servers, as maps or SortedDataSets """
+        if getattr(self, "sorted_data_analysis", False):
+            return self.data_collector.collect_sorted_data(servers, buckets, data_path=path,
+                                                           getReplica=getReplica, mode=mode)
+        return self.data_collector.collect_data(servers, buckets, data_path=path, perNode=False,
+                                                getReplica=getReplica, mode=mode)
+
     def get_data_set_all(self, servers, buckets, path=None, mode="disk"):
         """ Method to get all data set for buckets and from the servers """
         servers = self.get_kv_nodes(servers)
-        info, dataset = self.data_collector.collect_data(servers, buckets, data_path=path, perNode=False, mode=mode)
+        info, dataset = self.collect_data_set_all(servers, buckets, path=path, mode=mode)
         return dataset
 
     def get_data_set_with_data_distribution_all(self, servers, buckets, path=None, mode="disk"):
         """ Method to get all data set for buckets and from the servers """
         servers = self.get_kv_nodes(servers)
-        info, dataset = self.data_collector.collect_data(servers, buckets, data_path=path, perNode=False, mode=mode)
+        info, dataset = self.collect_data_set_all(servers, buckets, path=path, mode=mode)
         distribution = self.data_analyzer.analyze_data_distribution(dataset)
         return dataset, distribution
 
@@ -1768,10 +1781,17 @@ class BaseTestCase(unittest.TestCase):
            3)  Return active and replica data
         """
         servers = self.get_kv_nodes(servers)
-        info, disk_replica_dataset = self.data_collector.collect_data(servers, buckets, data_path=path, perNode=False,
-                                                                      getReplica=True, mode=mode)
-        info, disk_active_dataset = self.data_collector.collect_data(servers, buckets, data_path=path, perNode=False,
-                                                                     getReplica=False, mode=mode)
+        if getattr(self, "digest_data_analysis", False):
+            self.log.info(" Begin Verification for Active Vs Replica ")
+            replica_digests, active_digests, logic, summary = \
+                self.compare_active_replica_digests_all(servers, buckets, path=path, mode=mode)
+            self.assertTrue(logic, summary)
+            self.log.info(" End Verification for Active Vs Replica ")
+            return replica_digests, active_digests
+        info, disk_replica_dataset = self.collect_data_set_all(servers, buckets, path=path, getReplica=True,
+                                                               mode=mode)
+        info, disk_active_dataset = self.collect_data_set_all(servers, buckets, path=path, getReplica=False,
+                                                              mode=mode)
         self.log.info(" Begin Verification for Active Vs Replica ")
         comparison_result = self.data_analyzer.compare_all_dataset(info, disk_replica_dataset, disk_active_dataset)
         logic, summary, output = self.result_analyzer.analyze_all_result(comparison_result, deletedItems=False,
@@ -1780,6 +1800,36 @@ class BaseTestCase(unittest.TestCase):
         self.log.info(" End Verification for Active Vs Replica ")
         return disk_replica_dataset, disk_active_dataset
 
+    def compare_active_replica_digests_all(self, servers, buckets, path=None, mode="disk"):
+        """
+           Compares active and replica data by per-vbucket digests computed on the
+           servers, the rows of vbuckets whose digests differ are fetched and
+           compared to report the items that differ.
+           Returns replica digests, active digests, logic and summary
+        """
+        replica_digests = self.data_collector.collect_vbucket_digests(servers, buckets, data_path=path,
+                                                                      getReplica=True, mode=mode)
+        active_digests = self.data_collector.collect_vbucket_digests(servers, buckets, data_path=path,
+                                                                     getReplica=False, mode=mode)
+        replica_nodes = self.data_collector.collect_vbucket_replica_nodes(servers, buckets)
+        mismatches = self.data_analyzer.compare_active_replica_digests(active_digests, replica_digests,
+                                                                       replica_nodes)
+        vbuckets = dict((bucket, sorted(vbs.keys())) for bucket, vbs in mismatches.iteritems() if vbs)
+        if not vbuckets:
+            return replica_digests, active_digests, True, "Active and replica digests match"
+        for bucket, vbs in mismatches.iteritems():
+            for vbucket in sorted(vbs.keys()):
+                self.log.error("bucket {0}, vbucket {1} :: {2}".format(bucket, vbucket, vbs[vbucket]))
+        info, replica_rows = self.data_collector.collect_vbucket_rows(servers, buckets, vbuckets, data_path=path,
+                                                                      getReplica=True, mode=mode)
+        info, active_rows = self.data_collector.collect_vbucket_rows(servers, buckets, vbuckets, data_path=path,
+                                                                     getReplica=False, mode=mode)
+        comparison_result = self.data_analyzer.compare_all_dataset(info, replica_rows, active_rows)
+        logic, summary, output = self.result_analyzer.analyze_all_result(comparison_result, deletedItems=False,
+                                                                         addedItems=False, updatedItems=False)
+        summary = "vbuckets with different digests: {0}{1}".format(vbuckets, summary)
+        return replica_digests, active_digests, logic, summary
+
     def data_active_and_replica_analysis(self, server, max_verify=None, only_store_hash=True, kv_store=1):
         for bucket in self.buckets:
             task = self.cluster.async_verify_active_replica_data(server, bucket, bucket.kvs[kv_store], max_verify,
@@ -1904,10 +1954,22 @@ class BaseTestCase(unittest.TestCase):
             3) Compare Current Active and Replica data
         """
         self.log.info(" Begin Verification for data comparison ")
-        info, curr_data_set_replica = self.data_collector.collect_data(servers, buckets, data_path=path, perNode=False,
-                                                                       getReplica=True, mode=mode)
-        info, curr_data_set_active = self.data_collector.collect_data(servers, buckets, data_path=path, perNode=False,
-                                                                      getReplica=False, mode=mode)
+        if getattr(self, "digest_data_analysis", False):
+            curr_replica, curr_active, logic, summary = \
+                self.compare_active_replica_digests_all(servers, buckets, path=path, mode=mode)
+            self.log.info(" Comparing :: Prev vs Current :: Active and Replica ")
+            for prev_digests, curr_digests in [(prev_data_set_replica, curr_replica),
+                                               (prev_data_set_active, curr_active)]:
+                mismatches = self.data_analyzer.compare_vbucket_digests(prev_digests, curr_digests)
+                for bucket, vbuckets in mismatches.iteritems():
+                    self.assertFalse(vbuckets, "bucket {0}, vbuckets changed: {1}".format(bucket, vbuckets))
+            self.log.info(" Comparing :: Current :: Active and Replica :: {0}".format(summary))
+            self.log.info(" End Verification for data comparison ")
+            return
+        info, curr_data_set_replica = self.collect_data_set_all(servers, buckets, path=path, getReplica=True,
+                                                                mode=mode)
+        info, curr_data_set_active = self.collect_data_set_all(servers, buckets, path=path, getReplica=False,
+                                                               mode=mode)
         self.log.info(" Comparing :: Prev vs Current :: Active and Replica ")
         comparison_result_replica = self.data_analyzer.compare_all_dataset(info, prev_data_set_replica,
                                                                            curr_data_set_replica)
@@ -1935,8 +1997,7 @@ class BaseTestCase(unittest.TestCase):
         """
         self.log.info(" Begin Verification for data comparison ")
         servers = self.get_kv_nodes(servers)
-        info, curr_data_set = self.data_collector.collect_data(servers, buckets, data_path=path, perNode=False,
-                                                               mode=mode)
+        info, curr_data_set = self.collect_data_set_all(servers, buckets, path=path, mode=mode)
         comparison_result = self.data_analyzer.compare_all_dataset(info, prev_data_set, curr_data_set)
         logic, summary, output = self.result_analyzer.analyze_all_result(comparison_result, deletedItems=deletedItems,
                                                                          addedItems=addedItems,
@@ -2552,12 +2613,20 @@ class BaseTestCase(unittest.TestCase):
 
     def generate_full_docs_list(self, gens_load=[], keys=[], update=False):
         all_docs_list = []
+        if keys:
+            keys = set(keys)
         for gen_load in gens_load:
-            doc_gen = copy.deepcopy(gen_load)
-            while doc_gen.has_next():
-                key, val = doc_gen.next()
+            cached = DOCS_CACHE.cacheable(gen_load)
+            if cached:
+                # generated documents are decoded once and reused across
+                # calls and test methods, each call gets its own copies
+                doc_items = DOCS_CACHE.docs(gen_load, keys or None)
+            else:
+                doc_items = self._generator_items(copy.deepcopy(gen_load))
+            for key, val in doc_items:
                 try:
-                    val = json.loads(val)
+                    if not cached:
+                        val = json.loads(val)
                     if isinstance(val, dict) and 'mutated' not in val.keys():
                         if update:
                             val['mutated'] = 1
@@ -2573,6 +2642,11 @@ class BaseTestCase(unittest.TestCase):
                 all_docs_list.append(val)
         return all_docs_list
 
+    @staticmethod
+    def _generator_items(doc_gen):
+        while doc_gen.has_next():
+            yield doc_gen.next()
+
     def calculate_data_change_distribution(self, create_per=0, update_per=0,
                                            delete_per=0, expiry_per=0, start=0, end=0):
         count = end - start
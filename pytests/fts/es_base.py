@@ -1,11 +1,30 @@
 import httplib2
 import json
+import re
+import Queue
+from threading import Lock, Thread
 from tasks.taskmanager import TaskManager
 from tasks.task import *
 from remote.remote_util import RemoteMachineShellConnection, RemoteUtilHelper
+from membase.api import http_pool
+from couchbase_helper.query_compare import dataset_version
 import time
 import ast
 
+# bulk requests one generator load keeps in flight
+MAX_BULK_IN_FLIGHT = 4
+# failed bulk items reported with their error, the rest are only counted
+MAX_REPORTED_BULK_ERRORS = 10
+
+# the "type" of a generated document, without decoding it. Quotes inside JSON
+# strings are escaped, so this can't match in a value, but nested objects may
+# have a "type" of their own: only a single match is taken as the doc's.
+_DOC_TYPE_RE = re.compile(r'"type":\s*"([^"\\]*)"')
+
+# the APIs POSTed to that only read, every other request but a GET may
+# change what a search returns
+_READ_ONLY_APIS = ("/_search", "/_count")
+
 class BLEVE:
     STOPWORDS = ['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves',
                  'you', 'your', 'yours', 'yourself', 'yourselves', 'he', 'him',
@@ -187,6 +206,7 @@ class ElasticSearchBase(object):
         self.task_manager = TaskManager("ES_Thread")
         self.task_manager.start()
         self.http = httplib2.Http
+        self.__dataset_version = dataset_version()
 
     def _http_request(self, api, method='GET', params='', headers=None,
                       timeout=120):
@@ -194,10 +214,8 @@ class ElasticSearchBase(object):
             headers = {'Content-Type': 'application/json',
                        'Accept': '*/*'}
         try:
-            response, content = httplib2.Http(timeout=timeout).request(api,
-                                                                       method,
-                                                                       params,
-                                                                       headers)
+            response, content = http_pool.request(api, method, params, headers,
+                                                  timeout=timeout)
             if response['status'] in ['200', '201', '202']:
                 return True, content, response
             else:
@@ -220,6 +238,17 @@ class ElasticSearchBase(object):
             self.__log.error("socket error while connecting to {0} error {1} ".
                              format(api, e))
             raise ServerUnavailableException(ip=self.__host.ip)
+        finally:
+            if method != 'GET' and \
+                    not api.split('?')[0].endswith(_READ_ONLY_APIS):
+                self.__dataset_version = dataset_version()
+
+    def dataset_fingerprint(self, index_name):
+        """
+        Changes whenever an index, alias or document changes, search results
+        got in between can be reused. One for all indexes, aliases span them.
+        """
+        return self.__dataset_version
 
     def restart_es(self):
         shell = RemoteMachineShellConnection(self.__host)
@@ -423,6 +452,112 @@ class ElasticSearchBase(object):
         self.task_manager.schedule(_task)
         return _task
 
+    def bulk_bodies(self, index_name, generator, op_type='create', batch=1000):
+        """
+        Yields (NDJSON _bulk request body, number of docs) for the docs of
+        generator, batch docs per body. Created docs are sent as generated,
+        only updates are decoded to bump 'mutated'.
+        """
+        lines = []
+        batched = 0
+        for key, doc in generator:
+            types = _DOC_TYPE_RE.findall(doc)
+            doc_type = types[0] if len(types) == 1 else json.loads(doc)['type']
+            lines.append(json.dumps({op_type: {"_index": index_name,
+                                               "_type": doc_type,
+                                               "_id": key}}))
+            if op_type == "create":
+                # pretty printed JSON only has newlines between tokens
+                lines.append(doc.replace("\n", ""))
+            elif op_type == "update":
+                doc = json.loads(doc)
+                doc['mutated'] += 1
+                lines.append(json.dumps({"doc": doc}))
+            batched += 1
+            if batched == batch:
+                yield "\n".join(lines) + "\n", batched
+                lines = []
+                batched = 0
+        if batched:
+            yield "\n".join(lines) + "\n", batched
+
+    def bulk_load_generator(self, index_name, generator, op_type='create',
+                            batch=1000, in_flight=MAX_BULK_IN_FLIGHT):
+        """
+        Loads/updates/deletes the docs of generator with _bulk requests
+        built as the generator goes, keeping up to in_flight of them open
+        over pooled connections, and refreshes the index once at the end.
+        :return: (docs sent, docs ES failed, [(doc id, error)] of the first
+                  MAX_REPORTED_BULK_ERRORS failures)
+        """
+        bodies = Queue.Queue(maxsize=in_flight)
+        lock = Lock()
+        totals = {"sent": 0, "failed": 0}
+        errors = []
+
+        def failed(doc_id, error):
+            with lock:
+                totals["failed"] += 1
+                if len(errors) < MAX_REPORTED_BULK_ERRORS:
+                    errors.append((doc_id, error))
+
+        def send():
+            while True:
+                item = bodies.get()
+                if item is None:
+                    return
+                body, count = item
+                try:
+                    response = self.load_bulk_body(body)
+                except Exception as e:
+                    for _ in xrange(count):
+                        failed(None, str(e))
+                    continue
+                if response.get('errors'):
+                    for result in response['items']:
+                        result = result.values()[0]
+                        if 'error' in result:
+                            failed(result.get('_id'), result['error'])
+                with lock:
+                    totals["sent"] += count
+                    sent = totals["sent"]
+                self.__log.info("{0} documents bulk loaded into ES".format(sent))
+
+        senders = [Thread(target=send, name="es_bulk_{0}".format(i))
+                   for i in xrange(in_flight)]
+        for sender in senders:
+            sender.daemon = True
+            sender.start()
+        try:
+            for item in self.bulk_bodies(index_name, generator, op_type, batch):
+                bodies.put(item)
+        finally:
+            for _ in senders:
+                bodies.put(None)
+            for sender in senders:
+                sender.join()
+        self.update_index(index_name)
+        if totals["failed"]:
+            self.__log.error("{0} of {1} bulk '{2}' items failed on ES index {3},"
+                             " first errors: {4}".format(totals["failed"],
+                                                         totals["sent"],
+                                                         op_type,
+                                                         index_name,
+                                                         errors))
+        return totals["sent"], totals["failed"], errors
+
+    def load_bulk_body(self, body):
+        """
+        Sends one NDJSON _bulk request body
+        :return: the decoded bulk response, with per item results
+        """
+        status, content, _ = self._http_request(self.__connection_url + "_bulk",
+                                                'POST',
+                                                body)
+        if not status:
+            raise Exception("ES bulk request failed: {0}".format(content))
+        return json.loads(content)
+
     def load_bulk_data(self, filename):
         """
         Bulk load to ES from a file
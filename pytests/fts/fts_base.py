@@ -28,6 +28,7 @@ from couchbase_helper.documentgenerator import *
 from couchbase_helper.documentgenerator import JsonDocGenerator
 from lib.membase.api.exception import FTSException
 from es_base import ElasticSearchBase
+from reference_index import ReferenceSearchBase, REFERENCE_INDEX_PATH
 from security.rbac_base import RbacBase
 from lib.couchbase_helper.tuq_helper import N1QLHelper
 
@@ -3353,7 +3354,13 @@ class FTSBaseTest(unittest.TestCase):
         self.dataset = self._input.param("dataset", "emp")
         self.sample_query = {"match": "Safiya Morgan", "field": "name"}
         self.compare_es = self._input.param("compare_es", False)
-        if self.compare_es:
+        # validate against the in-process reference index instead of ES
+        self.reference_index = self._input.param("reference_index", False)
+        if self.compare_es and self.reference_index:
+            self.es = ReferenceSearchBase(
+                self.log,
+                self._input.param("reference_index_path", REFERENCE_INDEX_PATH))
+        elif self.compare_es:
             if not self.elastic_node:
                 self.fail("For ES result validation, pls add in the"
                           " [elastic] section in your ini file,"
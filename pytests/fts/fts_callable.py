@@ -5,6 +5,7 @@ import json
 from fts_base import FTSIndex, CouchbaseCluster
 from lib.membase.api.exception import FTSException
 from es_base import ElasticSearchBase
+from reference_index import ReferenceSearchBase, REFERENCE_INDEX_PATH
 from TestInput import TestInputSingleton
 from lib.couchbase_helper.documentgenerator import JsonDocGenerator
 from lib.membase.api.rest_client import RestConnection
@@ -45,7 +46,13 @@ class FTSCallable:
                       "prefix", "fuzzy", "conjunction", "disjunction",
                       "wildcard", "regexp", "query_string",
                       "numeric_range", "date_range"]
-        if self.compare_es and not self.elastic_node:
+        if self.compare_es and TestInputSingleton.input.param("reference_index", False):
+            self.es = ReferenceSearchBase(
+                self.log,
+                TestInputSingleton.input.param("reference_index_path", REFERENCE_INDEX_PATH))
+            if es_reset:
+                self.es.create_empty_index_with_bleve_equivalent_std_analyzer("es_index")
+        elif self.compare_es and not self.elastic_node:
             raise ("For ES result validation, pls add in the"
                       " [elastic] section in your ini file,"
                       " else set \"compare_es\" as False")
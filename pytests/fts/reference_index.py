@@ -0,0 +1,1193 @@
+import calendar
+import datetime
+import hashlib
+import json
+import marshal
+import math
+import mmap
+import os
+import re
+import struct
+import thread
+import time
+import logger
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import Condition, Lock
+
+from tasks.taskmanager import TaskManager
+from tasks.task import ReferenceIndexLoadTask
+from couchbase_helper.query_compare import dataset_version
+from es_base import BLEVE
+
+log = logger.Logger.get_logger()
+
+# ReferenceSearchBase: an in-process stand in for ElasticSearchBase, the
+#   oracle FTS query results are compared with. It takes the same calls and
+#   the same ES query DSL, and answers from ReferenceIndexes instead of an
+#   Elasticsearch node, so validation needs no [elastic] node and no refresh.
+# ReferenceIndex: one ES index. Its documents live in immutable segments,
+#   a document loaded again replaces the one in an older segment and deletes
+#   only mark documents, the way Lucene handles updates.
+# Segment: a segment file, memory-mapped. The term dictionary and the
+#   numeric and geo columns are read when the file is opened, the postings
+#   of a term (documents and positions) only when a query needs them.
+# SegmentStore: segment files by a fingerprint of the documents and the
+#   mapping they were indexed with. Every generator is indexed once, later
+#   loads of the same documents, in this run or the next, open its file.
+#
+# Text is indexed the way ES' standard analyzer with the bleve stopwords
+# indexes it (BLEVE.STD_ANALYZER): unicode word tokens, lowercased, stopwords
+# dropped but their positions kept, 100 positions between array elements.
+# Field types follow ES dynamic mapping unless the index mapping declares
+# them: numbers, booleans, ISO-8601 dates and everything else as text.
+# Custom analyzers are not emulated, every text field uses the standard one.
+
+REFERENCE_INDEX_PATH = "/tmp/fts_reference_index"
+# segment files of other data sets are removed, oldest first, beyond this
+MAX_STORE_BYTES = 4 * 1024 * 1024 * 1024
+POSITION_GAP = 100
+# terms a fuzzy query expands to, as ES' max_expansions
+MAX_EXPANSIONS = 50
+EARTH_RADIUS = 6371008.7714
+
+_MAGIC = "FTSREF01"
+_TRAILER = struct.Struct("<Q")
+_TOKEN_RE = re.compile(ur"\w+(?:['.\u2019]\w+)*", re.UNICODE)
+_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})(?:T(\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?)?"
+                      r"(Z|[+-]\d{2}:?\d{2})?\Z")
+_DISTANCE_RE = re.compile(r"\s*([0-9.]+)\s*([a-zA-Z]*)\s*\Z")
+_QUERY_STRING_RE = re.compile(ur'([+-]?)(?:([^\s:"]+):)?("[^"]*"|\S+)', re.UNICODE)
+_GEOHASH = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DISTANCE_UNITS = {"": 1.0, "m": 1.0, "meters": 1.0, "km": 1000.0, "kilometers": 1000.0,
+                   "mi": 1609.344, "miles": 1609.344, "yd": 0.9144, "yards": 0.9144,
+                   "ft": 0.3048, "feet": 0.3048, "in": 0.0254, "inch": 0.0254,
+                   "cm": 0.01, "centimeters": 0.01, "mm": 0.001, "millimeters": 0.001,
+                   "nmi": 1852.0, "NM": 1852.0}
+_ES_KINDS = {"string": "text", "text": "text", "keyword": "keyword",
+             "long": "number", "integer": "number", "short": "number", "byte": "number",
+             "double": "number", "float": "number", "half_float": "number",
+             "date": "date", "boolean": "boolean", "geo_point": "geo_point"}
+_STOPWORDS = frozenset(BLEVE.STOPWORDS)
+_TEXT_KINDS = ("text", "keyword")
+
+
+def _unicode(value):
+    if isinstance(value, str):
+        return value.decode("utf-8", "ignore")
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, bool):
+        return u"true" if value else u"false"
+    return unicode(value)
+
+
+def analyze(text):
+    """[(position, token)] of text as the standard analyzer indexes it"""
+    tokens = []
+    for position, match in enumerate(_TOKEN_RE.finditer(_unicode(text))):
+        token = match.group().lower()
+        if token not in _STOPWORDS:
+            tokens.append((position, token))
+    return tokens
+
+
+def parse_date(value):
+    """Epoch milliseconds of an ISO-8601 date, None if value is not one"""
+    if not isinstance(value, basestring):
+        return None
+    match = _DATE_RE.match(value.strip())
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    try:
+        moment = datetime.datetime(int(year), int(month), int(day),
+                                   int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        return None
+    millis = calendar.timegm(moment.timetuple()) * 1000.0
+    if fraction:
+        millis += int(fraction[:3].ljust(3, "0"))
+    if zone and zone != "Z":
+        offset = (int(zone[1:3]) * 60 + int(zone[-2:])) * 60000
+        millis -= offset if zone[0] == "+" else -offset
+    return millis
+
+
+def _date_value(value):
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return float(value)
+    millis = parse_date(value)
+    if millis is None:
+        raise Exception("not a date: {0}".format(value))
+    return millis
+
+
+def decode_geohash(geohash):
+    """(lat, lon) of the center of a geohash cell"""
+    lats, lons = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash.lower():
+        bits = _GEOHASH.index(char)
+        for mask in (16, 8, 4, 2, 1):
+            bounds = lons if even else lats
+            middle = (bounds[0] + bounds[1]) / 2
+            bounds[0 if bits & mask else 1] = middle
+            even = not even
+    return (lats[0] + lats[1]) / 2, (lons[0] + lons[1]) / 2
+
+
+def parse_geo_point(value):
+    """(lat, lon) of a geo point given as an object, [lon, lat], "lat,lon"
+    or a geohash, None if value is none of them"""
+    try:
+        if isinstance(value, dict):
+            return float(value["lat"]), float(value["lon"])
+        if isinstance(value, (list, tuple)) and len(value) == 2:
+            return float(value[1]), float(value[0])
+        if isinstance(value, basestring):
+            if "," in value:
+                lat, lon = value.split(",")
+                return float(lat), float(lon)
+            return decode_geohash(value.strip())
+    except (KeyError, TypeError, ValueError):
+        pass
+    return None
+
+
+def parse_distance(distance, unit="m"):
+    """A distance like "10km" or 10 in meters"""
+    if isinstance(distance, (int, long, float)):
+        return float(distance) * _DISTANCE_UNITS[unit]
+    match = _DISTANCE_RE.match(distance)
+    if not match or match.group(2) not in _DISTANCE_UNITS:
+        raise Exception("not a distance: {0}".format(distance))
+    return float(match.group(1)) * _DISTANCE_UNITS[match.group(2) or unit]
+
+
+def arc_distance(lat1, lon1, lat2, lon2):
+    """Haversine distance in meters"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance of a and b, limit + 1 once it is more than limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = range(len(b) + 1)
+    for i, char_a in enumerate(a):
+        current = [i + 1]
+        for j, char_b in enumerate(b):
+            current.append(min(previous[j + 1] + 1, current[j] + 1,
+                               previous[j] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def lucene_regexp(pattern):
+    """A compiled re matching the whole terms a lucene regexp matches.
+    Lucene accepts a repetition of a repetition, like "l+*", re does not,
+    so those are collapsed into the one repetition they amount to. The
+    optional lucene operators (&, ~, @, #, <n-m>) are not translated."""
+    translated = []
+    in_class = False
+    i = 0
+    pattern = _unicode(pattern)
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        if char == u"\\":
+            translated.append(pattern[i - 1:i + 1])
+            i += 1
+            continue
+        if in_class:
+            in_class = char != u"]"
+        elif char == u"[":
+            in_class = True
+        elif char in u"+*?" and translated and translated[-1] in (u"+", u"*", u"?"):
+            previous = translated.pop()
+            translated.append(previous if previous == char and char != u"*" else u"*")
+            continue
+        translated.append(char)
+    return re.compile(u"(?:{0})\\Z".format(u"".join(translated)), re.UNICODE | re.DOTALL)
+
+
+def parse_mapping(es_mapping):
+    """{doc_type: (dynamic, {field: kind})} of an ES mapping"""
+    mapping = {}
+    for doc_type, type_mapping in (es_mapping or {}).iteritems():
+        kinds = {}
+        _parse_properties(type_mapping.get("properties", {}), "", kinds)
+        dynamic = type_mapping.get("dynamic", True) not in (False, "false", "strict")
+        mapping[doc_type] = (dynamic, kinds)
+    return mapping
+
+
+def _parse_properties(properties, prefix, kinds):
+    for name, spec in properties.iteritems():
+        field = prefix + name
+        if "properties" in spec:
+            _parse_properties(spec["properties"], field + ".", kinds)
+            continue
+        kind = _ES_KINDS.get(spec.get("type", "object"))
+        if kind == "text" and spec.get("index") == "not_analyzed":
+            kind = "keyword"
+        if kind:
+            kinds[field] = kind
+
+
+class SegmentWriter(object):
+    def __init__(self, mapping=None):
+        self.mapping = mapping or {}
+        self.kinds = {}
+        for _, kinds in self.mapping.itervalues():
+            self.kinds.update(kinds)
+        self.ids = []
+        self._terms = {}
+        self._values = {}
+        self._points = {}
+
+    def add(self, doc_id, doc):
+        ord = len(self.ids)
+        self.ids.append(doc_id)
+        dynamic, declared = self.mapping.get(doc.get("type"), (True, None))
+        doc_terms = {}
+        self._collect(doc, "", ord, dynamic, declared, doc_terms, {})
+        for field, tokens in doc_terms.iteritems():
+            field_terms = self._terms.setdefault(field, {})
+            for token, positions in tokens.iteritems():
+                postings = field_terms.get(token)
+                if postings is None:
+                    postings = field_terms[token] = (array("i"), array("i"), array("i"))
+                postings[0].append(ord)
+                postings[1].append(len(positions))
+                postings[2].extend(positions)
+
+    def _kind(self, field, value, dynamic, declared):
+        if declared is not None and field in declared:
+            return declared[field]
+        if not dynamic:
+            return None
+        kind = self.kinds.get(field)
+        if kind is None:
+            if isinstance(value, bool):
+                kind = "boolean"
+            elif isinstance(value, (int, long, float)):
+                kind = "number"
+            elif isinstance(value, basestring):
+                kind = "text" if parse_date(value) is None else "date"
+            if kind is not None:
+                self.kinds[field] = kind
+        return kind
+
+    def _collect(self, value, field, ord, dynamic, declared, doc_terms, next_positions):
+        kind = self.kinds.get(field) if declared is None or field not in declared else declared[field]
+        if kind == "geo_point":
+            point = parse_geo_point(value)
+            if point is not None:
+                ords, lats, lons = self._points.setdefault(field, (array("i"), array("d"), array("d")))
+                ords.append(ord)
+                lats.append(point[0])
+                lons.append(point[1])
+            return
+        if isinstance(value, dict):
+            for name, item in value.iteritems():
+                self._collect(item, field + "." + name if field else name, ord,
+                              dynamic, declared, doc_terms, next_positions)
+            return
+        if isinstance(value, list):
+            for item in value:
+                self._collect(item, field, ord, dynamic, declared, doc_terms, next_positions)
+            return
+        if value is None or not field:
+            return
+        kind = self._kind(field, value, dynamic, declared)
+        if kind in ("number", "date"):
+            if kind == "date" and isinstance(value, basestring):
+                number = parse_date(value)
+            else:
+                try:
+                    number = float(value)
+                except (TypeError, ValueError):
+                    number = None
+            if number is not None:
+                values, ords = self._values.setdefault(field, (array("d"), array("i")))
+                values.append(number)
+                ords.append(ord)
+        elif kind in ("text", "keyword", "boolean"):
+            start = next_positions.get(field, 0)
+            if kind == "text":
+                tokens = analyze(value)
+            else:
+                tokens = [(0, _unicode(value))]
+            field_tokens = doc_terms.setdefault(field, {})
+            for position, token in tokens:
+                field_tokens.setdefault(token, []).append(start + position)
+            next_positions[field] = start + (tokens[-1][0] + 1 if tokens else 0) + POSITION_GAP
+
+    def write(self, filename):
+        tmp = "{0}.{1}.{2}.tmp".format(filename, os.getpid(), thread.get_ident())
+        terms_meta = {}
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC)
+            offset = len(_MAGIC)
+            for field, field_terms in self._terms.iteritems():
+                terms = sorted(field_terms)
+                offsets = []
+                for term in terms:
+                    ords, counts, positions = field_terms[term]
+                    blob = marshal.dumps((ords.tostring(), counts.tostring(), positions.tostring()))
+                    f.write(blob)
+                    offsets.append(offset)
+                    offset += len(blob)
+                offsets.append(offset)
+                terms_meta[field] = (terms, offsets)
+            values_meta = {}
+            for field, (values, ords) in self._values.iteritems():
+                order = sorted(xrange(len(values)), key=values.__getitem__)
+                values_meta[field] = (array("d", [values[i] for i in order]).tostring(),
+                                      array("i", [ords[i] for i in order]).tostring())
+            points_meta = {}
+            for field, columns in self._points.iteritems():
+                points_meta[field] = tuple(column.tostring() for column in columns)
+            f.write(marshal.dumps({"ids": self.ids, "kinds": self.kinds, "terms": terms_meta,
+                                   "values": values_meta, "points": points_meta}))
+            f.write(_TRAILER.pack(offset))
+        os.rename(tmp, filename)
+
+
+def _array(typecode, data):
+    column = array(typecode)
+    column.fromstring(data)
+    return column
+
+
+class Postings(object):
+    def __init__(self, blob):
+        ords, self._counts, self._positions = marshal.loads(blob)
+        self.ords = _array("i", ords)
+        self._starts = None
+
+    def find(self, ord):
+        i = bisect_left(self.ords, ord)
+        if i < len(self.ords) and self.ords[i] == ord:
+            return i
+        return -1
+
+    def positions(self, i):
+        if self._starts is None:
+            counts = _array("i", self._counts)
+            starts = [0]
+            for count in counts:
+                starts.append(starts[-1] + count)
+            self._starts = starts
+            self._positions = _array("i", self._positions)
+        return self._positions[self._starts[i]:self._starts[i + 1]]
+
+
+class Segment(object):
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(_MAGIC)] != _MAGIC or len(self._map) < len(_MAGIC) + _TRAILER.size:
+            self._map.close()
+            raise Exception("{0} is not a reference index segment".format(filename))
+        meta_offset = _TRAILER.unpack(self._map[-_TRAILER.size:])[0]
+        meta = marshal.loads(self._map[meta_offset:len(self._map) - _TRAILER.size])
+        self.ids = meta["ids"]
+        self.kinds = meta["kinds"]
+        self._terms = meta["terms"]
+        self._values = {}
+        for field, (values, ords) in meta["values"].iteritems():
+            self._values[field] = (_array("d", values), _array("i", ords))
+        self._points = {}
+        for field, (ords, lats, lons) in meta["points"].iteritems():
+            self._points[field] = (_array("i", ords), _array("d", lats), _array("d", lons))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def terms(self, field):
+        """The sorted terms of field"""
+        if field not in self._terms:
+            return []
+        return self._terms[field][0]
+
+    def postings_at(self, field, i):
+        offsets = self._terms[field][1]
+        return Postings(self._map[offsets[i]:offsets[i + 1]])
+
+    def postings(self, field, term):
+        terms = self.terms(field)
+        i = bisect_left(terms, term)
+        if i == len(terms) or terms[i] != term:
+            return None
+        return self.postings_at(field, i)
+
+    def values(self, field):
+        """(values, ords) of a number or date field, sorted by value"""
+        return self._values.get(field, ((), ()))
+
+    def points(self, field):
+        """(ords, lats, lons) of a geo_point field"""
+        return self._points.get(field, ((), (), ()))
+
+    def close(self):
+        self._map.close()
+
+
+class SegmentStore(object):
+    def __init__(self, path=REFERENCE_INDEX_PATH, max_bytes=MAX_STORE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._cond = Condition()
+        self._segments = {}
+        self._building = set()
+        self.hits = 0
+        self.builds = 0
+
+    @staticmethod
+    def fingerprint(docs, mapping):
+        digest = hashlib.sha1(_MAGIC)
+        digest.update(json.dumps(mapping, sort_keys=True))
+        for key, doc in docs:
+            digest.update("{0}\0{1}\n".format(key, doc))
+        return digest.hexdigest()
+
+    def segment(self, docs, mapping=None):
+        """The segment of the (key, json document) pairs docs() iterates,
+        indexed with mapping by the first caller and read from its file
+        by everyone after it"""
+        mapping = mapping or {}
+        fingerprint = self.fingerprint(docs(), mapping)
+        with self._cond:
+            while fingerprint in self._building:
+                self._cond.wait(1)
+            if fingerprint in self._segments:
+                self.hits += 1
+                return self._segments[fingerprint]
+            self._building.add(fingerprint)
+        segment = None
+        try:
+            filename = os.path.join(self.path, fingerprint + ".seg")
+            if os.path.exists(filename):
+                try:
+                    segment = Segment(filename)
+                    os.utime(filename, None)
+                    with self._cond:
+                        self.hits += 1
+                except Exception, ex:
+                    log.error("discarding reference index segment {0}: {1}".format(filename, ex))
+                    os.remove(filename)
+            if segment is None:
+                writer = SegmentWriter(mapping)
+                for key, doc in docs():
+                    writer.add(key, json.loads(doc))
+                writer.write(filename)
+                segment = Segment(filename)
+                with self._cond:
+                    self.builds += 1
+                self._evict(filename)
+        finally:
+            with self._cond:
+                self._building.discard(fingerprint)
+                if segment is not None:
+                    self._segments[fingerprint] = segment
+                self._cond.notify_all()
+        return segment
+
+    def _evict(self, keep):
+        with self._cond:
+            in_use = set(segment.filename for segment in self._segments.itervalues())
+        in_use.add(keep)
+        files = []
+        for name in os.listdir(self.path):
+            filename = os.path.join(self.path, name)
+            if name.endswith(".seg"):
+                stat = os.stat(filename)
+                files.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for _, size, _ in files)
+        for _, size, filename in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if filename not in in_use:
+                os.remove(filename)
+                total -= size
+
+    def close(self):
+        with self._cond:
+            segments, self._segments = self._segments.values(), {}
+        for segment in segments:
+            segment.close()
+
+    def stats(self):
+        with self._cond:
+            return {"segments": len(self._segments), "hits": self.hits, "builds": self.builds}
+
+
+class ReferenceIndex(object):
+    def __init__(self, name, store, mapping=None):
+        self.name = name
+        self.store = store
+        self.mapping = mapping or {}
+        self.kinds = {}
+        for _, kinds in self.mapping.itervalues():
+            self.kinds.update(kinds)
+        # replaced rather than changed in place, searches read them unlocked
+        self.segments = ()
+        self.deleted = frozenset()
+        self.size = 0
+        self._live = {}
+        self._pending = []
+        self._lock = Lock()
+        self._refresh_lock = Lock()
+
+    def add_segment(self, segment):
+        with self._lock:
+            base = self.size
+            replaced = []
+            for ord, doc_id in enumerate(segment.ids):
+                old = self._live.get(doc_id)
+                if old is not None:
+                    replaced.append(old)
+                self._live[doc_id] = base + ord
+            for field, kind in segment.kinds.iteritems():
+                self.kinds.setdefault(field, kind)
+            self.segments += ((base, segment),)
+            self.size = base + len(segment)
+            if replaced:
+                self.deleted = self.deleted.union(replaced)
+
+    def load(self, docs, op_type="create"):
+        """Loads the (key, json document) pairs docs() iterates, as
+        ESBulkLoadGeneratorTask loads a generator into ES. Updates replace
+        whole documents, the generators' updates carry every field."""
+        if op_type == "delete":
+            keys = [key for key, _ in docs()]
+            self.delete(keys)
+            return len(keys)
+        if op_type == "update":
+            docs = _updated(docs)
+        self.refresh()
+        segment = self.store.segment(docs, self.mapping)
+        self.add_segment(segment)
+        return len(segment)
+
+    def index_doc(self, doc_id, doc_json):
+        """Indexes a document at the next refresh"""
+        with self._lock:
+            self._pending.append((doc_id, doc_json))
+
+    def delete(self, doc_ids):
+        self.refresh()
+        with self._lock:
+            deleted = [self._live.pop(doc_id) for doc_id in doc_ids if doc_id in self._live]
+            if deleted:
+                self.deleted = self.deleted.union(deleted)
+
+    def refresh(self):
+        with self._refresh_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending:
+                self.add_segment(self.store.segment(lambda: iter(pending), self.mapping))
+
+    def count(self):
+        self.refresh()
+        with self._lock:
+            return len(self._live)
+
+    def search(self, body):
+        """The ids of the documents matching an ES search body, sorted"""
+        self.refresh()
+        with self._lock:
+            searcher = _Searcher(self.segments, self.size, self.deleted, dict(self.kinds))
+        return searcher.doc_ids(searcher.search(body))
+
+
+def _updated(docs):
+    def updated_docs():
+        for key, doc in docs():
+            doc = json.loads(doc)
+            if "mutated" in doc:
+                doc["mutated"] += 1
+            yield key, json.dumps(doc)
+    return updated_docs
+
+
+def _clauses(clauses):
+    if clauses is None:
+        return []
+    if isinstance(clauses, dict):
+        return [clauses]
+    return clauses
+
+
+def _field_clause(body, *value_keys):
+    """(field, value, options) of a {field: value} or a
+    {field: {value_key: value, ...}} clause"""
+    fields = [key for key in body if key not in ("boost", "_name")]
+    if len(fields) != 1:
+        raise Exception("expected one field in {0}".format(body))
+    spec = body[fields[0]]
+    if isinstance(spec, dict):
+        for key in value_keys:
+            if key in spec:
+                return fields[0], spec[key], spec
+        raise Exception("no {0} in {1}".format(" or ".join(value_keys), body))
+    return fields[0], spec, {}
+
+
+class _Searcher(object):
+    """Evaluates ES queries to sets of ords over a snapshot of an index"""
+
+    def __init__(self, segments, size, deleted, kinds):
+        self.segments = segments
+        self.size = size
+        self.deleted = deleted
+        self.kinds = kinds
+        self._all = None
+        self._handlers = {
+            "match_all": self._match_all, "match_none": self._match_none,
+            "term": self._term, "terms": self._terms, "match": self._match,
+            "match_phrase": self._match_phrase, "prefix": self._prefix,
+            "wildcard": self._wildcard, "regexp": self._regexp, "fuzzy": self._fuzzy,
+            "range": self._range, "bool": self._bool, "filtered": self._filtered,
+            "constant_score": self._constant_score, "and": self._and, "or": self._or,
+            "not": self._not, "query_string": self._query_string,
+            "geo_distance": self._geo_distance, "geo_bounding_box": self._geo_bounding_box}
+
+    def search(self, body):
+        docs = self.run(body.get("query", {"match_all": {}}))
+        for key in ("filter", "post_filter"):
+            if key in body:
+                docs &= self.run(body[key])
+        return docs - self.deleted
+
+    def run(self, query):
+        docs = None
+        for name, body in query.iteritems():
+            if name not in self._handlers:
+                raise Exception("the reference index does not support '{0}' queries".format(name))
+            result = self._handlers[name](body)
+            docs = result if docs is None else docs & result
+        if docs is None:
+            raise Exception("empty query")
+        return docs
+
+    def doc_ids(self, docs):
+        ids = []
+        segments = iter(self.segments)
+        base, segment = -1, None
+        for ord in sorted(docs):
+            while segment is None or ord >= base + len(segment):
+                base, segment = next(segments)
+            ids.append(segment.ids[ord - base])
+        return ids
+
+    def all(self):
+        if self._all is None:
+            self._all = set(xrange(self.size)) - self.deleted
+        return self._all
+
+    def _fields(self, field, kinds=_TEXT_KINDS):
+        # _all is searched as each of the text fields
+        if field == "_all":
+            return [name for name, kind in self.kinds.iteritems() if kind in kinds]
+        return [field]
+
+    @staticmethod
+    def _add(docs, ords, base):
+        if base:
+            docs.update(base + ord for ord in ords)
+        else:
+            docs.update(ords)
+
+    def _term_docs(self, field, term):
+        docs = set()
+        for name in self._fields(field):
+            for base, segment in self.segments:
+                postings = segment.postings(name, term)
+                if postings is not None:
+                    self._add(docs, postings.ords, base)
+        return docs
+
+    def _expanded_docs(self, field, select):
+        """The documents of the terms select(terms) picks by index"""
+        docs = set()
+        for name in self._fields(field):
+            for base, segment in self.segments:
+                for i in select(segment.terms(name)):
+                    self._add(docs, segment.postings_at(name, i).ords, base)
+        return docs
+
+    def _phrase_docs(self, field, tokens):
+        if len(tokens) < 2:
+            return self._term_docs(field, tokens[0][1]) if tokens else set()
+        docs = set()
+        first = tokens[0][0]
+        for name in self._fields(field):
+            for base, segment in self.segments:
+                postings = []
+                for position, token in tokens:
+                    term_postings = segment.postings(name, token)
+                    if term_postings is None:
+                        break
+                    postings.append((position - first, term_postings))
+                else:
+                    postings.sort(key=lambda item: len(item[1].ords))
+                    (offset, rarest), others = postings[0], postings[1:]
+                    for i, ord in enumerate(rarest.ords):
+                        found = []
+                        for other_offset, other in others:
+                            j = other.find(ord)
+                            if j < 0:
+                                break
+                            found.append((other_offset, set(other.positions(j))))
+                        else:
+                            for position in rarest.positions(i):
+                                start = position - offset
+                                if all(start + other_offset in positions
+                                       for other_offset, positions in found):
+                                    docs.add(base + ord)
+                                    break
+        return docs
+
+    def _value_docs(self, field, low, high, include_low=True, include_high=True):
+        docs = set()
+        for base, segment in self.segments:
+            values, ords = segment.values(field)
+            start, end = 0, len(values)
+            if low is not None:
+                start = (bisect_left if include_low else bisect_right)(values, low)
+            if high is not None:
+                end = (bisect_right if include_high else bisect_left)(values, high)
+            if start < end:
+                self._add(docs, ords[start:end], base)
+        return docs
+
+    def _equal_docs(self, field, value):
+        kind = self.kinds.get(field)
+        if kind == "number":
+            value = float(value)
+            return self._value_docs(field, value, value)
+        if kind == "date":
+            value = _date_value(value)
+            return self._value_docs(field, value, value)
+        return self._term_docs(field, _unicode(value))
+
+    def _match_docs(self, field, text, operator="or"):
+        if self.kinds.get(field) not in (None, "text"):
+            return self._equal_docs(field, text)
+        docs = None
+        for token in set(token for _, token in analyze(text)):
+            token_docs = self._term_docs(field, token)
+            if docs is None:
+                docs = token_docs
+            elif operator.lower() == "and":
+                docs &= token_docs
+            else:
+                docs |= token_docs
+        return docs or set()
+
+    def _range_docs(self, field, spec):
+        low = spec.get("from")
+        high = spec.get("to")
+        include_low = spec.get("include_lower", True)
+        include_high = spec.get("include_upper", True)
+        for key, inclusive in (("gt", False), ("gte", True)):
+            if key in spec:
+                low, include_low = spec[key], inclusive
+        for key, inclusive in (("lt", False), ("lte", True)):
+            if key in spec:
+                high, include_high = spec[key], inclusive
+        kind = self.kinds.get(field)
+        if kind in ("number", "date"):
+            convert = float if kind == "number" else _date_value
+            return self._value_docs(field, None if low is None else convert(low),
+                                    None if high is None else convert(high),
+                                    include_low, include_high)
+        if low is not None:
+            low = _unicode(low)
+        if high is not None:
+            high = _unicode(high)
+
+        def select(terms):
+            start, end = 0, len(terms)
+            if low is not None:
+                start = (bisect_left if include_low else bisect_right)(terms, low)
+            if high is not None:
+                end = (bisect_right if include_high else bisect_left)(terms, high)
+            return xrange(start, end)
+        return self._expanded_docs(field, select)
+
+    def _combine(self, must, should, must_not, minimum_should_match=None):
+        """ES bool semantics over evaluated clauses: should clauses are
+        optional next to must clauses, else at least one has to match"""
+        docs = None
+        for clause_docs in must:
+            docs = clause_docs if docs is None else docs & clause_docs
+        if minimum_should_match is None:
+            minimum_should_match = 0 if must else 1
+        minimum_should_match = int(minimum_should_match)
+        if should and minimum_should_match > 0:
+            counts = {}
+            for clause_docs in should:
+                for ord in clause_docs:
+                    counts[ord] = counts.get(ord, 0) + 1
+            should_docs = set(ord for ord, count in counts.iteritems()
+                              if count >= minimum_should_match)
+            docs = should_docs if docs is None else docs & should_docs
+        if docs is None:
+            docs = set(self.all())
+        for clause_docs in must_not:
+            docs -= clause_docs
+        return docs
+
+    def _match_all(self, body):
+        return set(self.all())
+
+    def _match_none(self, body):
+        return set()
+
+    def _term(self, body):
+        field, value, _ = _field_clause(body, "value", "term")
+        return self._equal_docs(field, value)
+
+    def _terms(self, body):
+        fields = [key for key in body if key not in ("boost", "_name")]
+        docs = set()
+        for value in body[fields[0]]:
+            docs |= self._equal_docs(fields[0], value)
+        return docs
+
+    def _match(self, body):
+        field, text, options = _field_clause(body, "query")
+        if options.get("type") in ("phrase", "match_phrase"):
+            return self._phrase_docs(field, analyze(text))
+        if "fuzziness" in options:
+            raise Exception("the reference index does not support fuzzy match queries")
+        return self._match_docs(field, text, options.get("operator", "or"))
+
+    def _match_phrase(self, body):
+        field, text, _ = _field_clause(body, "query")
+        if self.kinds.get(field) not in (None, "text"):
+            return self._equal_docs(field, text)
+        return self._phrase_docs(field, analyze(text))
+
+    def _prefix(self, body):
+        field, prefix, _ = _field_clause(body, "value", "prefix")
+        prefix = _unicode(prefix)
+
+        def select(terms):
+            i = bisect_left(terms, prefix)
+            while i < len(terms) and terms[i].startswith(prefix):
+                yield i
+                i += 1
+        return self._expanded_docs(field, select)
+
+    def _wildcard(self, body):
+        field, pattern, _ = _field_clause(body, "value", "wildcard")
+        pattern = _unicode(pattern)
+        regex = re.compile(u"".join(u".*" if char == u"*" else u"." if char == u"?" else re.escape(char)
+                                    for char in pattern) + u"\\Z", re.UNICODE | re.DOTALL)
+        prefix = re.split(u"[*?]", pattern, 1)[0]
+
+        def select(terms):
+            i = bisect_left(terms, prefix)
+            while i < len(terms) and terms[i].startswith(prefix):
+                if regex.match(terms[i]):
+                    yield i
+                i += 1
+        return self._expanded_docs(field, select)
+
+    def _regexp(self, body):
+        field, pattern, _ = _field_clause(body, "value")
+        regex = lucene_regexp(pattern)
+        return self._expanded_docs(field, lambda terms: (i for i, term in enumerate(terms)
+                                                         if regex.match(term)))
+
+    def _fuzzy(self, body):
+        field, value, options = _field_clause(body, "value")
+        value = _unicode(value)
+        fuzziness = options.get("fuzziness", "AUTO")
+        if str(fuzziness).upper() == "AUTO":
+            fuzziness = 0 if len(value) < 3 else 1 if len(value) < 6 else 2
+        fuzziness = int(fuzziness)
+        prefix = value[:int(options.get("prefix_length", 0))]
+        max_expansions = int(options.get("max_expansions", MAX_EXPANSIONS))
+        # like lucene, keep the max_expansions most similar terms
+        candidates = {}
+        for name in self._fields(field):
+            for _, segment in self.segments:
+                terms = segment.terms(name)
+                i = bisect_left(terms, prefix)
+                while i < len(terms) and terms[i].startswith(prefix):
+                    term = terms[i]
+                    i += 1
+                    if term in candidates:
+                        continue
+                    distance = edit_distance(value, term, fuzziness)
+                    if distance <= fuzziness:
+                        length = min(len(term), len(value)) or 1
+                        candidates[term] = (distance / float(length), term)
+        docs = set()
+        for _, term in sorted(candidates.itervalues())[:max_expansions]:
+            docs |= self._term_docs(field, term)
+        return docs
+
+    def _range(self, body):
+        fields = [key for key in body if key not in ("boost", "_name")]
+        return self._range_docs(fields[0], body[fields[0]])
+
+    def _bool(self, body):
+        must = [self.run(clause) for clause in _clauses(body.get("must")) + _clauses(body.get("filter"))]
+        should = [self.run(clause) for clause in _clauses(body.get("should"))]
+        must_not = [self.run(clause) for clause in _clauses(body.get("must_not"))]
+        return self._combine(must, should, must_not, body.get("minimum_should_match"))
+
+    def _filtered(self, body):
+        docs = self.run(body.get("query", {"match_all": {}}))
+        if "filter" in body:
+            docs &= self.run(body["filter"])
+        return docs
+
+    def _constant_score(self, body):
+        return self.run(body.get("filter") or body["query"])
+
+    def _and(self, body):
+        filters = body["filters"] if isinstance(body, dict) else body
+        return self._combine([self.run(clause) for clause in filters], [], [])
+
+    def _or(self, body):
+        filters = body["filters"] if isinstance(body, dict) else body
+        return self._combine([], [self.run(clause) for clause in filters], [])
+
+    def _not(self, body):
+        return self.all() - self.run(body.get("filter", body.get("query", body)))
+
+    def _query_string(self, body):
+        default_field = body.get("default_field", "_all")
+        must, should, must_not = [], [], []
+        for occur, field, value in _QUERY_STRING_RE.findall(_unicode(body["query"])):
+            docs = self._query_string_clause(field or default_field, value)
+            {u"+": must, u"-": must_not}.get(occur, should).append(docs)
+        return self._combine(must, should, must_not)
+
+    def _query_string_clause(self, field, value):
+        if value.startswith(u'"'):
+            if self.kinds.get(field) not in (None, "text"):
+                return self._equal_docs(field, value.strip(u'"'))
+            return self._phrase_docs(field, analyze(value.strip(u'"')))
+        for operator, key in ((u">=", "gte"), (u"<=", "lte"), (u">", "gt"), (u"<", "lt")):
+            if value.startswith(operator):
+                return self._range_docs(field, {key: value[len(operator):]})
+        return self._match_docs(field, value)
+
+    def _geo_distance(self, body):
+        options = ("distance", "distance_type", "unit", "optimize_bbox", "validation_method",
+                   "ignore_malformed", "coerce", "boost", "_name")
+        field = [key for key in body if key not in options][0]
+        distance = parse_distance(body["distance"], body.get("unit", "m"))
+        lat, lon = parse_geo_point(body[field])
+        docs = set()
+        for base, segment in self.segments:
+            ords, lats, lons = segment.points(field)
+            for i in xrange(len(ords)):
+                if arc_distance(lat, lon, lats[i], lons[i]) <= distance:
+                    docs.add(base + ords[i])
+        return docs
+
+    def _geo_bounding_box(self, body):
+        options = ("type", "validation_method", "ignore_malformed", "coerce", "boost", "_name")
+        field = [key for key in body if key not in options][0]
+        top, left = parse_geo_point(body[field]["top_left"])
+        bottom, right = parse_geo_point(body[field]["bottom_right"])
+        docs = set()
+        for base, segment in self.segments:
+            ords, lats, lons = segment.points(field)
+            for i in xrange(len(ords)):
+                if not bottom <= lats[i] <= top:
+                    continue
+                if left <= right and left <= lons[i] <= right or \
+                        left > right and (lons[i] >= left or lons[i] <= right):
+                    docs.add(base + ords[i])
+        return docs
+
+
+def _generator_docs(generator):
+    """A function iterating generator from where it is now, every call"""
+    start = generator.itr
+
+    def docs():
+        generator.itr = start
+        return generator
+    return docs
+
+
+class ReferenceSearchBase(object):
+    """Takes the calls of ElasticSearchBase and answers them in process"""
+
+    def __init__(self, logger, path=REFERENCE_INDEX_PATH):
+        self.__log = logger
+        self.__store = SegmentStore(path)
+        self.__indexes = {}
+        self.__aliases = {}
+        self.__lock = Lock()
+        self.__dataset_version = dataset_version()
+        self.es_queries = []
+        self.task_manager = TaskManager("Reference_index_thread")
+        self.task_manager.start()
+
+    def restart_es(self):
+        self.__log.info("Using the reference index in {0}, no ES server to restart"
+                        .format(self.__store.path))
+
+    def is_running(self):
+        return True
+
+    def _index(self, index_name):
+        with self.__lock:
+            if index_name not in self.__indexes:
+                # ES creates a missing index on the first document
+                self.__indexes[index_name] = ReferenceIndex(index_name, self.__store)
+            return self.__indexes[index_name]
+
+    def _data_changed(self):
+        self.__dataset_version = dataset_version()
+
+    def dataset_fingerprint(self, index_name):
+        """Changes whenever an index, alias or document changes, search
+        results got in between can be reused"""
+        return self.__dataset_version
+
+    def _indexes(self, index_name):
+        with self.__lock:
+            names = self.__aliases.get(index_name, [index_name])
+            return [self.__indexes[name] for name in names if name in self.__indexes]
+
+    def delete_index(self, index_name):
+        with self.__lock:
+            self.__indexes.pop(index_name, None)
+            self.__aliases.pop(index_name, None)
+        self._data_changed()
+
+    def delete_indices(self):
+        for index_name in self.get_indices():
+            self.delete_index(index_name)
+            self.__log.info("Reference index %s deleted" % index_name)
+
+    def create_empty_index(self, index_name, mapping=None):
+        with self.__lock:
+            self.__aliases.pop(index_name, None)
+            self.__indexes[index_name] = ReferenceIndex(index_name, self.__store, mapping)
+        self._data_changed()
+
+    def create_empty_index_with_bleve_equivalent_std_analyzer(self, index_name):
+        self.create_empty_index(index_name)
+
+    def create_index_mapping(self, index_name, es_mapping, fts_mapping=None):
+        if fts_mapping and fts_mapping['params']['mapping'].get('analysis', {}).get('analyzers'):
+            self.__log.warn("The reference index indexes every text field with the"
+                            " standard analyzer, custom analyzers are not emulated")
+        self.__log.info("Creating reference index %s with mapping %s"
+                        % (index_name, json.dumps(es_mapping, indent=3)))
+        self.create_empty_index(index_name, parse_mapping(es_mapping))
+
+    def create_alias(self, name, indexes):
+        with self.__lock:
+            self.__indexes.pop(name, None)
+            self.__aliases[name] = list(indexes)
+        self._data_changed()
+        self.__log.info("Reference index alias '{0}' created on {1}".format(name, indexes))
+
+    def async_load_ES(self, index_name, gen, op_type='create'):
+        return self.async_bulk_load_ES(index_name, gen, op_type)
+
+    def async_bulk_load_ES(self, index_name, gen, op_type='create', batch=5000):
+        _task = ReferenceIndexLoadTask(es_instance=self,
+                                       index_name=index_name,
+                                       generator=gen,
+                                       op_type=op_type)
+        self.task_manager.schedule(_task)
+        return _task
+
+    def load_generator(self, index_name, gen, op_type='create'):
+        """Loads, updates or deletes the documents of gen, returns how many"""
+        try:
+            return self._index(index_name).load(_generator_docs(gen), op_type)
+        finally:
+            self._data_changed()
+
+    def load_bulk_data(self, filename):
+        """
+        Loads an ES bulk request file, see ElasticSearchBase.load_bulk_data.
+        Partial updates replace the whole document.
+        """
+        try:
+            with open(filename, "rb") as f:
+                lines = iter(f)
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    (op_type, action), = json.loads(line).items()
+                    index = self._index(action["_index"])
+                    if op_type == "delete":
+                        index.delete([action["_id"]])
+                        continue
+                    doc = json.loads(next(lines))
+                    if op_type == "update":
+                        doc = doc["doc"]
+                    index.index_doc(action["_id"], json.dumps(doc))
+        finally:
+            self._data_changed()
+        return True
+
+    def load_data(self, index_name, document_json, doc_type, doc_id, collection=None):
+        self._index(index_name).index_doc(doc_id, document_json)
+        self._data_changed()
+
+    def update_index(self, index_name):
+        for index in self._indexes(index_name):
+            index.refresh()
+
+    def search(self, index_name, query, result_size=1000000):
+        """
+           Runs an ES search body against the reference index
+           :return: number of matches found, doc_ids and time taken
+        """
+        try:
+            self.__log.info("Reference index query '{0}' ".format(query))
+            start = time.time()
+            doc_ids = []
+            for index in self._indexes(index_name):
+                doc_ids += index.search(query)
+            took = int((time.time() - start) * 1000)
+            return len(doc_ids), doc_ids[:result_size], took
+        except Exception as e:
+            self.__log.error("Couldn't run query on the reference index: %s, reason : %s"
+                             % (json.dumps(query), e))
+            raise e
+
+    def get_index_count(self, index_name):
+        return sum(index.count() for index in self._indexes(index_name))
+
+    def get_indices(self):
+        with self.__lock:
+            return self.__indexes.keys() + self.__aliases.keys()
+
+    def close(self):
+        self.task_manager.shutdown(force=True)
+        self.__store.close()
+
+    def sleep(self, timeout=1, message=""):
+        self.__log.info("sleep for {0} secs. {1} ...".format(timeout, message))
+        time.sleep(timeout)
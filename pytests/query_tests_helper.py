@@ -5,7 +5,7 @@ from couchbase_helper.tuq_generators import JsonGenerator
 from remote.remote_util import RemoteMachineShellConnection
 from basetestcase import BaseTestCase
 from couchbase_helper.tuq_helper import N1QLHelper
-from membase.api.rest_client import RestConnection
+from membase.api.rest_client import RestConnection, Bucket
 from random import randint
 
 log = logging.getLogger(__name__)
@@ -178,6 +178,23 @@ class QueryHelperTests(BaseTestCase):
                                                             server=self.n1ql_server)
         self.assertTrue(check, "index {0} failed to be created".format(query_definition.index_name))
 
+    def create_index_batch(self, bucket, query_definitions, deploy_node_info=None):
+        """Creates the GSI indexes of query_definitions deferred, builds them
+        with one BUILD INDEX and waits for all of them with one poll per
+        tick. Primary and view indexes are created one by one."""
+        bucket_name = bucket.name if isinstance(bucket, Bucket) else bucket
+        statements = {}
+        for query_definition in query_definitions:
+            if not self.use_gsi_for_secondary or "primary" in query_definition.index_name:
+                self.create_index(bucket, query_definition, deploy_node_info)
+                continue
+            statements[query_definition.index_name] = query_definition.generate_index_create_query(
+                bucket=bucket_name, use_gsi_for_secondary=self.use_gsi_for_secondary,
+                deploy_node_info=deploy_node_info, defer_build=True, num_replica=self.num_index_replicas)
+            log.info(statements[query_definition.index_name])
+        check = self.n1ql_helper.create_indexes(bucket_name, statements, server=self.n1ql_server)
+        self.assertTrue(check, "indexes {0} failed to be created".format(sorted(statements)))
+
     def _create_primary_index(self):
         if self.n1ql_server:
             if self.doc_ops:
@@ -244,12 +261,36 @@ class QueryHelperTests(BaseTestCase):
                                                                server=self.n1ql_server)
                 log.info(actual_result)
 
+    def drop_index_batch(self, bucket, query_definitions):
+        """Drops the indexes of query_definitions and waits for all of them
+        with one poll per tick. Failures are logged, as by drop_index."""
+        bucket_name = bucket.name if isinstance(bucket, Bucket) else bucket
+        statements = {}
+        for query_definition in query_definitions:
+            if "primary" in query_definition.index_name:
+                # dropped as the bucket's primary index, not by its name
+                self.drop_index(bucket, query_definition)
+                continue
+            statements[query_definition.index_name] = query_definition.generate_index_drop_query(
+                bucket=bucket_name,
+                use_gsi_for_secondary=self.use_gsi_for_secondary,
+                use_gsi_for_primary=self.use_gsi_for_primary)
+            log.info(statements[query_definition.index_name])
+        try:
+            if not self.n1ql_helper.drop_indexes(bucket_name, statements, server=self.n1ql_server):
+                log.info("indexes {0} failed to be deleted".format(sorted(statements)))
+        except Exception, ex:
+            log.info(ex)
+            query = "select * from system:indexes"
+            actual_result = self.n1ql_helper.run_cbq_query(query=query,
+                                                           server=self.n1ql_server)
+            log.info(actual_result)
+
     def run_async_index_operations(self, operation_type):
         if operation_type == "create_index":
             self._create_primary_index()
             for bucket in self.buckets:
-                for query_definition in self.query_definitions:
-                    self.create_index(bucket=bucket, query_definition=query_definition)
+                self.create_index_batch(bucket, self.query_definitions)
         if operation_type == "query":
             for bucket in self.buckets:
                 for query_definition in self.query_definitions:
@@ -257,9 +298,7 @@ class QueryHelperTests(BaseTestCase):
                                query_definition=query_definition)
         if operation_type == "drop_index":
             for bucket in self.buckets:
-                for query_definition in self.query_definitions:
-                    self.drop_index(bucket=bucket,
-                               query_definition=query_definition)
+                self.drop_index_batch(bucket, self.query_definitions)
         if operation_type == "generate_docs":
             for bucket in self.buckets:
                     self.generate_docs(self.docs_per_day,start=randint(0,1000000000))
@@ -18,6 +18,8 @@ from os import listdir
 from os.path import isfile, join
 import traceback
 from rqg_postgres_client import RQGPostgresClient
+from rqg_sqlite_client import RQGSQLiteClient
+from rqg_sql_oracle import SQLClientPool, ExpectedResultCache, SQLOracle
 from membase.api.exception import CBQError
 
 class BaseRQGTests(BaseTestCase):
@@ -48,6 +50,11 @@ class BaseRQGTests(BaseTestCase):
             self.failure_record_path = self.input.param("failure_record_path", "/tmp")
             self.use_mysql = self.input.param("use_mysql", False)
             self.use_postgres = self.input.param("use_postgres", False)
+            self.use_sqlite = self.input.param("use_sqlite", False)
+            self.sqlite_dir = self.input.param("sqlite_dir", "/tmp")
+            self.sql_result_cache = self.input.param("sql_result_cache", True)
+            self.sql_result_cache_path = self.input.param("sql_result_cache_path", "/tmp/rqg_sql_result_cache.db")
+            self.sql_result_cache_mb = self.input.param("sql_result_cache_mb", 1024)
             self.initial_loading_to_cb = self.input.param("initial_loading_to_cb", True)
             self.change_bucket_properties = self.input.param("change_bucket_properties", False)
             self.database = self.input.param("database", "flightstats")
@@ -94,6 +101,7 @@ class BaseRQGTests(BaseTestCase):
             self.drop_secondary_indexes = self.input.param("drop_secondary_indexes", True)
             self.query_helper = self._initialize_rqg_query_helper()
             self.n1ql_helper = self._initialize_n1ql_helper()
+            self.sql_oracle = self._initialize_sql_oracle()
             self.rest = RestConnection(self.master)
             self.indexer_memQuota = self.input.param("indexer_memQuota", 1024)
             self.teardown_mysql = self.use_mysql and self.reset_database and (not self.skip_cleanup)
@@ -131,7 +139,11 @@ class BaseRQGTests(BaseTestCase):
             super(BaseRQGTests, self).tearDown()
             self.log.info("==============  RQG BasTestCase Teardown Has Completed ==============")
             self.log.info("==============  RQG Teardown Has Started ==============")
+            if hasattr(self, 'sql_oracle'):
+                self.sql_oracle.close()
             if hasattr(self, 'reset_database'):
+                if self.use_sqlite and self.reset_database and (not self.skip_cleanup):
+                    self.client.drop_database(self.database)
                 if self.teardown_mysql:
                     client = RQGMySQLClient(database=self.database, host=self.mysql_url, user_id=self.user_id, password=self.password)
                     self.kill_mysql_processes(client)
@@ -344,6 +356,11 @@ class BaseRQGTests(BaseTestCase):
         result_run["sql_query"] = sql_query
         result_run["test_case_number"] = test_case_number
 
+        # the sql result is computed while the n1ql queries run
+        sql_future = None
+        if expected_result is None:
+            sql_future = self.sql_oracle.submit(sql_query, repeated_columns=self.aggregate_pushdown)
+
         if self.ansi_transform:
             result = self._run_explain_queries(n1ql_query=n1ql_query, keyword="u'outer':u'True'", present=False)
             result_run.update(result)
@@ -357,10 +374,11 @@ class BaseRQGTests(BaseTestCase):
                                                                                   subquery=self.subquery,
                                                                                   n1ql_query=n1ql_query,
                                                                                   sql_query=sql_query,
-                                                                                  expected_result=expected_result)
+                                                                                  expected_result=expected_result,
+                                                                                  sql_future=sql_future)
 
         if expected_result is None:
-            expected_result = self._gen_expected_result(sql_query, test_case_number)
+            expected_result = self._gen_expected_result(sql_query, test_case_number, sql_future)
             query_test_map["expected_result"] = expected_result
 
         if self.set_limit > 0 and n1ql_query.find("DISTINCT") > 0:
@@ -629,15 +647,14 @@ class BaseRQGTests(BaseTestCase):
         self.log.info("N1QL :: {0}".format(n1ql_query))
 
         crud_ops_run_result = None
-        client = RQGMySQLClient(database=self.database, host=self.mysql_url, user_id=self.user_id, password=self.password)
         try:
             self.n1ql_query_runner_wrapper(n1ql_query=n1ql_query, server=self.n1ql_server)
-            client._insert_execute_query(query=sql_query)
+            with self.sql_oracle.pool.client() as client:
+                client._insert_execute_query(query=sql_query)
         except Exception, ex:
             self.log.info(ex)
             crud_ops_run_result = {"success": False, "result": str(ex)}
-            client._close_connection()
-        client._close_connection()
+        self.sql_oracle.invalidate()
         if crud_ops_run_result is None:
             query_index_run = self._run_queries_and_verify_crud(n1ql_query=verification_query, sql_query=verification_query, expected_result=None, table_name=table_name)
         else:
@@ -698,25 +715,14 @@ class BaseRQGTests(BaseTestCase):
         result = self._generate_result(failure_map)
         return success, summary, result
 
-    def _gen_expected_result(self, sql="", test=49):
+    def _gen_expected_result(self, sql="", test=49, sql_future=None):
         sql_result = []
         try:
-            client = None
-            if self.use_mysql:
-                client = RQGMySQLClient(database=self.database, host=self.mysql_url, user_id=self.user_id, password=self.password)
-            elif self.use_postgres:
-                client = RQGPostgresClient()
-
-            if test == 51:
-                columns = []
-                rows = []
-            else:
-                columns, rows = client._execute_query(query=sql)
-            if self.aggregate_pushdown:
-                sql_result = client._gen_json_from_results_repeated_columns(columns, rows)
-            else:
-                sql_result = client._gen_json_from_results(columns, rows)
-            client._close_connection()
+            if test != 51:
+                if sql_future is not None:
+                    sql_result = sql_future.result()
+                else:
+                    sql_result = self.sql_oracle.expected_result(sql, repeated_columns=self.aggregate_pushdown)
         except Exception, ex:
             self.log.info(ex)
             traceback.print_exc()
@@ -733,7 +739,7 @@ class BaseRQGTests(BaseTestCase):
         else:
             return {"success": True, "result": "Pass"}
 
-    def _run_queries_and_verify(self, aggregate=False, subquery=False, n1ql_query=None, sql_query=None, expected_result=None):
+    def _run_queries_and_verify(self, aggregate=False, subquery=False, n1ql_query=None, sql_query=None, expected_result=None, sql_future=None):
         if not self.create_primary_index:
             n1ql_query = n1ql_query.replace("USE INDEX(`#primary` USING GSI)", " ")
         if self.prepared:
@@ -745,6 +751,8 @@ class BaseRQGTests(BaseTestCase):
         for i, item in enumerate(hints):
             if "simple_table" in item:
                 hints[i] = hints[i].replace("simple_table", self.database+"_"+"simple_table")
+        if expected_result is None and sql_future is None:
+            sql_future = self.sql_oracle.submit(sql_query, repeated_columns=self.aggregate_pushdown)
         try:
             if subquery:
                 query_params = {'timeout': '1200s'}
@@ -758,21 +766,10 @@ class BaseRQGTests(BaseTestCase):
                 actual_result = self.n1ql_query_runner_wrapper(n1ql_query=prepared_query, server=self.n1ql_server, query_params=query_params, scan_consistency="request_plus")
             n1ql_result = actual_result["results"]
 
-            # Run SQL Query
+            # Wait for the SQL Query
             sql_result = expected_result
-            client = None
-            if self.use_mysql:
-                client = RQGMySQLClient(database=self.database, host=self.mysql_url, user_id=self.user_id, password=self.password)
-            elif self.use_postgres:
-                client = RQGPostgresClient()
-
             if expected_result is None:
-                columns, rows = client._execute_query(query=sql_query)
-                if self.aggregate_pushdown:
-                    sql_result = client._gen_json_from_results_repeated_columns(columns, rows)
-                else:
-                    sql_result = client._gen_json_from_results(columns, rows)
-            client._close_connection()
+                sql_result = sql_future.result()
             self.log.info(" result from n1ql query returns {0} items".format(len(n1ql_result)))
             self.log.info(" result from sql query returns {0} items".format(len(sql_result)))
 
@@ -811,11 +808,11 @@ class BaseRQGTests(BaseTestCase):
             n1ql_result = actual_result["results"]
             # Run SQL Query
             sql_result = expected_result
-            client = RQGMySQLClient(database=self.database, host=self.mysql_url, user_id=self.user_id, password=self.password)
             if expected_result is None:
-                columns, rows = client._execute_query(query=sql_query)
-                sql_result = client._gen_json_from_results(columns, rows)
-            client._close_connection()
+                # the data changes with every crud test, so no cached results
+                with self.sql_oracle.pool.client() as client:
+                    columns, rows = client._execute_query(query=sql_query)
+                    sql_result = client._gen_json_from_results(columns, rows)
             self.log.info(" result from n1ql query returns {0} items".format(len(n1ql_result)))
             self.log.info(" result from sql query returns {0} items".format(len(sql_result)))
 
@@ -908,6 +905,11 @@ class BaseRQGTests(BaseTestCase):
             self._initialize_postgres_client()
             if not self.generate_input_only:
                 self._setup_and_load_buckets()
+        elif self.use_sqlite:
+            self.log.info(" Will load directly from sqlite")
+            self._initialize_sqlite_client()
+            if not self.generate_input_only:
+                self._setup_and_load_buckets()
         else:
             self.log.info(" Will load directly from file snap-shot")
             if self.populate_with_replay:
@@ -931,7 +933,7 @@ class BaseRQGTests(BaseTestCase):
         fields = ['primary_key_id','bool_field1','char_field1','datetime_field1','decimal_field1',
                   'int_field1','varchar_field1']
         if self.create_secondary_indexes:
-            if self.use_mysql or self.use_postgres:
+            if self.use_mysql or self.use_postgres or self.use_sqlite:
                 self.sec_index_map = self.client._gen_index_combinations_for_tables(partitioned_indexes=self.partitioned_indexes)
             else:
                 self.sec_index_map = self._extract_secondary_index_map_from_file(self.secondary_index_info_path)
@@ -1009,6 +1011,20 @@ class BaseRQGTests(BaseTestCase):
                                       full_docs_list=[], log=self.log, input=self.input, master=self.master,
                                       database=self.database, use_rest=self.use_rest)
 
+    def _initialize_sql_oracle(self):
+        cache = None
+        if self.sql_result_cache and not self.crud_ops:
+            cache = ExpectedResultCache(self.sql_result_cache_path, max_bytes=self.sql_result_cache_mb * 1024 * 1024)
+        pool = SQLClientPool(self._new_sql_client, max_size=self.concurreny_count)
+        return SQLOracle(pool, cache)
+
+    def _new_sql_client(self):
+        if self.use_postgres:
+            return RQGPostgresClient()
+        if self.use_sqlite:
+            return RQGSQLiteClient(database=self.database, directory=self.sqlite_dir)
+        return RQGMySQLClient(database=self.database, host=self.mysql_url, user_id=self.user_id, password=self.password)
+
     def _initialize_mysql_client(self):
         if self.reset_database:
             self.client = RQGMySQLClient(host=self.mysql_url, user_id=self.user_id, password=self.password)
@@ -1032,6 +1048,17 @@ class BaseRQGTests(BaseTestCase):
         self.client = RQGPostgresClient()
         self.client.reset_database_add_data()
 
+    def _initialize_sqlite_client(self):
+        if self.reset_database:
+            self.client = RQGSQLiteClient(directory=self.sqlite_dir)
+            path = "b/resources/rqg/{0}/database_definition/definition.sql".format(self.database)
+            self.database = self.database+"_"+str(self.query_helper._random_int())
+            self.client.reset_database_add_data(database=self.database, items=self.items, sql_file_definiton_path=path,
+                                                populate_data=not self.populate_with_replay, number_of_tables=self.number_of_buckets)
+            self._copy_table_for_merge()
+        else:
+            self.client = RQGSQLiteClient(database=self.database, directory=self.sqlite_dir)
+
     def _copy_table_for_merge(self):
         table_list = self.client._get_table_list()
         reference_table = table_list[0]
@@ -1045,7 +1072,7 @@ class BaseRQGTests(BaseTestCase):
                     self.client._insert_execute_query(sql)
         table_list = self.client._get_table_list()
         for table_name in table_list:
-            self.client_map[table_name] = RQGMySQLClient(database=self.database, host=self.mysql_url, user_id=self.user_id, password=self.password)
+            self.client_map[table_name] = self._new_sql_client()
 
     def _generate_result(self, data):
         result = ""
@@ -1283,13 +1310,8 @@ class BaseRQGTests(BaseTestCase):
         database_dump = self.data_dump_path+"/db_dump"
         os.mkdir(database_dump)
         f_write_index_file = open(secondary_index_path+"/secondary_index_definitions.txt",'w')
-        client = None
-        if self.use_mysql:
-            client = RQGMySQLClient(database=self.database, host=self.mysql_url, user_id=self.user_id, password=self.password)
-        elif self.use_postgres:
-            client = RQGPostgresClient()
-        client.dump_database(data_dump_path=database_dump)
-        client._close_connection()
+        with self.sql_oracle.pool.client() as client:
+            client.dump_database(data_dump_path=database_dump)
         f_write_index_file.write(json.dumps(self.sec_index_map))
         f_write_index_file.close()
         while not failure_record_queue.empty():
@@ -0,0 +1,242 @@
+import hashlib
+import marshal
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from threading import Condition, Lock, Thread
+
+from tasks.future import Future
+
+# SQLClientPool: open SQL clients shared by the RQG test threads. A thread
+#   checks a client out for one query and hands it back, so a run opens at
+#   most max_size connections instead of one per query.
+# ExpectedResultCache: SQL results stored in a SQLite file keyed by the SQL
+#   text, the shape the rows were converted to and a fingerprint of the
+#   data the query ran against. The least recently used results are dropped
+#   once the stored size exceeds max_bytes. The file outlives the run, so
+#   reruns against the same data (a replayed dump, reset_database=False)
+#   do not query the database again either.
+# SQLOracle: expected results for SQL queries, from the cache or from a
+#   pooled client, optionally in a thread of their own so they overlap the
+#   n1ql query they are compared with.
+
+MAX_POOL_SIZE = 10
+MAX_CACHE_BYTES = 1024 * 1024 * 1024
+# evict down to this share of max_bytes so not every insert evicts
+_EVICT_RATIO = 0.9
+
+
+class SQLClientPool(object):
+    def __init__(self, factory, max_size=MAX_POOL_SIZE):
+        self.factory = factory
+        self.max_size = max_size
+        self._cond = Condition()
+        self._idle = []
+        self._size = 0
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                if self._idle:
+                    self.reused += 1
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                self._cond.wait(1)
+        try:
+            client = self.factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created += 1
+        return client
+
+    def release(self, client, discard=False):
+        with self._cond:
+            if discard:
+                self._close(client)
+                self._size -= 1
+            else:
+                self._idle.append(client)
+            self._cond.notify()
+
+    @contextmanager
+    def client(self):
+        """A client for the with block. One that raised is closed rather
+        than handed to the next thread, it may have lost its connection."""
+        client = self.acquire()
+        discard = True
+        try:
+            yield client
+            discard = False
+        finally:
+            self.release(client, discard)
+
+    @staticmethod
+    def _close(client):
+        try:
+            client._close_connection()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.pop())
+                self._size -= 1
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle),
+                    "created": self.created, "reused": self.reused}
+
+
+def dataset_fingerprint(client):
+    """A hash of the schema and the rows of every table the client sees"""
+    digest = hashlib.sha1()
+    for table_name in sorted(client._get_table_list()):
+        columns, rows = client._execute_query(query="SELECT * FROM {0}".format(table_name))
+        digest.update(repr((table_name, [(column["column_name"], column["type"]) for column in columns])))
+        for row in sorted(repr(tuple(row)) for row in rows):
+            digest.update(row)
+    return digest.hexdigest()
+
+
+class ExpectedResultCache(object):
+    def __init__(self, path, max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results "
+                           "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, used INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        self._clock = self._conn.execute("SELECT COALESCE(MAX(used), 0) FROM results").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(sql, fingerprint, result_format):
+        if isinstance(sql, unicode):
+            sql = sql.encode("utf-8")
+        return hashlib.sha1("\0".join([fingerprint, result_format, sql])).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clock += 1
+            self._conn.execute("UPDATE results SET used = ? WHERE key = ?", (self._clock, key))
+            self._conn.commit()
+        return marshal.loads(zlib.decompress(row[0]))
+
+    def put(self, key, result):
+        try:
+            value = zlib.compress(marshal.dumps(result))
+        except ValueError:
+            # not a plain json-like result, don't cache it
+            return
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self._size -= old[0]
+            self._clock += 1
+            self._conn.execute("INSERT OR REPLACE INTO results (key, value, size, used) VALUES (?, ?, ?, ?)",
+                               (key, sqlite3.Binary(value), len(value), self._clock))
+            self._size += len(value)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self._size <= self.max_bytes:
+            return
+        target = self.max_bytes * _EVICT_RATIO
+        rows = self._conn.execute("SELECT key, size FROM results ORDER BY used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {"results": count, "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+class SQLOracle(object):
+    def __init__(self, pool, cache=None):
+        self.pool = pool
+        self.cache = cache
+        self._fingerprint = None
+        self._lock = Lock()
+
+    def fingerprint(self):
+        # taken on first use, after the test has finished loading data
+        with self._lock:
+            if self._fingerprint is None:
+                with self.pool.client() as client:
+                    self._fingerprint = dataset_fingerprint(client)
+            return self._fingerprint
+
+    def invalidate(self):
+        """To be called after the data changed"""
+        with self._lock:
+            self._fingerprint = None
+
+    def expected_result(self, sql, repeated_columns=False):
+        """The rows of sql as the list of dicts the n1ql results are
+        compared with, converted like _gen_json_from_results(_repeated_columns)"""
+        result_format = "repeated_columns" if repeated_columns else "columns"
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(sql, self.fingerprint(), result_format)
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+        with self.pool.client() as client:
+            columns, rows = client._execute_query(query=sql)
+            if repeated_columns:
+                result = client._gen_json_from_results_repeated_columns(columns, rows)
+            else:
+                result = client._gen_json_from_results(columns, rows)
+        if key is not None:
+            self.cache.put(key, result)
+        return result
+
+    def submit(self, sql, repeated_columns=False):
+        """Runs expected_result in a new thread and returns its Future"""
+        future = Future()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(self.expected_result(sql, repeated_columns))
+            except Exception, ex:
+                future.set_exception(ex)
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def close(self):
+        self.pool.close_all()
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Python based SQLite interface, a local stand-in for the MySQL RQG database
+"""
+import os
+import re
+
+from base_rqg_mysql_client import BaseRQGMySQLClient
+from lib.sqlite_client import SQLiteClient
+
+CREATE_TABLE_RE = re.compile(r"CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(?:`[^`]*`\.)?`(\w+)`\s*\((.*?)\)\s*ENGINE",
+                             re.IGNORECASE | re.DOTALL)
+
+
+class RQGSQLiteClient(SQLiteClient, BaseRQGMySQLClient):
+    """Runs the RQG oracle queries against a SQLite file. The template
+    conversion is shared with the MySQL client, only the schema handling
+    and the database definitions differ."""
+
+    def _get_table_list(self):
+        columns, rows = self._execute_query(query="SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+        return [row[0] for row in rows]
+
+    def _get_databases(self):
+        return [self.database]
+
+    def _get_table_info(self, table_name=""):
+        # the same fields DESCRIBE returns on MySQL
+        columns, rows = self._execute_query(query="PRAGMA table_info(`{0}`)".format(table_name))
+        table_info = []
+        for cid, name, type, notnull, default, pk in rows:
+            table_info.append({"Field": name, "Type": type.lower(),
+                               "Null": "NO" if notnull else "YES",
+                               "Key": "PRI" if pk else "", "Default": default, "Extra": ""})
+        return table_info
+
+    def _translate_table_definitions(self, sqls):
+        statements = []
+        for table_name, body in CREATE_TABLE_RE.findall(sqls):
+            statements.append("CREATE TABLE IF NOT EXISTS `{0}` ({1});".format(table_name, body))
+        return "\n".join(statements)
+
+    def drop_database(self, database):
+        if database == self.database:
+            self._close_connection()
+        path = self._database_path(database)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def reset_database_add_data(self, database="", items=1000, sql_file_definiton_path="/tmp/definition.sql", populate_data=True, number_of_tables=None):
+        self.drop_database(self.database)
+        self.drop_database(database)
+        self.database = database
+        self._set_sqlite_client(self.database)
+        self.database_add_data(database=database, sql_file_definiton_path=sql_file_definiton_path)
+        if number_of_tables is not None:
+            table_list = self._get_table_list()
+            for table_name in table_list[number_of_tables:]:
+                self._db_execute_query("DROP TABLE {0}".format(table_name))
+        if populate_data:
+            self._gen_data_simple_table(number_of_rows=items)
+
+    def database_add_data(self, database="", items=1000, sql_file_definiton_path="/tmp/definition.sql"):
+        sqls = "".join(self._read_from_file(sql_file_definiton_path))
+        self._db_execute_query(self._translate_table_definitions(sqls))
@@ -19,6 +19,7 @@ from membase.api.rest_client import RestConnection
 from security.rbac_base import RbacBase
 # from sdk_client import SDKClient
 from couchbase_helper.tuq_generators import TuqGenerators
+from couchbase_helper.tuq_helper import get_query_connection
 #from xdcr.upgradeXDCR import UpgradeTests
 from couchbase_helper.documentgenerator import JSONNonDocGenerator
 from couchbase.cluster import Cluster
@@ -972,7 +973,7 @@ class QueryTests(BaseTestCase):
             if self.input.tuq_client and "client" in self.input.tuq_client:
                 server = self.tuq_client
         cred_params = {'creds': []}
-        rest = RestConnection(server)
+        rest = get_query_connection(server)
         if username is None and password is None:
             username = rest.username
             password = rest.password
@@ -3406,62 +3406,25 @@ class XDCRNewBaseTest(unittest.TestCase):
         """ Will merge kv_src_bucket keys that match the filter_expression
             if any into kv_dest_bucket.
         """
-        valid_keys_src, deleted_keys_src = kv_src_bucket[
-            kvs_num].key_set()
-        valid_keys_dest, deleted_keys_dest = kv_dest_bucket[
-            kvs_num].key_set()
-
-        self.log.info("src_kvstore has %s valid and %s deleted keys"
-                      % (len(valid_keys_src), len(deleted_keys_src)))
-        self.log.info("dest kvstore has %s valid and %s deleted keys"
-                      % (len(valid_keys_dest), len(deleted_keys_dest)))
-
+        key_filter = None
         if filter_exp:
             # If key based adv filter
             if "META().id" in filter_exp:
                 filter_exp = filter_exp.split('\'')[1]
+            key_filter = re.compile(str(filter_exp))
 
-            filtered_src_keys = filter(
-                lambda key: re.search(str(filter_exp), key) is not None,
-                valid_keys_src
-            )
-            valid_keys_src = filtered_src_keys
+        # In case of lww, keys with a lower timestamp on source than on
+        # destination are not set or deleted.
+        stats = kv_dest_bucket[kvs_num].merge_from(
+            kv_src_bucket[kvs_num], key_filter=key_filter, lww=self.__lww)
+        self.log.info("src_kvstore has %s valid keys" % stats["valid"])
+        if filter_exp:
             self.log.info(
                 "{0} keys matched the filter expression {1}".format(
-                    len(valid_keys_src),
+                    stats["matched"],
                     filter_exp))
-
-        for key in valid_keys_src:
-            # replace/add the values for each key in src kvs
-            if key not in deleted_keys_dest:
-                partition1 = kv_src_bucket[kvs_num].acquire_partition(key)
-                partition2 = kv_dest_bucket[kvs_num].acquire_partition(key)
-                # In case of lww, if source's key timestamp is lower than
-                # destination than no need to set.
-                if self.__lww and partition1.get_timestamp(
-                        key) < partition2.get_timestamp(key):
-                    continue
-                key_add = partition1.get_key(key)
-                partition2.set(
-                    key,
-                    key_add["value"],
-                    key_add["expires"],
-                    key_add["flag"])
-                kv_src_bucket[kvs_num].release_partition(key)
-                kv_dest_bucket[kvs_num].release_partition(key)
-
-        for key in deleted_keys_src:
-            if key not in deleted_keys_dest:
-                partition1 = kv_src_bucket[kvs_num].acquire_partition(key)
-                partition2 = kv_dest_bucket[kvs_num].acquire_partition(key)
-                # In case of lww, if source's key timestamp is lower than
-                # destination than no need to delete.
-                if self.__lww and partition1.get_timestamp(
-                        key) < partition2.get_timestamp(key):
-                    continue
-                partition2.delete(key)
-                kv_src_bucket[kvs_num].release_partition(key)
-                kv_dest_bucket[kvs_num].release_partition(key)
+        self.log.info("merged %s keys set and %s keys deleted into dest kvstore"
+                      % (stats["set"], stats["deleted"]))
 
         valid_keys_dest, deleted_keys_dest = kv_dest_bucket[
             kvs_num].key_set()
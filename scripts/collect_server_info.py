@@ -2,8 +2,6 @@
 import getopt
 import sys
 import os
-import time
-from threading import Thread
 from datetime import datetime
 import subprocess
 import platform
@@ -142,25 +140,12 @@ def main():
 
     if not local:
         file_path = input.param("path", ".")
-        remotes = (cbcollectRunner(server, file_path, local) for server in input.servers)
-
-        remote_threads = [Thread(target=remote.run()) for remote in remotes]
-        for remote_thread in remote_threads:
-            remote_thread.daemon = True
-            remote_thread.start()
-            run_time = 0
-            while remote_thread.isAlive() and run_time < 1200:
-                time.sleep(15)
-                run_time += 15
-                print "Waiting for another 15 seconds (time-out after 20 min)"
-            if run_time == 1200:
-                print "cbcollect_info hung on this node. Jumping to next node"
-            print "collect info done"
-
-        for remote_thread in remote_threads:
-            remote_thread.join(120)
-            if remote_thread.isAlive():
-                raise Exception("cbcollect_info hung on remote node")
+        from lib.remote.remote_util import RemoteClusterExecutor
+        # collect from all nodes at once, giving each node up to 20 min
+        executor = RemoteClusterExecutor(input.servers, timeout=1200)
+        results = executor.run(lambda shell, server: cbcollectRunner(server, file_path, local).run())
+        print "collect info done"
+        results.raise_on_failure("cbcollect_info failed")
     else:
         file_name = "%s-%s-diag.zip" % ("local", time_stamp())
         cbcollect_command = WIN_COUCHBASE_BIN_PATH_RAW + "cbcollect_info.exe"
@@ -3,11 +3,10 @@ import getopt
 import sys
 import os
 import time
-from threading import Thread
 
 sys.path.append('.')
 sys.path.append('lib')
-from remote.remote_util import RemoteMachineShellConnection
+from remote.remote_util import RemoteMachineShellConnection, RemoteClusterExecutor
 
 from TestInput import TestInputParser
 
@@ -164,25 +163,15 @@ def main():
         usage("ERROR: " + str(error))
 
     file_path = input.param("path", ".")
-    remotes = (Getcoredumps(server, file_path) for server in input.servers)
-    remote_threads = [Thread(target=remote.run) for remote in remotes]
-
-    for remote_thread in remote_threads:
-        remote_thread.daemon = True
-        remote_thread.start()
-        run_time = 0
-        while remote_thread.isAlive() and run_time < 1200:
-            time.sleep(15)
-            run_time += 15
-            print "Waiting for another 15 seconds (time-out after 20 min)"
-        if run_time == 1200:
-            print "collect core dumps hung on this node. Jumping to next node"
-        print "collect core dumps info done"
-
-    for remote_thread in remote_threads:
-        remote_thread.join(120)
-        if remote_thread.isAlive():
-            raise Exception("collect core dumps hung on remote node")
+    # collect from all nodes at once, giving each node up to 20 min
+    executor = RemoteClusterExecutor(input.servers, timeout=1200)
+    results = executor.run(lambda shell, server: Getcoredumps(server, file_path).run())
+    hung = sorted(node for node, result in results.iteritems() if result.timed_out)
+    for node in hung:
+        print "collect core dumps hung on {0}".format(node)
+    print "collect core dumps info done"
+    if hung:
+        raise Exception("collect core dumps hung on remote node")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
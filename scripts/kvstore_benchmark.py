@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Compare memory use and throughput of KVStore and CompactKVStore, or with
+-m the time KVStore.merge_from takes to merge two stores.
+
+Results on a 6 GB, single core VM with python 2.7.18:
+
+store            keys     rss MB    B/key       sets/s       gets/s  key_set s
+dict          1000000      489.8    513.5       186556       268849       0.42
+compact       1000000      164.8    172.8       106724       194311       0.26
+dict         10000000     5462.1    572.7       187130       254998       7.80
+compact      10000000     2017.2    211.5        93093       164072       2.40
+compact      20000000     3468.3    181.8        95005       178122       4.77
+
+The dict store does not fit in 6 GB at 20M keys.
+"""
+
+import getopt
+import os
+import subprocess
+import sys
+import time
+import zlib
+
+sys.path.append('.')
+sys.path.append('lib')
+
+
+def usage(err=None):
+    err_code = 0
+    if err:
+        err_code = 1
+        print "Error:", err
+        print
+    print "./scripts/kvstore_benchmark.py [-n <keys>[,<keys>...]] [-s <store>[,<store>...]] [-m]"
+    print ""
+    print " keys               number of keys to track, default 10000000,50000000,100000000"
+    print " store              dict and/or compact, default both"
+    print " -m                 merge a source store into a destination store the way"
+    print "                    the xdcr tests do, default keys 1000000,10000000"
+    print ""
+    print "./scripts/kvstore_benchmark.py -n 1000000,10000000 -s compact"
+    sys.exit(err_code)
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_one(store_type, num_keys):
+    """Fills one store the way the loaders do and prints a result line."""
+    from memcached.helper.kvstore import KVStore, CompactKVStore
+    store = CompactKVStore() if store_type == "compact" else KVStore()
+    base = rss_mb()
+
+    start = time.time()
+    for i in xrange(num_keys):
+        key = "key-%d" % i
+        partition = store.acquire_partition(key)
+        partition.set(key, str(zlib.crc32(key) & 0x7fff))
+        store.release_partition(key)
+    set_rate = num_keys / (time.time() - start)
+    mem = rss_mb() - base
+
+    reads = min(num_keys, 1000000)
+    start = time.time()
+    for i in xrange(reads):
+        key = "key-%d" % i
+        partition = store.acquire_partition(key)
+        partition.get_valid(key)
+        store.release_partition(key)
+    get_rate = reads / (time.time() - start)
+
+    start = time.time()
+    valid_keys, deleted_keys = store.key_set()
+    key_set_time = time.time() - start
+
+    print "%-8s %12d %10.1f %8.1f %12.0f %12.0f %10.2f" % (
+        store_type, num_keys, mem, mem * 1024 * 1024 / num_keys,
+        set_rate, get_rate, key_set_time)
+    sys.stdout.flush()
+
+
+def fill(store, num_keys, offset=0):
+    for itr in xrange(store.num_locks):
+        store.cache[itr]["lock"].acquire()
+    for i in xrange(offset, offset + num_keys):
+        key = "key-%d" % i
+        store.cache[store._hash(key)]["partition"].set(key, str(zlib.crc32(key) & 0x7fff))
+    for itr in xrange(store.num_locks):
+        store.cache[itr]["lock"].release()
+
+
+def run_merge(store_type, num_keys):
+    """Merges a source store into a destination store that shares half its
+    keys, with a tenth of the keys deleted on each side, and prints a result line."""
+    import re
+    from memcached.helper.kvstore import KVStore, CompactKVStore
+    store_class = CompactKVStore if store_type == "compact" else KVStore
+    src, dest = store_class(), store_class()
+    fill(src, num_keys)
+    fill(dest, num_keys, offset=num_keys / 2)
+    for store, start in [(src, 0), (dest, num_keys / 2 + 5)]:
+        for i in xrange(start, start + num_keys, 10):
+            key = "key-%d" % i
+            store.acquire_partition(key).delete(key)
+            store.release_partition(key)
+
+    start = time.time()
+    stats = dest.merge_from(src)
+    merge_time = time.time() - start
+    start = time.time()
+    dest.merge_from(src, key_filter=re.compile("1$"), lww=True)
+    filtered_time = time.time() - start
+
+    print "%-8s %12d %10d %10d %10.2f %12.2f" % (
+        store_type, num_keys, stats["set"], stats["deleted"], merge_time, filtered_time)
+    sys.stdout.flush()
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:s:m", ["run-one=", "run-merge="])
+    except getopt.GetoptError, err:
+        usage(err)
+
+    key_counts = None
+    stores = ["dict", "compact"]
+    merge = False
+    for o, a in opts:
+        if o == "-h":
+            usage()
+        elif o == "-m":
+            merge = True
+        elif o == "-n":
+            key_counts = [int(n) for n in a.split(",")]
+        elif o == "-s":
+            stores = a.split(",")
+        elif o == "--run-one":
+            store_type, num_keys = a.split(":")
+            run_one(store_type, int(num_keys))
+            return
+        elif o == "--run-merge":
+            store_type, num_keys = a.split(":")
+            run_merge(store_type, int(num_keys))
+            return
+
+    if merge:
+        key_counts = key_counts or [1000000, 10000000]
+        print "%-8s %12s %10s %10s %10s %12s" % (
+            "store", "keys", "set", "deleted", "merge s", "filtered s")
+        run = "--run-merge"
+    else:
+        key_counts = key_counts or [10000000, 50000000, 100000000]
+        print "%-8s %12s %10s %8s %12s %12s %10s" % (
+            "store", "keys", "rss MB", "B/key", "sets/s", "gets/s", "key_set s")
+        run = "--run-one"
+    for num_keys in key_counts:
+        for store_type in stores:
+            # a fresh process per run so each one starts from a clean heap
+            rv = subprocess.call([sys.executable, os.path.abspath(__file__),
+                                  "%s=%s:%d" % (run, store_type, num_keys)])
+            if rv != 0:
+                print "%-8s %12d failed with exit code %d (out of memory?)" % (store_type, num_keys, rv)
+
+
+if __name__ == "__main__":
+    main()